@@ -1,42 +1,116 @@
 import argparse
+import cProfile
 from logging import INFO, FileHandler, Formatter, getLogger, StreamHandler, DEBUG
+from logging.handlers import QueueHandler, QueueListener
+import queue
+from typing import Tuple
 
 from . import NAME_LOGER
 from .argparse import ThrowingArgumentParser
-from .addgglloc import AddGglLoc, AddGglLocException, DEFAULT_DIR_JPEG_INPUT, DEFAULT_DIR_GOOGLE_LOCATION_LOG, DEFAULT_DIR_OUTPUT, DEFAULT_TOLERANCE_SEC
+from .shard import parseShard
+from .addgglloc import AddGglLoc, AddGglLocException, DEFAULT_DIR_JPEG_INPUT, DEFAULT_DIR_GOOGLE_LOCATION_LOG, DEFAULT_DIR_OUTPUT, DEFAULT_TOLERANCE_SEC, DEFAULT_WORKERS, DEFAULT_EXECUTOR, EXECUTOR_TYPES, DEFAULT_LOAD_WORKERS, DEFAULT_MANIFEST_NAME, DEFAULT_PROGRESS_INTERVAL_SEC, DEFAULT_WATCH_SETTLE_SEC, DEFAULT_WATCH_INTERVAL_SEC, DEFAULT_SIDECAR_NAMING, SIDECAR_NAMINGS, DEFAULT_MATCH_STRATEGY, DEFAULT_RAW_MAX_ACCURACY_M, DEFAULT_RAW_DUPLICATE_DISTANCE_M, DEFAULT_RAW_STAY_RADIUS_M, DEFAULT_RAW_STAY_MIN_SEC
+from .location_matcher import MATCH_STRATEGIES
+
+DEFAULT_LOG_FILE = "addgglloc.log"
+""" ログファイルのデフォルト値 """
 
 logger = getLogger(NAME_LOGER)
 logger.setLevel(INFO)
 
 def _main() -> None:
     """メイン関数"""
+    args = _parseArgs()
+    listener = _initLogger(args.log_file)
     try:
-        _initLogger()
         logger.info("[START] addgglloc")
-        args = _parseArgs()
         logger.info(f"args:{vars(args)}")
 
         addgglloc = AddGglLoc()
         addgglloc.googleLocationLogDir = args.google
         addgglloc.jpegInputDir = args.jpeg
         addgglloc.outputDir = args.output
-        addgglloc.execute()
+        addgglloc.matchStrategy = args.match_strategy
+        addgglloc.rawMaxAccuracyM = args.raw_max_accuracy
+        addgglloc.rawDuplicateDistanceM = args.raw_duplicate_distance
+        addgglloc.rawStayRadiusM = args.raw_stay_radius
+        addgglloc.rawStayMinSec = args.raw_stay_min
+        addgglloc.workers = args.workers
+        addgglloc.executor = args.executor
+        addgglloc.loadWorkers = args.load_workers
+        addgglloc.cachePath = args.cache
+        addgglloc.rebuildCache = args.rebuild_cache
+        addgglloc.lazyLoad = args.lazy_load
+        addgglloc.manifestPath = args.manifest
+        addgglloc.resume = args.resume
+        addgglloc.statsPath = args.stats
+        addgglloc.inPlace = args.in_place
+        addgglloc.undoJournalPath = args.undo_journal
+        addgglloc.sidecar = args.sidecar
+        addgglloc.sidecarNaming = args.sidecar_naming
+        addgglloc.compact = args.compact
+        addgglloc.progressIntervalSec = args.progress_interval
+        addgglloc.resultsPath = args.results
+        addgglloc.watchSettleSec = args.watch_settle
+        addgglloc.watchIntervalSec = args.watch_interval
+        addgglloc.shardIndex, addgglloc.shardCount = args.shard
+
+        if args.merge_manifests is not None:
+            addgglloc.mergeManifests(args.merge_manifests)
+            return
+        if args.build_cache:
+            addgglloc.buildCache()
+            return
+
+        if args.rollback:
+            addgglloc.rollback()
+            return
+        if args.plan is not None:
+            addgglloc.planPath = args.plan
+        elif args.apply is not None:
+            addgglloc.planPath = args.apply
+
+        profiler = None if args.profile is None else cProfile.Profile()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            if args.plan is not None:
+                addgglloc.plan()
+            elif args.apply is not None:
+                addgglloc.apply()
+            elif args.watch:
+                addgglloc.watch()
+            else:
+                addgglloc.execute()
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(args.profile)
+                logger.info(f"プロファイル結果を書き出しました:'{args.profile}'")
     except AddGglLocException as e:
         logger.error(f"[ABORT] {e.message}")
     finally:
         logger.info("[END] addgglloc")
+        listener.stop()
+
+def _initLogger(logFile: str) -> QueueListener:
+    """ ロガーを初期化し、出力を担うQueueListenerを開始して返す
 
-def _initLogger():
+    ログの書式化と出力は別スレッドで行い、処理中のスレッドはキューに入れるだけにする。
+    """
     global logger
     sHandler = StreamHandler()
     sHandler.setLevel(INFO)
     sHandler.setFormatter(Formatter("[%(levelname)7s]\t%(message)s"))
-    logger.addHandler(sHandler)
 
-    fHandler = FileHandler("addgglloc.log", encoding="utf-8")
+    fHandler = FileHandler(logFile, encoding="utf-8")
     fHandler.setLevel(DEBUG)
     fHandler.setFormatter(Formatter("%(asctime)s\t[%(levelname)7s]\t%(message)s"))
-    logger.addHandler(fHandler)
+
+    logQueue: "queue.SimpleQueue" = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(logQueue))
+    listener = QueueListener(logQueue, sHandler, fHandler, respect_handler_level=True)
+    listener.start()
+    return listener
 
 def _parseArgs() -> argparse.Namespace:
     """ コマンドラインパラメータを解析 """
@@ -54,8 +128,126 @@ def _parseArgs() -> argparse.Namespace:
                         metavar="path",
                         default=DEFAULT_DIR_OUTPUT,
                         help=f"ここで指定されたディレクトリ配下に、処理済みのJPEGが格納されます。 デフォルト値：\"{DEFAULT_DIR_OUTPUT}\"")
+    parser.add_argument("--match-strategy", type=str,
+                        choices=MATCH_STRATEGIES,
+                        default=DEFAULT_MATCH_STRATEGY,
+                        help=f"撮影時間と位置情報を照合する方法です。nearestは前後の位置情報と滞在のうち時間が最も近いもの、interpolateは滞在中でなければ前後の位置情報の間を線形補間した位置、visit-preferredは近くに滞在があればそれを優先します。 デフォルト値：\"{DEFAULT_MATCH_STRATEGY}\"")
+    parser.add_argument("--raw-max-accuracy", type=int,
+                        metavar="M",
+                        default=DEFAULT_RAW_MAX_ACCURACY_M,
+                        help=f"生のロケーション履歴（Records.json）を読み込むとき、精度がMメートルより悪い点を捨てます。0なら捨てません。 デフォルト値：{DEFAULT_RAW_MAX_ACCURACY_M}")
+    parser.add_argument("--raw-duplicate-distance", type=int,
+                        metavar="M",
+                        default=DEFAULT_RAW_DUPLICATE_DISTANCE_M,
+                        help=f"生のロケーション履歴を読み込むとき、直前に残した点からMメートル以内の点を重複として捨てます。0なら捨てません。 デフォルト値：{DEFAULT_RAW_DUPLICATE_DISTANCE_M}")
+    parser.add_argument("--raw-stay-radius", type=int,
+                        metavar="M",
+                        default=DEFAULT_RAW_STAY_RADIUS_M,
+                        help=f"生のロケーション履歴を読み込むとき、半径Mメートル以内に留まり続けた点を1件の滞在にまとめます。0ならまとめません。 デフォルト値：{DEFAULT_RAW_STAY_RADIUS_M}")
+    parser.add_argument("--raw-stay-min", type=int,
+                        metavar="SEC",
+                        default=DEFAULT_RAW_STAY_MIN_SEC,
+                        help=f"生のロケーション履歴の点を滞在にまとめる最短の時間（秒）です。0ならまとめません。 デフォルト値：{DEFAULT_RAW_STAY_MIN_SEC}")
+    parser.add_argument("-w", "--workers", type=int,
+                        metavar="N",
+                        default=DEFAULT_WORKERS,
+                        help=f"JPEGファイルをN並列で処理します。 デフォルト値：{DEFAULT_WORKERS}")
+    parser.add_argument("--executor", type=str,
+                        choices=EXECUTOR_TYPES,
+                        default=DEFAULT_EXECUTOR,
+                        help=f"並列処理の方式です。threadはI/O待ちが多い場合、processはCPU負荷が高い場合に向いています。 デフォルト値：\"{DEFAULT_EXECUTOR}\"")
+    parser.add_argument("--load-workers", type=int,
+                        metavar="N",
+                        default=DEFAULT_LOAD_WORKERS,
+                        help=f"ロケーション履歴ファイルをNプロセスで並列に読み込みます。 デフォルト値：{DEFAULT_LOAD_WORKERS}")
+    parser.add_argument("--cache", type=str,
+                        metavar="path",
+                        default=None,
+                        help="解析済みのロケーション履歴をこのファイルにキャッシュし、次回以降は変更のあったJSONファイルだけを読み込みます。")
+    parser.add_argument("--rebuild-cache", action="store_true",
+                        help="既存のキャッシュを使わず、すべてのJSONファイルを読み込み直してキャッシュを作り直します。")
+    parser.add_argument("--lazy-load", action="store_true",
+                        help="先にJPEGファイルの撮影日時を調べ、その前後に期間が重なるロケーション履歴ファイルだけを読み込みます。期間は--cacheの内容か、YYYY_MONTH.jsonというファイル名から判断します。一部の写真だけを処理するときに速くなります。--watchでは無視します。")
+    parser.add_argument("--manifest", type=str,
+                        metavar="path",
+                        default=None,
+                        help=f"各JPEGファイルの処理結果をこのファイル(SQLite)に記録します。 --resume指定時のデフォルト値：出力先ディレクトリの\"{DEFAULT_MANIFEST_NAME}\"")
+    parser.add_argument("--resume", action="store_true",
+                        help="マニフェストに処理済みと記録されていて、前回から変更のないJPEGファイルを読み飛ばします。中断した処理の再開に使います。")
+    parser.add_argument("--in-place", action="store_true",
+                        help="出力先ディレクトリに書き出さず、元のJPEGファイルを直接書き換えます。同じディレクトリの一時ファイルに書き出してから置き換えます。")
+    parser.add_argument("--undo-journal", type=str,
+                        metavar="path",
+                        default=None,
+                        help="--in-place指定時に、書き換える前のExifをこのファイル(SQLite)に記録します。--rollbackで元に戻せます。")
+    parser.add_argument("--sidecar", action="store_true",
+                        help="JPEGファイルは書き出さず、位置情報（座標、タイムスタンプ、場所の名称）をXMPサイドカーファイルに書き出します。出力先ディレクトリの同じ相対パスに、--in-place指定時は元のファイルの隣に書き出します。既存のサイドカーファイルは上書きしません。")
+    parser.add_argument("--sidecar-naming", type=str,
+                        choices=SIDECAR_NAMINGS,
+                        default=DEFAULT_SIDECAR_NAMING,
+                        help=f"サイドカーファイルの名前の付け方です。replaceはIMG_0001.xmp（Lightroomなど）、appendはIMG_0001.jpg.xmp（darktableなど）になります。 デフォルト値：\"{DEFAULT_SIDECAR_NAMING}\"")
+    parser.add_argument("--rollback", action="store_true",
+                        help="--undo-journalに記録した内容で、書き換えたJPEGファイルを元に戻して終了します。")
+    parser.add_argument("--shard", type=_shardArg,
+                        metavar="K/N",
+                        default=(0, 1),
+                        help="JPEGファイルを--jpegからの相対パスのハッシュ値でN個に分割し、K番目（1〜N）だけを処理します。複数のマシンで分担するときに使います。マニフェストなどの出力ファイル名には分割ごとに\".shardKofN\"を付け、キャッシュファイルは更新しません。")
+    parser.add_argument("--build-cache", action="store_true",
+                        help="ロケーション履歴を読み込んで--cacheのキャッシュファイルを作成・更新して終了します。--shardで分担する前に1度実行しておきます。")
+    parser.add_argument("--merge-manifests", type=str,
+                        metavar="path",
+                        nargs="+",
+                        default=None,
+                        help=f"分割して処理したときのマニフェストを1つにまとめ、処理結果の内訳を表示して終了します。まとめ先は--manifest（省略時は出力先ディレクトリの\"{DEFAULT_MANIFEST_NAME}\"）です。")
+    parser.add_argument("--plan", type=str,
+                        metavar="path",
+                        default=None,
+                        help="JPEGファイルを書き換えずに位置情報を照合し、ファイルごとの処理予定をこのファイルに書き出して終了します。画像データは読まないので、結果の確認にも使えます。")
+    parser.add_argument("--apply", type=str,
+                        metavar="path",
+                        default=None,
+                        help="--planで書き出した計画ファイルのとおりに位置情報を付与します。ロケーション履歴は読み込まず、ディレクトリ、iノード番号の順に書き込みます。")
+    parser.add_argument("--watch", action="store_true",
+                        help="既存のJPEGファイルを処理した後も終了せず、JPEGファイルの追加・変更を監視して処理し続けます。JSONファイルが追加・変更されたらロケーション履歴を読み込み直します。--cacheと併用すると読み込み直しが速くなります。Ctrl+Cで終了します。")
+    parser.add_argument("--watch-settle", type=float,
+                        metavar="SEC",
+                        default=DEFAULT_WATCH_SETTLE_SEC,
+                        help=f"--watch指定時に、ファイルの変化が止まってから処理するまでの待ち時間（秒）です。 デフォルト値：{DEFAULT_WATCH_SETTLE_SEC}")
+    parser.add_argument("--watch-interval", type=float,
+                        metavar="SEC",
+                        default=DEFAULT_WATCH_INTERVAL_SEC,
+                        help=f"--watch指定時に、inotifyが使えない環境でディレクトリを走査する間隔（秒）です。 デフォルト値：{DEFAULT_WATCH_INTERVAL_SEC}")
+    parser.add_argument("--log-file", type=str,
+                        metavar="path",
+                        default=DEFAULT_LOG_FILE,
+                        help=f"ログファイルのパスです。 デフォルト値：\"{DEFAULT_LOG_FILE}\"")
+    parser.add_argument("--compact", action="store_true",
+                        help="ファイルごとのログはエラーと警告だけにし、代わりに処理速度と残り時間の見込みを一定間隔で表示します。")
+    parser.add_argument("--progress-interval", type=float,
+                        metavar="SEC",
+                        default=DEFAULT_PROGRESS_INTERVAL_SEC,
+                        help=f"--compact指定時に進捗を表示する間隔（秒）です。 デフォルト値：{DEFAULT_PROGRESS_INTERVAL_SEC}")
+    parser.add_argument("--results", type=str,
+                        metavar="path",
+                        default=None,
+                        help="ファイルごとの処理結果（パス、処理結果、付与した位置情報など）を、1行1件のJSONでこのファイルに書き出します。")
+    parser.add_argument("--stats", type=str,
+                        metavar="path",
+                        default=None,
+                        help="段階ごとの処理時間（回数、合計、ヒストグラム）、読み書きしたバイト数、処理結果の内訳をこのファイル(JSON)に書き出します。")
+    parser.add_argument("--profile", type=str,
+                        metavar="path",
+                        default=None,
+                        help="実行全体をcProfileで計測し、結果をこのファイルに書き出します（python -m pstatsで参照できます）。--executor processのワーカー内の処理は含みません。")
     args = parser.parse_args()
     return args
 
+def _shardArg(text: str) -> Tuple[int, int]:
+    """ --shardの値を解析 """
+    try:
+        return parseShard(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"K/N（1≦K≦N）の形式で指定してください:'{text}'")
+
 if __name__ == "__main__":
     _main()
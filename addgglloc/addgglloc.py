@@ -1,16 +1,39 @@
 
+from bisect import bisect_left
+from collections import deque
+import contextlib
+import itertools
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from logging import getLogger
+import json
+from logging import DEBUG, getLogger
 import os
 from pathlib import Path
-from typing import Any, Dict, List, Literal, Optional, cast
+import shutil
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Literal, Optional, Sequence, Set, TextIO, Tuple, cast
 import dataclasses
 import re
+import time
 
 import piexif
 
 from . import NAME_LOGER
 from .location_log import LocationLog
+from .location_index import LocationIndex, LocationIndexBuilder, NameTable, datetimeToMs, msToDatetime
+from .location_matcher import LocationMatch, LocationMatcher
+from .location_cache import CacheEntry, LocationLogCache
+from .raw_location_filter import RawLocationFilter
+from .jpeg_file import JpegFile, inPlaceTempPath, spliceFile
+from .exif_gps import insertGpsIfd
+from .exif_scan import ExifScanResult, scanExif, scanTiff
+from .file_walker import BackgroundIterator, walkFiles
+from .manifest import ProcessManifest
+from .stats import RunStats, StageTimer
+from .plan import PLANNED_STATUS, InvalidPlanException, PlanEntry, PlanReader, PlanWriter
+from .shard import shardOf, shardPath
+from .undo_journal import UndoJournal
+from .xmp_sidecar import buildXmp, sidecarPath, writeSidecar
+from .watcher import createWatcher
 from .google_location_log_loader import GoogleLocationLogLoader, InvalidFileFormatException
 
 
@@ -26,9 +49,82 @@ DEFAULT_DIR_OUTPUT = "./output"
 DEFAULT_TOLERANCE_SEC = 5 * 60
 """ 撮影時間と位置情報のタイムスタンプがこれ以下の値ならその位置情報を採用するデフォルト値 """
 
+DEFAULT_MATCH_STRATEGY = "nearest"
+""" 撮影時間と位置情報を照合する方法のデフォルト値（指定可能な値はMATCH_STRATEGIES） """
+
+DEFAULT_RAW_MAX_ACCURACY_M = 200
+""" 生のロケーション履歴（Records.json）で、精度がこれより悪い点を捨てるデフォルト値（メートル） """
+
+DEFAULT_RAW_DUPLICATE_DISTANCE_M = 10
+""" 生のロケーション履歴で、直前に残した点からこの距離以内の点を捨てるデフォルト値（メートル） """
+
+DEFAULT_RAW_STAY_RADIUS_M = 50
+""" 生のロケーション履歴で、この半径に留まり続けた点を1件の滞在にまとめるデフォルト値（メートル） """
+
+DEFAULT_RAW_STAY_MIN_SEC = 10 * 60
+""" 生のロケーション履歴で、滞在にまとめる最短の時間のデフォルト値（秒） """
+
+DEFAULT_WORKERS = 1
+""" JPEGファイルを並列に処理するワーカー数のデフォルト値（1なら逐次処理） """
+
+DEFAULT_EXECUTOR = "thread"
+""" 並列処理の方式のデフォルト値 """
+
+EXECUTOR_TYPES = ("thread", "process")
+""" 指定可能な並列処理の方式 """
+
+DEFAULT_LOAD_WORKERS = 1
+""" ロケーション履歴ファイルを並列に読み込むワーカー数のデフォルト値（1なら逐次読み込み） """
+
+DEFAULT_MANIFEST_NAME = ".addgglloc-manifest.sqlite"
+""" 処理結果を記録するマニフェストのデフォルトのファイル名（出力先ディレクトリに作成） """
+
+DEFAULT_PROGRESS_INTERVAL_SEC = 10
+""" 簡易表示のときに進捗を出力する間隔（秒）のデフォルト値 """
+
+DEFAULT_SIDECAR_NAMING = "replace"
+""" XMPサイドカーファイルの名前の付け方のデフォルト値 """
+
+SIDECAR_NAMINGS = ("replace", "append")
+""" 指定可能なXMPサイドカーファイルの名前の付け方（拡張子を置き換える、拡張子の後に付け加える） """
+
+DEFAULT_WATCH_SETTLE_SEC = 2
+""" 監視中に、ファイルの変化が止まってから処理するまでの待ち時間（秒）のデフォルト値 """
+
+DEFAULT_WATCH_INTERVAL_SEC = 5
+""" inotifyが使えず、定期的に走査して監視するときの間隔（秒）のデフォルト値 """
+
 
 logger = getLogger(NAME_LOGER)
 
+_JPEG_EXTENSIONS = (".jpg", ".jpeg")
+""" JPEGファイルとみなす拡張子 """
+
+_DISCOVERY_QUEUE_SIZE = 10000
+""" 見つけたJPEGファイルのうち、処理を待たせておく数の上限 """
+
+_APPLY_CHUNK_SIZE = 1000
+""" 計画を適用するときに、まとめて読み込んで書き込む順に並べ替えるファイル数 """
+
+_EXIF_HEADER = b"Exif\x00\x00"
+""" ExifのAPP1セグメントでTIFF構造の前に置く識別子 """
+
+_MONTH_NAMES = (
+    "JANUARY", "FEBRUARY", "MARCH", "APRIL", "MAY", "JUNE",
+    "JULY", "AUGUST", "SEPTEMBER", "OCTOBER", "NOVEMBER", "DECEMBER",
+)
+""" Googleのロケーション履歴の月ごとのファイル名（YYYY_MONTH.json）に使われる月の名前 """
+
+_MONTHLY_FILE_PATTERN = re.compile(r"^(\d{4})_([A-Z]+)\.json$", re.IGNORECASE)
+""" 月ごとのロケーション履歴のファイル名 """
+
+_MONTHLY_FILE_MARGIN = timedelta(days=1)
+""" 月ごとのファイルがどのタイムゾーンの月で区切られていてもよいように、範囲の前後に加える余裕 """
+
+_MSG_HAS_LOCATION = "ロケーション情報がすでに存在します。"
+_MSG_NOT_MATCHED = "どのロケージョン履歴ともマッチしませんでした。"
+_MSG_HAS_SIDECAR = "XMPサイドカーファイルがすでに存在します。"
+
 
 @dataclasses.dataclass
 class AddGglLoc(object):
@@ -47,157 +143,1094 @@ class AddGglLoc(object):
     # 撮影時間と位置情報を紐付ける時間の範囲（秒）。タイムスタンプの差がこれ以下の値ならその位置情報を採用します
     toleranceSec: int = dataclasses.field(default=DEFAULT_TOLERANCE_SEC)
 
+    # 撮影時間と位置情報を照合する方法（nearest、interpolate、visit-preferred）。
+    matchStrategy: str = dataclasses.field(default=DEFAULT_MATCH_STRATEGY)
+
+    # 生のロケーション履歴（Records.jsonのlocations）で、精度がこれより悪い点を捨てる（メートル）。0なら捨てません。
+    rawMaxAccuracyM: int = dataclasses.field(default=DEFAULT_RAW_MAX_ACCURACY_M)
+
+    # 生のロケーション履歴で、直前に残した点からこの距離以内の点を重複として捨てる（メートル）。0なら捨てません。
+    rawDuplicateDistanceM: int = dataclasses.field(default=DEFAULT_RAW_DUPLICATE_DISTANCE_M)
+
+    # 生のロケーション履歴で、この半径に留まり続けた点を1件の滞在にまとめる（メートル）。0ならまとめません。
+    rawStayRadiusM: int = dataclasses.field(default=DEFAULT_RAW_STAY_RADIUS_M)
+
+    # 生のロケーション履歴で、滞在にまとめる最短の時間（秒）。0ならまとめません。
+    rawStayMinSec: int = dataclasses.field(default=DEFAULT_RAW_STAY_MIN_SEC)
+
+    # JPEGファイルを並列に処理するワーカー数。1以下なら逐次処理します。
+    workers: int = dataclasses.field(default=DEFAULT_WORKERS)
+
+    # 並列処理の方式。I/O待ちが主ならthread、CPU負荷が主ならprocessを指定します。
+    executor: Literal["thread", "process"] = \
+        dataclasses.field(default=DEFAULT_EXECUTOR)
+
+    # ロケーション履歴ファイルを並列に読み込むワーカープロセス数。1以下なら逐次読み込みます。
+    loadWorkers: int = dataclasses.field(default=DEFAULT_LOAD_WORKERS)
+
+    # 解析済みのロケーション履歴を保存するキャッシュファイル。Noneならキャッシュしません。
+    cachePath: Optional[str] = dataclasses.field(default=None)
+
+    # Trueなら既存のキャッシュを使わず、すべてのロケーション履歴ファイルを読み込み直します。
+    rebuildCache: bool = dataclasses.field(default=False)
+
+    # 処理結果を記録するマニフェストファイル。Noneなら`resume`のときだけ出力先ディレクトリに作成します。
+    manifestPath: Optional[str] = dataclasses.field(default=None)
+
+    # Trueならマニフェストに処理済みと記録されていて、前回から変わっていないファイルを読み飛ばします。
+    resume: bool = dataclasses.field(default=False)
+
+    # Trueならファイルごとのログ（エラーと警告を除く）をDEBUGレベルにし、代わりに一定間隔で進捗を出力します。
+    compact: bool = dataclasses.field(default=False)
+
+    # `compact`のときに進捗を出力する間隔（秒）。
+    progressIntervalSec: float = dataclasses.field(default=DEFAULT_PROGRESS_INTERVAL_SEC)
+
+    # ファイルごとの処理結果を1行1件のJSONで書き出すファイル。Noneなら書き出しません。
+    resultsPath: Optional[str] = dataclasses.field(default=None)
+
+    # Trueなら先にJPEGファイルの撮影日時を調べ、その前後（`toleranceSec`）を含むロケーション履歴ファイルだけを読み込みます。
+    # ファイルの期間はキャッシュ、またはYYYY_MONTH.jsonというファイル名から判断し、分からないファイルは読み込みます。
+    lazyLoad: bool = dataclasses.field(default=False)
+
+    # 段階ごとの処理時間などの統計を書き出すJSONファイル。Noneなら書き出しません。
+    statsPath: Optional[str] = dataclasses.field(default=None)
+
+    # Trueなら出力先ディレクトリに書き出さず、元のファイルを直接書き換えます。
+    inPlace: bool = dataclasses.field(default=False)
+
+    # Trueなら画像は書き出さず、位置情報をXMPのサイドカーファイルに書き出します。
+    # `inPlace`なら元のファイルの隣に、そうでなければ出力先ディレクトリの同じ相対パスに書き出します。
+    sidecar: bool = dataclasses.field(default=False)
+
+    # サイドカーファイルの名前の付け方。replaceならIMG_0001.xmp、appendならIMG_0001.jpg.xmpにします。
+    sidecarNaming: Literal["replace", "append"] = dataclasses.field(default=DEFAULT_SIDECAR_NAMING)
+
+    # 元のファイルを書き換える前のExifを記録するジャーナルファイル。Noneなら記録しません。
+    undoJournalPath: Optional[str] = dataclasses.field(default=None)
+
+    # 処理対象を分割したときに、この実行が受け持つ番号（0から`shardCount`-1）。
+    shardIndex: int = dataclasses.field(default=0)
+
+    # 処理対象の分割数。2以上なら、`jpegInputDir`からの相対パスのハッシュ値で分割したうちの`shardIndex`番目だけを処理します。
+    # マニフェストなどの出力ファイルは分割ごとに別のファイルにし、キャッシュファイルは読み込むだけにします。
+    shardCount: int = dataclasses.field(default=1)
+
+    # 処理予定を書き出す（plan）、または読み込んで適用する（apply）計画ファイル。
+    planPath: Optional[str] = dataclasses.field(default=None)
+
+    # 監視中に、ファイルの変化が止まってから処理するまでの待ち時間（秒）。書き込み途中のファイルを処理しないために待ちます。
+    watchSettleSec: float = dataclasses.field(default=DEFAULT_WATCH_SETTLE_SEC)
+
+    # 監視中に、inotifyが使えず定期的にディレクトリを走査するときの間隔（秒）。
+    watchIntervalSec: float = dataclasses.field(default=DEFAULT_WATCH_INTERVAL_SEC)
+
+    # 実行中に集計した統計
+    stats: RunStats = dataclasses.field(default_factory=RunStats, repr=False, compare=False)
+
+    # 実行中に開いているジャーナル（プロセスプールのワーカーには渡さず、ワーカーごとに開く）
+    _undoJournal: Optional[UndoJournal] = dataclasses.field(default=None, init=False, repr=False, compare=False)
+
     def execute(self) -> None:
         """ 処理を実行する """
+        self._runWithStats(self._execute)
+
+    def watch(self) -> None:
+        """ ロケーション履歴を読み込んだまま、JPEGファイルの追加・変更を監視して処理し続ける
+
+        ロケーション履歴のディレクトリにJSONファイルが追加・変更されたら読み込み直し、
+        それまでどのロケーション履歴ともマッチしなかったファイルを処理し直す。
+        Ctrl+C（KeyboardInterrupt）で終了する。
+        """
+        self._runWithStats(self._watch)
+
+    def _runWithStats(self, run: Callable[[], None]) -> None:
+        """ 統計を集計しながら`run`を実行し、指定があれば統計を書き出す """
 
-        locationLogs = self._loadLocationLogs(self.googleLocationLogDir)
-        if len(locationLogs) == 0:
+        self.stats = RunStats()
+        try:
+            with self.stats.measure("total"):
+                run()
+        finally:
+            if self.statsPath is not None:
+                statsPath = self._shardPath(self.statsPath)
+                self.stats.write(statsPath)
+                logger.info(f"統計を書き出しました:'{statsPath}'")
+
+    def _execute(self) -> None:
+        jpegFileList: Optional[List[str]] = None
+        shootingTimes: Optional[List[int]] = None
+        if self.lazyLoad:
+            # 撮影日時の範囲が分かるまでロケーション履歴を読み込めないので、先にすべてのJPEGファイルを調べる
+            with self.stats.measure("walkJpeg"):
+                jpegFileList = self._listJpegFiles(self.jpegInputDir)
+            with self.stats.measure("dateScan"):
+                shootingTimes = self._scanShootingTimes(jpegFileList)
+
+        locationIndex = self._loadLocationLogs(self.googleLocationLogDir, shootingTimes)
+        if len(locationIndex) == 0 and len(locationIndex.visits) == 0 and not self.lazyLoad:
             logger.info("グーグルロケーション履歴ファイルが見つかりませんでした。")
             return
 
-        jpegFiles: List[str] = self._listJpegFiles(self.jpegInputDir)
-        if len(jpegFiles) == 0:
+        # ディレクトリの走査は別スレッドで進め、見つけたファイルから順に処理する
+        if jpegFileList is None:
+            jpegFiles = BackgroundIterator(self._iterJpegFiles(self.jpegInputDir), _DISCOVERY_QUEUE_SIZE)
+        else:
+            jpegFiles = BackgroundIterator(iter(jpegFileList), _DISCOVERY_QUEUE_SIZE)
+
+        startTime = time.monotonic()
+        lastProgressTime = startTime
+        processed = 0
+        reported = 0
+        with self._openOutputs() as (manifest, resultsFile):
+            results = self._processFiles(locationIndex, jpegFiles, manifest)
+            for i, (jpegFile, result) in enumerate(results):
+                processed = i + 1
+                # 走査中は、ここまでに見つかったファイル数に"+"を付けて表示する
+                total = f"{jpegFiles.count}{'' if jpegFiles.done else '+'}"
+                self._recordResult(f"{i}/{total}", jpegFile, result, manifest, resultsFile)
+
+                if self.compact:
+                    now = time.monotonic()
+                    if now - lastProgressTime >= self.progressIntervalSec:
+                        self._logProgress(processed, jpegFiles, now - startTime)
+                        lastProgressTime = now
+                        reported = processed
+
+        if jpegFileList is None:
+            self.stats.addTiming("walkJpeg", jpegFiles.elapsedSec)
+        if self.compact and processed > reported:
+            self._logProgress(processed, jpegFiles, time.monotonic() - startTime)
+        if jpegFiles.count == 0:
             logger.info("JPEGファイルが見つかりませんでした。")
             return
 
-        total = len(jpegFiles)
-        for i, jpegFile in enumerate(jpegFiles):
+        logger.info(f"{jpegFiles.count}個のJPEGファイルを処理しました。")
+
+    def _watch(self) -> None:
+        locationIndex = self._loadLocationLogs(self.googleLocationLogDir)
+        if not os.path.isdir(self.jpegInputDir):
+            raise AddGglLocException(f"ディレクトリが見つかりません:'{self.jpegInputDir}'")
+
+        # 出力先の相対パスを求めるため、通知されるパスは指定どおりのディレクトリから始まるようにする
+        jpegInputDir = self.jpegInputDir
+        googleLocationLogDir = self.googleLocationLogDir
+
+        # 処理した直後のファイルの(サイズ, 更新日時)。自分で書き換えたときの通知を読み飛ばすのに使う。
+        processedStats: Dict[str, Tuple[int, int]] = {}
+        # どのロケーション履歴ともマッチしなかったファイル。ロケーション履歴を読み込み直したら処理し直す。
+        unmatched: Set[str] = set()
+        processed = 0
+
+        def process(files: Iterable[str], manifest: Optional[ProcessManifest], resultsFile: Optional[TextIO],
+                    resume: bool = True) -> None:
+            nonlocal processed
+            for jpegFile, result in self._processFiles(locationIndex, files, manifest, resume=resume):
+                processed += 1
+                self._recordResult(f"{processed}", jpegFile, result, manifest, resultsFile)
+                if resultsFile is not None:
+                    resultsFile.flush()
+                if result.fileSize is not None:
+                    processedStats[jpegFile] = (result.fileSize, cast(int, result.fileMtimeNs))
+                if result.successMsg == _MSG_NOT_MATCHED:
+                    unmatched.add(jpegFile)
+                else:
+                    unmatched.discard(jpegFile)
+
+        def isChanged(path: str) -> bool:
             try:
-                result = self._processFile(locationLogs, jpegFile)
-            except Exception as e:
-                result = FileProcessResult("ERROR", errorMsg=f"{e}")
+                stat = os.stat(path)
+            except OSError:
+                return False
+            return processedStats.get(path) != (stat.st_size, stat.st_mtime_ns)
+
+        # 起動中に追加されたファイルを取りこぼさないよう、既存のファイルを処理する前に監視を始める
+        watcher = createWatcher(
+            [jpegInputDir, googleLocationLogDir], _JPEG_EXTENSIONS + (".json",),
+            self.watchSettleSec, self.watchIntervalSec)
+        with watcher, self._openOutputs() as (manifest, resultsFile):
+            process(self._iterJpegFiles(jpegInputDir), manifest, resultsFile)
+            logger.info(f"[WATCH]\t'{jpegInputDir}'と'{googleLocationLogDir}'を監視します。Ctrl+Cで終了します。")
+            try:
+                while True:
+                    changedFiles = watcher.poll(1.0)
+                    if not changedFiles:
+                        continue
+
+                    jsonFiles = [
+                        path for path in changedFiles
+                        if path.lower().endswith(".json") and _isUnder(path, googleLocationLogDir)
+                    ]
+                    jpegFiles = sorted(
+                        path for path in changedFiles
+                        if path.lower().endswith(_JPEG_EXTENSIONS) and _isUnder(path, jpegInputDir)
+                        and self._isInShard(path) and isChanged(path)
+                    )
+
+                    if jsonFiles:
+                        logger.info(f"[WATCH]\t{len(jsonFiles)}個のJSONファイルが追加・変更されたため、ロケーション履歴を読み込み直します。")
+                        with self.stats.measure("reload"):
+                            locationIndex = self._loadLocationLogs(self.googleLocationLogDir)
+                        # マッチしなかったファイルは処理済みとして記録されているので、マニフェストを見ずに処理し直す
+                        # （処理し直した結果はマニフェストに記録する）
+                        retryFiles = sorted(unmatched.difference(jpegFiles))
+                        if retryFiles:
+                            logger.info(f"[WATCH]\t{len(retryFiles)}個のマッチしなかったJPEGファイルを処理し直します。")
+                            process(retryFiles, manifest, resultsFile, resume=False)
+
+                    if jpegFiles:
+                        process(jpegFiles, manifest, resultsFile)
+            except KeyboardInterrupt:
+                logger.info(f"[WATCH]\t監視を終了します。{processed}個のJPEGファイルを処理しました。")
+
+    def _recordResult(self, label: str, jpegFile: str, result: "FileProcessResult",
+                      manifest: Optional[ProcessManifest], resultsFile: Optional[TextIO]) -> None:
+        """ 1ファイル分の処理結果を統計、ログ、処理結果ファイル、マニフェストに記録する """
+
+        self.stats.countStatus(result.status)
+        self.stats.addTimings(result.timings)
+        self.stats.count("jpegBytesRead", result.bytesRead)
+        self.stats.count("jpegBytesCopied", result.bytesCopied)
+        self.stats.count("jpegBytesWritten", result.bytesWritten)
+
+        # TODO 例外系はdebugログ出したほうが親切なんだろうな
+        if result.status == "ERROR":
+            logger.error(
+                f"({label})\t{jpegFile}\t{result.status}\t{result.errorMsg}"
+            )
+        elif result.status == "WARN":
+            logger.warning(
+                f"({label})\t{jpegFile}\t{result.status}\t{result.successMsg}\t{result.errorMsg}"
+            )
+        elif not self.compact:
+            logger.info(
+                f"({label})\t{jpegFile}\t{result.status}\t{result.successMsg}"
+            )
+        elif logger.isEnabledFor(DEBUG):
+            logger.debug(
+                f"({label})\t{jpegFile}\t{result.status}\t{result.successMsg}"
+            )
 
-            # TODO 例外系はdebugログ出したほうが親切なんだろうな
-            if result.status == "ERROR":
-                logger.error(
-                    f"({i}/{total})\t{jpegFile}\t{result.status}\t{result.errorMsg}"
-                )
-            elif result.status == "WARN":
-                logger.warning(
-                    f"({i}/{total})\t{jpegFile}\t{result.status}\t{result.successMsg}\t{result.errorMsg}"
-                )
-            else:
-                logger.info(
-                    f"({i}/{total})\t{jpegFile}\t{result.status}\t{result.successMsg}"
-                )
+        if resultsFile is not None:
+            resultsFile.write(json.dumps(self._resultRecord(jpegFile, result), ensure_ascii=False) + "\n")
 
-        logger.info(f"{len(jpegFiles)}個のJPEGファイルを処理しました。")
+        if (manifest is not None) and (not result.resumed) and (result.fileSize is not None):
+            with self.stats.measure("manifest"):
+                manifest.record(
+                    jpegFile, result.fileSize, cast(int, result.fileMtimeNs), result.status,
+                    result.locationLog,
+                    result.errorMsg if result.status == "ERROR" else result.successMsg
+                )
 
-    def _loadLocationLogs(self, baseDir: str) -> List[LocationLog]:
-        """ ロケーション履歴ファイルを読み込む """
+    @contextlib.contextmanager
+    def _openOutputs(self) -> Iterator[Tuple[Optional[ProcessManifest], Optional[TextIO]]]:
+        """ 処理中に使うジャーナル、マニフェスト、処理結果ファイルを開き、(マニフェスト, 処理結果ファイル)を返す。
+
+        withブロックを抜けるとすべて閉じる。
+        """
+
+        if self.sidecar:
+            where = "元のファイルの隣" if self.inPlace else "出力先ディレクトリ"
+            logger.info(f"画像は書き出さず、位置情報をXMPサイドカーファイルとして{where}に書き出します。")
+        elif self.inPlace:
+            logger.info("元のファイルを直接書き換えます。")
+            if self.undoJournalPath is not None:
+                undoJournalPath = self._shardPath(self.undoJournalPath)
+                self._undoJournal = UndoJournal(undoJournalPath)
+                logger.info(f"書き換える前のExifをジャーナルに記録します:'{undoJournalPath}'")
+
+        manifest = self._openManifest()
+        resultsFile = None
+        if self.resultsPath is not None:
+            resultsFile = open(self._shardPath(self.resultsPath), "w", encoding="utf-8")
+        try:
+            yield manifest, resultsFile
+        finally:
+            if manifest is not None:
+                manifest.close()
+            if resultsFile is not None:
+                resultsFile.close()
+            if self._undoJournal is not None:
+                self._undoJournal.close()
+                self._undoJournal = None
+
+    def _logProgress(self, processed: int, jpegFiles: BackgroundIterator[str], elapsedSec: float) -> None:
+        """ 処理済みのファイル数、処理速度、残り時間の見込みと処理結果の内訳を出力する """
+
+        rate = processed / elapsedSec if elapsedSec > 0 else 0.0
+        if jpegFiles.done and rate > 0:
+            eta = str(timedelta(seconds=int((jpegFiles.count - processed) / rate)))
+        else:
+            # 走査が終わるまではファイル数が分からない
+            eta = "?"
+        total = f"{jpegFiles.count}{'' if jpegFiles.done else '+'}"
+        statuses = ", ".join(f"{status} {count}" for status, count in sorted(self.stats.statuses.items()))
+        logger.info(f"[PROGRESS]\t{processed}/{total}\t{rate:.1f}ファイル/秒\t残り{eta}\t{statuses}")
+
+    def _resultRecord(self, jpegFile: str, result: "FileProcessResult") -> Dict[str, Any]:
+        """ 処理結果ファイルに書き出す1件分の内容を返す """
+        locationLog = result.locationLog
+        return {
+            "path": jpegFile,
+            "status": result.status,
+            "message": result.successMsg,
+            "error": result.errorMsg,
+            "lat": None if locationLog is None else locationLog.lat,
+            "lon": None if locationLog is None else locationLog.lon,
+            "areaInformation": None if locationLog is None else locationLog.areaInformation,
+            "timestamp": None if locationLog is None else locationLog.timestamp.isoformat(),
+            "matchDeltaSec": None if result.match is None else result.match.deltaMs / 1000,
+            "confidence": None if result.match is None else round(result.match.confidence, 3),
+            "resumed": result.resumed,
+        }
+
+    def _openManifest(self) -> Optional[ProcessManifest]:
+        """ 処理結果を記録するマニフェストを開く。使わない設定ならNoneを返す。
+
+        分割して処理するときは、後でまとめられるよう分割ごとのマニフェストに必ず記録する。
+        """
+
+        manifestPath = self.manifestPath
+        if manifestPath is None:
+            if (not self.resume) and (self.shardCount <= 1):
+                return None
+            manifestPath = os.path.join(self.outputDir, DEFAULT_MANIFEST_NAME)
+        manifestPath = self._shardPath(manifestPath)
+
+        manifest = ProcessManifest(manifestPath)
+        logger.info(f"処理結果をマニフェストに記録します:'{manifestPath}'")
+        return manifest
+
+    def buildCache(self) -> None:
+        """ ロケーション履歴を読み込み、キャッシュファイルを作成・更新する
+
+        分割して処理する前に1度実行しておくと、各分割の実行ではキャッシュを読み込むだけで済む。
+        """
+
+        if self.cachePath is None:
+            raise AddGglLocException("キャッシュファイルが指定されていません。")
+        if self.shardCount > 1:
+            raise AddGglLocException("分割して処理するときはキャッシュファイルを更新できません。")
+
+        def build() -> None:
+            self._loadLocationLogs(self.googleLocationLogDir)
+        self._runWithStats(build)
+
+    def mergeManifests(self, sources: Sequence[str]) -> None:
+        """ 分割して処理したときのマニフェストを1つにまとめ、処理結果の内訳を出力する
+
+        まとめ先は`manifestPath`（Noneなら出力先ディレクトリの既定のファイル）。
+        """
+
+        for source in sources:
+            if not os.path.isfile(source):
+                raise AddGglLocException(f"マニフェストが見つかりません:'{source}'")
+
+        manifestPath = self.manifestPath
+        if manifestPath is None:
+            manifestPath = os.path.join(self.outputDir, DEFAULT_MANIFEST_NAME)
+
+        logger.info(f"[START]\t{len(sources)}個のマニフェストをまとめます:'{manifestPath}'")
+        total = len(sources)
+        with ProcessManifest(manifestPath) as manifest:
+            for i, source in enumerate(sources):
+                merged = manifest.merge(source)
+                logger.info(f"({i}/{total})\t{source}\tMERGED\t{merged}件")
+            statusCounts = manifest.statusCounts()
+        statuses = ", ".join(f"{status} {count}" for status, count in statusCounts.items())
+        logger.info(f"[END]\t{sum(statusCounts.values())}個のJPEGファイルの処理結果をまとめました。\t{statuses}")
+
+    def _shardPath(self, path: str) -> str:
+        """ 分割して処理するときは、出力ファイルのパスを分割ごとのものにして返す """
+        if self.shardCount <= 1:
+            return path
+        return shardPath(path, self.shardIndex, self.shardCount)
+
+    def _isInShard(self, file: str) -> bool:
+        """ ファイルがこの実行の受け持つ分割に含まれていればTrueを返す """
+        if self.shardCount <= 1:
+            return True
+        return shardOf(os.path.relpath(file, self.jpegInputDir), self.shardCount) == self.shardIndex
+
+    def _loadLocationLogs(self, baseDir: str, shootingTimes: Optional[Sequence[int]] = None) -> LocationIndex:
+        """ ロケーション履歴ファイルを読み込む
+
+        `shootingTimes`（昇順の撮影日時のエポックミリ秒）を渡すと、
+        そのいずれかの前後`toleranceSec`に期間が重なるファイルだけを読み込む。
+        """
 
         logger.info("[START]\tGoogleロケーション履歴を読み込みます。")
 
         if not os.path.isdir(baseDir):
             raise AddGglLocException(f"ディレクトリが見つかりません:'{baseDir}'")
 
-        jsonFiles = [
-            os.path.join(curDir, file)
-            for curDir, _, files in os.walk(baseDir)
-            for file in files
-            if file.endswith(".json")
-        ]
+        # キャッシュとの突き合わせに全体が必要なので、JSONファイルは一覧にしておく（数は多くない）
+        with self.stats.measure("walkJson"):
+            jsonFiles = list(walkFiles(baseDir, (".json",)))
         total = len(jsonFiles)
         logger.info(f"{total}個のJSONファイルが見つかりました。")
 
-        fileNum = 0
-        locationLogs = []
-        for i, file in enumerate(jsonFiles):
-            try:
-                tempLocationLogs = GoogleLocationLogLoader.load(file)
-            except InvalidFileFormatException as e:
-                logger.warning(
-                    f"({i}/{total})\t{file}\tSKIP\t読み込めないファイル構造です: {e.message}")
-                continue
-            except Exception as e:
-                logger.error(f"({i}/{total})\t{file}\tSKIP\t想定外のエラーが発生しました。")
-                continue
+        rawFilter = self._rawLocationFilter()
+        cache = None if self.cachePath is None \
+            else LocationLogCache(self.cachePath, {"rawFilter": dataclasses.asdict(rawFilter)})
+        with self.stats.measure("cacheLoad"):
+            cacheData = None if (cache is None) or self.rebuildCache else cache.load()
+        nameTable = NameTable() if cacheData is None else cacheData.nameTable
+
+        # 前回から変わっていないファイルはキャッシュを使う
+        stats = {file: os.stat(file) for file in jsonFiles}
+        cachedEntries: Dict[str, CacheEntry] = {}
+        if cacheData is not None:
+            for file in jsonFiles:
+                cachedEntry = cacheData.entries.get(file)
+                if (cachedEntry is not None) and cachedEntry.isFresh(stats[file]):
+                    cachedEntries[file] = cachedEntry
+
+        if shootingTimes is not None:
+            toleranceMs = self.toleranceSec * 1000
+            jsonFiles = [
+                file for file in jsonFiles
+                if _isNeededForShootingTimes(file, cachedEntries.get(file), shootingTimes, toleranceMs)
+            ]
+            logger.info(f"撮影日時の前後に期間が重なる{len(jsonFiles)}個のJSONファイルだけを読み込みます。")
+            total = len(jsonFiles)
+
+        # 並列に読み込む場合は、先にすべてのファイルをワーカーに渡しておく
+        pool: Optional[ProcessPoolExecutor] = None
+        futures: Dict[str, Future] = {}
+        if self.loadWorkers > 1:
+            pool = ProcessPoolExecutor(self.loadWorkers)
+            futures = {
+                file: pool.submit(_loadLocationLogFile, file, None, rawFilter)
+                for file in jsonFiles
+                if file not in cachedEntries
+            }
 
-            fileNum += 1
-            locationLogs.extend(tempLocationLogs)
-            logger.info(f"({i}/{total})\t{file}\tLOADED")
-
-        # 2部探索するためにソートしておく
-        locationLogs.sort(key=lambda l: l.timestamp)
+        fileNum = 0
+        parsedNum = 0
+        entries: List[CacheEntry] = []
+        try:
+            for i, file in enumerate(jsonFiles):
+                if file in cachedEntries:
+                    fileNum += 1
+                    entries.append(cachedEntries[file])
+                    logger.info(f"({i}/{total})\t{file}\tLOADED\tキャッシュ")
+                    continue
+
+                try:
+                    if pool is None:
+                        fileIndex, timings = _loadLocationLogFile(file, nameTable, rawFilter)
+                    else:
+                        # ワーカーごとに名称IDが異なるので付け替える
+                        fileIndex, timings = futures[file].result()
+                        with self.stats.measure("rebind"):
+                            fileIndex = fileIndex.rebind(nameTable)
+                except InvalidFileFormatException as e:
+                    logger.warning(
+                        f"({i}/{total})\t{file}\tSKIP\t読み込めないファイル構造です: {e.message}")
+                    continue
+                except Exception as e:
+                    logger.error(f"({i}/{total})\t{file}\tSKIP\t想定外のエラーが発生しました。")
+                    continue
+
+                fileNum += 1
+                parsedNum += 1
+                stat = stats[file]
+                self.stats.addTimings(timings)
+                self.stats.count("jsonBytesRead", stat.st_size)
+                entries.append(CacheEntry(file, stat.st_size, stat.st_mtime_ns, fileIndex))
+                logger.info(f"({i}/{total})\t{file}\tLOADED")
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        if (cacheData is not None) \
+                and (len(entries) == len(cacheData.entries)) \
+                and all(entry is cacheData.entries.get(entry.path) for entry in entries):
+            # すべてキャッシュどおりなら、キャッシュ内のソート済みのものをそのまま使う
+            locationIndex = cacheData.merged
+        else:
+            # 2部探索するために、ファイルごとにソート済みのものをタイムスタンプ順にマージしておく
+            with self.stats.measure("merge"):
+                locationIndex = LocationIndex.merge((entry.index for entry in entries), nameTable)
+
+            if (cache is not None) and (shootingTimes is not None):
+                # 一部のファイルしか読み込んでいないので、キャッシュファイルは更新しない
+                if parsedNum > 0:
+                    logger.info(f"撮影日時で絞り込んで読み込んだため、キャッシュファイルは更新しません:'{cache.path}'")
+            elif (cache is not None) and (self.shardCount > 1):
+                # 複数のマシンで同じファイルを書き換え合わないよう、分割して処理するときは更新しない
+                logger.warning(f"キャッシュファイルが最新ではありませんが、分割して処理しているため更新しません:'{cache.path}'")
+            elif cache is not None:
+                entries = [dataclasses.replace(entry, index=entry.index.detach()) for entry in entries]
+                if cacheData is not None:
+                    cacheData.close()
+                with self.stats.measure("cacheSave"):
+                    cache.save(nameTable, entries, locationIndex)
+                logger.info(f"キャッシュファイルを更新しました:'{cache.path}'")
 
         logger.info(
-            f"[END]\t{fileNum}個のロケーション履歴ファイルが見つかり、{len(locationLogs)}個のロケーションログを読み込みました。")
+            f"[END]\t{fileNum}個のロケーション履歴ファイルが見つかり、"
+            f"{len(locationIndex)}個のロケーションログと{len(locationIndex.visits)}個の滞在を読み込みました。")
 
-        return locationLogs
+        return locationIndex
 
     def _listJpegFiles(self, baseDir: str) -> List[str]:
         """ JPEGファイルを列挙する """
+        return list(self._iterJpegFiles(baseDir))
+
+    def _iterJpegFiles(self, baseDir: str) -> Iterator[str]:
+        """ JPEGファイルを見つけた順に返す。ディレクトリ全体の走査が終わるのを待たない。 """
 
         logger.info("[START]\tJPEGファイルを検索します。")
 
         if not os.path.isdir(baseDir):
             raise AddGglLocException(f"ディレクトリが見つかりません:'{baseDir}'")
 
-        def isJpeg(filePath: str) -> bool:
-            extention = filePath.split(".")[-1].lower()
-            return (extention == "jpg") or (extention == "jpeg")
-        jpegFiles = [
-            os.path.join(curDir, file)
-            for curDir, _, files in os.walk(baseDir)
-            for file in files
-            if isJpeg(file)
-        ]
+        def walk() -> Iterator[str]:
+            count = 0
+            for file in walkFiles(baseDir, _JPEG_EXTENSIONS):
+                if not self._isInShard(file):
+                    continue
+                count += 1
+                yield file
+            if self.shardCount > 1:
+                logger.info(f"[END]\t分割{self.shardIndex + 1}/{self.shardCount}の担当分として{count}個のJPEGファイルが見つかりました。")
+            else:
+                logger.info(f"[END]\t{count}個のJPEGファイルが見つかりました。")
+        return walk()
 
-        logger.info(f"[END]\t{len(jpegFiles)}個のJPEGファイルが見つかりました。")
+    def _scanShootingTimes(self, jpegFiles: Sequence[str]) -> List[int]:
+        """ 位置情報を付与する対象になりうるJPEGファイルの撮影日時を、昇順のエポックミリ秒で返す
 
-        return jpegFiles
+        位置情報がすでにあるファイルや、撮影日時が分からないファイルは除く。
+        """
 
-    def _processFile(self, locationLogs, file) -> "FileProcessResult":
-        """ 1ファイル処理する。 """
+        shootingTimes: List[int] = []
+        for file in jpegFiles:
+            try:
+                scanResult = scanExif(file)
+                if scanResult is not None:
+                    if scanResult.hasLocation:
+                        continue
+                    shootingDateTime = self._parseShootingDate(scanResult.dateTimeOriginal)
+                else:
+                    with JpegFile(file) as jpeg:
+                        exifDict = jpeg.loadExif()
+                    if self._hasLocationLog(exifDict):
+                        continue
+                    shootingDateTime = self._getShootingDate(exifDict)
+            except Exception:
+                # 読み込めないファイルは処理するときにエラーとして出力する
+                continue
+            if shootingDateTime is not None:
+                shootingTimes.append(datetimeToMs(shootingDateTime))
+        shootingTimes.sort()
+
+        if shootingTimes:
+            logger.info(
+                f"{len(shootingTimes)}個のJPEGファイルの撮影日時は"
+                f"{msToDatetime(shootingTimes[0]).isoformat()}から{msToDatetime(shootingTimes[-1]).isoformat()}です。")
+        return shootingTimes
+
+    def _processFiles(self, locationIndex: LocationIndex, jpegFiles: Iterable[str],
+                      manifest: Optional[ProcessManifest] = None,
+                      plannedEntries: Optional[Dict[str, PlanEntry]] = None,
+                      resume: bool = True) -> Iterator[Tuple[str, "FileProcessResult"]]:
+        """ JPEGファイルを処理し、(ファイル, 処理結果)を入力と同じ順序で返す。
+
+        `workers`が2以上ならワーカープールで並列に処理する。
+        ロケーション履歴はワーカーの初期化時に1度だけ渡す。
+        `resume`のときは、マニフェストで処理済みのファイルを開かずに読み飛ばす（引数の`resume`がFalseなら読み飛ばさない）。
+        `plannedEntries`に処理予定があるファイルは、照合せずに計画どおりの位置情報を付与する。
+        処理予定はファイルを処理に回すときに取り出す（呼び出し側は処理しながら追加してよい）。
+        """
+
+        def takePlanned(file: str) -> Optional[PlanEntry]:
+            return None if plannedEntries is None else plannedEntries.pop(file, None)
+
+        # 処理済みかどうかを調べるマニフェスト（処理結果の記録は呼び出し側が`manifest`に行う）
+        resumeManifest = manifest if resume else None
+
+        if self.workers <= 1:
+            for file in jpegFiles:
+                planned = takePlanned(file)
+                resumed = self._findResumed(resumeManifest, file)
+                if resumed is not None:
+                    yield file, resumed
+                    continue
+                yield file, self._processFileSafely(locationIndex, file, planned)
+            return
 
-        result: Optional[FileProcessResult] = None
+        pool: Executor
+        func: Callable[[str, Optional[PlanEntry]], FileProcessResult]
+        if self.executor == "process":
+            pool = ProcessPoolExecutor(
+                self.workers, initializer=_initWorker, initargs=(dataclasses.replace(self), locationIndex))
+            func = _processFileInWorker
+        else:
+            pool = ThreadPoolExecutor(self.workers)
+            def func(file: str, planned: Optional[PlanEntry]) -> FileProcessResult:
+                return self._processFileSafely(locationIndex, file, planned)
+
+        # 結果の順序を保つため、投入した順に結果を取り出す。
+        # 投入済みで未回収のファイル数はワーカー数の数倍までに抑える。
+        maxPending = self.workers * 4
+        with pool:
+            pending: Deque[Tuple[str, Future]] = deque()
+            for file in jpegFiles:
+                planned = takePlanned(file)
+                resumed = self._findResumed(resumeManifest, file)
+                if resumed is not None:
+                    future: Future = Future()
+                    future.set_result(resumed)
+                    pending.append((file, future))
+                else:
+                    pending.append((file, pool.submit(func, file, planned)))
+                if len(pending) >= maxPending:
+                    pendingFile, pendingFuture = pending.popleft()
+                    yield pendingFile, pendingFuture.result()
+            while pending:
+                pendingFile, pendingFuture = pending.popleft()
+                yield pendingFile, pendingFuture.result()
+
+    def _findResumed(self, manifest: Optional[ProcessManifest], file: str) -> Optional["FileProcessResult"]:
+        """ 前回の実行で処理済みのファイルなら、その処理結果を返す。 """
+
+        if (manifest is None) or (not self.resume):
+            return None
+        try:
+            done = manifest.findDone(file, os.stat(file))
+        except OSError:
+            return None
+        if done is None:
+            return None
+        status, message = done
+        return FileProcessResult(
+            "SKIP", successMsg=f"前回の実行で処理済みです。({status}) {message}", resumed=True)
 
-        # Exifを辞書として読み込む
-        exifDict: Dict[str, Any] = cast(Dict[str, Any], piexif.load(f"{file}"))
+    def _processFileSafely(self, locationIndex: LocationIndex, file: str,
+                           planned: Optional[PlanEntry] = None) -> "FileProcessResult":
+        """ 1ファイル処理する。例外はERRORの処理結果に変換する。 """
 
-        # 既にGPS情報が格納されていたら終了
-        if self._hasLocationLog(exifDict):
-            return FileProcessResult("SKIP", successMsg="ロケーション情報がすでに存在します。")
+        timer = StageTimer()
+        with timer.measure("file"):
+            try:
+                stat = os.stat(file)
+            except OSError as e:
+                return FileProcessResult("ERROR", errorMsg=f"{e}")
+            if (planned is not None) and (not planned.isUnchanged(stat)):
+                return FileProcessResult("ERROR", errorMsg="計画を作成した後に変更されています。計画を作成し直してください。")
 
-        # タイムスタンプに紐づく位置情報を取得
-        shootingDateTime = self._getShootingDate(exifDict)
-        locationLog = self._matchLocationLog(locationLogs, shootingDateTime)
+            try:
+                result = self._processFile(locationIndex, file, timer, planned)
+            except Exception as e:
+                result = FileProcessResult("ERROR", errorMsg=f"{e}")
+        if result.fileSize is None:
+            result.fileSize = stat.st_size
+            result.fileMtimeNs = stat.st_mtime_ns
+        result.timings = timer.timings
+        result.bytesRead = timer.counters.get("jpegBytesRead", 0)
+        result.bytesCopied = timer.counters.get("jpegBytesCopied", 0)
+        return result
 
-        # 位置情報が取得できなければ終了
+    def _processFile(self, locationIndex: LocationIndex, file: str, timer: StageTimer,
+                     planned: Optional[PlanEntry] = None) -> "FileProcessResult":
+        """ 1ファイル処理する。 """
+
+        # ヘッダだけを読んで、位置情報を付与できないファイルは先に除外する（計画済みなら除外済み）
+        match: Optional[LocationMatch] = None
+        scanResult: Optional[ExifScanResult] = None
+        if planned is None:
+            with timer.measure("prescan"):
+                scanResult = scanExif(file)
+        if scanResult is not None:
+            timer.count("jpegBytesRead", scanResult.bytesRead)
+            if scanResult.hasLocation:
+                return FileProcessResult("SKIP", successMsg=_MSG_HAS_LOCATION)
+            shootingDateTime = self._parseShootingDate(scanResult.dateTimeOriginal)
+            with timer.measure("match"):
+                match = self._matchLocation(locationIndex, shootingDateTime)
+            if match is None:
+                return FileProcessResult("SKIP", successMsg=_MSG_NOT_MATCHED)
+
+        if self.sidecar:
+            return self._processSidecar(locationIndex, file, timer, planned, match)
+
+        # ファイルは1度だけ開き、読み込みも書き出しも同じバッファから行う
+        with timer.measure("open"):
+            jpeg = JpegFile(file)
+        if not self.inPlace:
+            with jpeg:
+                try:
+                    return self._processJpeg(locationIndex, jpeg, timer, planned, match)
+                finally:
+                    _countJpegBytes(timer, jpeg)
+
+        # 元のファイルを書き換える場合は、同じディレクトリの一時ファイルに書き出してから置き換える
+        tempPath = inPlaceTempPath(file)
+        try:
+            with jpeg:
+                try:
+                    result = self._processJpeg(locationIndex, jpeg, timer, planned, match)
+                finally:
+                    _countJpegBytes(timer, jpeg)
+            if result.status in ("ADDED", "WARN"):
+                with timer.measure("replace"):
+                    shutil.copymode(file, tempPath)
+                    os.replace(tempPath, file)
+                # 書き換えた後の状態をマニフェストに記録し、再開時に読み飛ばせるようにする
+                stat = os.stat(file)
+                result.fileSize = stat.st_size
+                result.fileMtimeNs = stat.st_mtime_ns
+            return result
+        finally:
+            if os.path.lexists(tempPath):
+                os.remove(tempPath)
+
+    def _processSidecar(self, locationIndex: LocationIndex, file: str, timer: StageTimer,
+                        planned: Optional[PlanEntry], match: Optional[LocationMatch]) -> "FileProcessResult":
+        """ 画像は書き出さず、位置情報をXMPのサイドカーファイルに書き出す。
+
+        `match`はヘッダの走査で照合済みの位置情報。Noneなら、Exifを読み込んで判断する。
+        """
+
+        locationLog = None if match is None else match.locationLog
         if locationLog is None:
-            return FileProcessResult("SKIP", successMsg="どのロケージョン履歴ともマッチしませんでした。")
+            # Exifだけを読み込み、画像データは読まない
+            with timer.measure("open"):
+                jpeg = JpegFile(file)
+            with jpeg:
+                with timer.measure("exifLoad"):
+                    exifDict: Dict[str, Any] = jpeg.loadExif()
+            _countJpegBytes(timer, jpeg)
+            if self._hasLocationLog(exifDict):
+                return FileProcessResult("SKIP", successMsg=_MSG_HAS_LOCATION)
+            if planned is not None:
+                locationLog = planned.locationLog
+                match = planned.match()
+            else:
+                shootingDateTime = self._getShootingDate(exifDict)
+                with timer.measure("match"):
+                    match = self._matchLocation(locationIndex, shootingDateTime)
+                locationLog = None if match is None else match.locationLog
+            if locationLog is None:
+                return FileProcessResult("SKIP", successMsg=_MSG_NOT_MATCHED)
+
+        if self.inPlace:
+            imagePath = Path(file)
+        else:
+            imagePath = Path(self.outputDir, Path(file).relative_to(self.jpegInputDir))
+        xmpPath = sidecarPath(str(imagePath), self.sidecarNaming)
+
+        # 他のツールが書き出したサイドカーファイルは上書きしない
+        if os.path.lexists(xmpPath):
+            return FileProcessResult("SKIP", successMsg=_MSG_HAS_SIDECAR)
+        try:
+            os.makedirs(imagePath.parent, exist_ok=True)
+        except Exception as e:
+            return FileProcessResult("ERROR", errorMsg=f"ディレクトリを作成できませんでした:'{imagePath.parent}'.")
 
-        # 位置情報を辞書に書き込む
-        exifDict = locationLog.writeTo(exifDict)
+        xmp = buildXmp(locationLog)
+        with timer.measure("write"):
+            writeSidecar(xmpPath, xmp)
 
-        # ExifIFD.SceneTypeにbyte以外のデータが入っていることがまれにある。
-        # byte以外のデータだとpiexif.insertに失敗するのでbyteにして入れ直す。
-        if (piexif.ExifIFD.SceneType in exifDict['Exif']) and type(exifDict['Exif'][piexif.ExifIFD.SceneType]) is int:
-            exifDict['Exif'][piexif.ExifIFD.SceneType] = bytes(
-                [exifDict['Exif'][piexif.ExifIFD.SceneType]]
-            )
-            result = FileProcessResult(
-                "WARN",
-                errorMsg="'ExifIFD.SceneType'がbyte型でなかったので、byte型に変換しました。"
-            )
+        return FileProcessResult(
+            "ADDED", successMsg=_describeLocation(locationLog), locationLog=locationLog, match=match,
+            bytesWritten=len(xmp))
+
+    def _processJpeg(self, locationIndex: LocationIndex, jpeg: JpegFile, timer: StageTimer,
+                     planned: Optional[PlanEntry] = None,
+                     match: Optional[LocationMatch] = None) -> "FileProcessResult":
+        """ 開いたJPEGファイルを1つ処理する。処理予定があれば、照合せずにその位置情報を付与する。
+
+        `match`はヘッダの走査で照合済みの位置情報。Noneなら、Exifを読み込んで判断する。
+        """
+
+        result: Optional[FileProcessResult] = None
+        locationLog: Optional[LocationLog] = None
+        exifBytes: Optional[bytes] = None
+
+        # ExifのTIFF構造を解釈できれば、元のバイト列はそのままにGPS IFDだけを書き足す
+        # （照合済みなら、位置情報の有無の判断と照合はやり直さない）
+        with timer.measure("exifLoad"):
+            tiff = jpeg.exifTiff()
+            scanResult = None if (tiff is None) or (match is not None) else scanTiff(tiff)
+        if match is not None:
+            locationLog = match.locationLog
+        elif scanResult is not None:
+            if scanResult.hasLocation:
+                return FileProcessResult("SKIP", successMsg=_MSG_HAS_LOCATION)
+            if planned is not None:
+                locationLog = planned.locationLog
+                match = planned.match()
+            else:
+                shootingDateTime = self._parseShootingDate(scanResult.dateTimeOriginal)
+                with timer.measure("match"):
+                    match = self._matchLocation(locationIndex, shootingDateTime)
+                locationLog = None if match is None else match.locationLog
+            if locationLog is None:
+                return FileProcessResult("SKIP", successMsg=_MSG_NOT_MATCHED)
+        if (locationLog is not None) and (tiff is not None):
+            with timer.measure("exifDump"):
+                gpsTiff = insertGpsIfd(tiff, locationLog.gpsTags())
+            if gpsTiff is not None:
+                exifBytes = _EXIF_HEADER + gpsTiff
+
+        if exifBytes is None:
+            # Exifが無い、解釈できない構造、APP1に収まらないなどの場合は、piexifで辞書にしてから書き出し直す
+            with timer.measure("exifLoad"):
+                exifDict: Dict[str, Any] = jpeg.loadExif()
+
+            if locationLog is None:
+                # 既にGPS情報が格納されていたら終了
+                if self._hasLocationLog(exifDict):
+                    return FileProcessResult("SKIP", successMsg=_MSG_HAS_LOCATION)
+
+                # タイムスタンプに紐づく位置情報を取得
+                if planned is not None:
+                    locationLog = planned.locationLog
+                    match = planned.match()
+                else:
+                    shootingDateTime = self._getShootingDate(exifDict)
+                    with timer.measure("match"):
+                        match = self._matchLocation(locationIndex, shootingDateTime)
+                    locationLog = None if match is None else match.locationLog
+
+                # 位置情報が取得できなければ終了
+                if locationLog is None:
+                    return FileProcessResult("SKIP", successMsg=_MSG_NOT_MATCHED)
+
+            # 位置情報を辞書に書き込む
+            with timer.measure("writeTo"):
+                exifDict = locationLog.writeTo(exifDict)
+
+            # ExifIFD.SceneTypeにbyte以外のデータが入っていることがまれにある。
+            # byte以外のデータだとpiexif.insertに失敗するのでbyteにして入れ直す。
+            # （writeToはExif IFDを元の辞書と共有しているので、コピーしてから書き換える）
+            if (piexif.ExifIFD.SceneType in exifDict['Exif']) and type(exifDict['Exif'][piexif.ExifIFD.SceneType]) is int:
+                exifDict['Exif'] = dict(exifDict['Exif'])
+                exifDict['Exif'][piexif.ExifIFD.SceneType] = bytes(
+                    [exifDict['Exif'][piexif.ExifIFD.SceneType]]
+                )
+                result = FileProcessResult(
+                    "WARN",
+                    errorMsg="'ExifIFD.SceneType'がbyte型でなかったので、byte型に変換しました。"
+                )
+
+            with timer.measure("exifDump"):
+                exifBytes = piexif.dump(exifDict)
 
         # 出力先ディレクトリ作成
-        pathFromBase = Path(file).relative_to(self.jpegInputDir)
-        outputPath = Path(self.outputDir, pathFromBase)
+        if self.inPlace:
+            outputPath = Path(inPlaceTempPath(jpeg.path))
+        else:
+            pathFromBase = Path(jpeg.path).relative_to(self.jpegInputDir)
+            outputPath = Path(self.outputDir, pathFromBase)
         try:
             os.makedirs(outputPath.parent, exist_ok=True)
         except Exception as e:
             return FileProcessResult("ERROR", errorMsg=f"ディレクトリを作成できませんでした:'{outputPath.parent}'.")
 
         # 位置情報付与して出力
-        exifBytes = piexif.dump(exifDict)
-        piexif.insert(exifBytes, file, outputPath)
+        with timer.measure("write"):
+            bytesWritten = jpeg.writeWithExif(str(outputPath), exifBytes)
+        if self._undoJournal is not None:
+            with timer.measure("journal"):
+                self._journalOriginal(jpeg, str(outputPath), bytesWritten)
 
         result = FileProcessResult("ADDED") if result is None else result
-        result.successMsg = f"({locationLog.lat}, {locationLog.lon}) {'' if locationLog.areaInformation is None else f',{locationLog.areaInformation}'}"
+        result.locationLog = locationLog
+        result.match = match
+        result.bytesWritten = bytesWritten
+        result.successMsg = _describeLocation(locationLog)
 
         return result
 
+    def _journalOriginal(self, jpeg: JpegFile, outputPath: str, bytesWritten: int) -> None:
+        """ 書き換える前のExifの範囲をジャーナルに記録する """
+        assert self._undoJournal is not None
+        cutStart, cutEnd = jpeg.replaceRange()
+        newLength = bytesWritten - (jpeg.size - (cutEnd - cutStart))
+        self._undoJournal.record(
+            jpeg.path, os.stat(outputPath), cutStart, newLength, jpeg.readRange(cutStart, cutEnd))
+
+    def plan(self) -> None:
+        """ JPEGファイルを書き換えずに位置情報を照合し、処理予定を計画ファイルに書き出す
+
+        JPEGファイルはExifのヘッダだけを読み、画像データは読まない（書き換えずに結果を確認するのにも使える）。
+        撮影時間はまとめてソートしてから照合する。
+        処理予定はディレクトリ、iノード番号の順に並べ、適用するときにディスクを連続して読み書きできるようにする。
+        """
+        self._runWithStats(self._plan)
+
+    def apply(self) -> None:
+        """ 計画ファイルの処理予定のとおりに位置情報を付与する
+
+        ロケーション履歴は読み込まない。
+        計画ファイルは先頭から一定数ずつ読み込み、その中でディレクトリ、iノード番号の順に並べ替えて処理する。
+        計画を作成した後に変更されたファイルはERRORにする。
+        """
+        self._runWithStats(self._apply)
+
+    def _plan(self) -> None:
+        if self.planPath is None:
+            raise AddGglLocException("計画ファイルが指定されていません。")
+
+        logger.info("[START]\t処理予定を計画します。")
+        entries: List[PlanEntry] = []
+        shootingDateTimes: List[Optional[datetime]] = []
+        jpegFiles = BackgroundIterator(self._iterJpegFiles(self.jpegInputDir), _DISCOVERY_QUEUE_SIZE)
+        for file in jpegFiles:
+            with self.stats.measure("prescan"):
+                entry, shootingDateTime = self._planFile(file)
+            entries.append(entry)
+            shootingDateTimes.append(shootingDateTime)
+        self.stats.addTiming("walkJpeg", jpegFiles.elapsedSec)
+
+        # 撮影日時が分かってからロケーション履歴を読み込む（`lazyLoad`なら関係するファイルだけを読み込む）
+        shootingTimes: Optional[List[int]] = None
+        if self.lazyLoad:
+            shootingTimes = sorted(datetimeToMs(dateTime) for dateTime in shootingDateTimes if dateTime is not None)
+        locationIndex = self._loadLocationLogs(self.googleLocationLogDir, shootingTimes)
+
+        with self.stats.measure("match"):
+            matches = self._matchMany(locationIndex, shootingDateTimes)
+        for entry, match in zip(entries, matches):
+            if entry.status != PLANNED_STATUS:
+                continue
+            if match is None:
+                entry.status = "SKIP"
+                entry.message = _MSG_NOT_MATCHED
+            else:
+                entry.setMatch(match)
+                entry.message = _describeLocation(match.locationLog)
+
+        entries.sort(key=PlanEntry.sortKey)
+        total = len(entries)
+        with PlanWriter(self.planPath, self.jpegInputDir, self.toleranceSec) as writer:
+            for i, entry in enumerate(entries):
+                writer.write(entry)
+                if entry.status == "ERROR":
+                    result = FileProcessResult("ERROR", errorMsg=entry.message)
+                else:
+                    result = FileProcessResult(
+                        cast(Any, entry.status), successMsg=entry.message, locationLog=entry.locationLog,
+                        match=entry.match())
+                self._recordResult(f"{i}/{total}", entry.path, result, None, None)
+
+        planned = self.stats.statuses.get(PLANNED_STATUS, 0)
+        logger.info(f"[END]\t{total}個のJPEGファイルのうち、{planned}個に位置情報を付与する計画を書き出しました:'{self.planPath}'")
+
+    def _planFile(self, file: str) -> Tuple[PlanEntry, Optional[datetime]]:
+        """ 1ファイル分の処理予定（照合前）と撮影時間を返す """
+
+        try:
+            stat = os.stat(file)
+            scanResult = scanExif(file)
+            if scanResult is not None:
+                hasLocation = scanResult.hasLocation
+                shootingDateTime = self._parseShootingDate(scanResult.dateTimeOriginal)
+            else:
+                # ヘッダの走査で判断できない構造なら、Exifだけを読み込む
+                with JpegFile(file) as jpeg:
+                    exifDict = jpeg.loadExif()
+                hasLocation = self._hasLocationLog(exifDict)
+                shootingDateTime = self._getShootingDate(exifDict)
+        except Exception as e:
+            return PlanEntry(file, "ERROR", message=f"{e}"), None
+
+        entry = PlanEntry(file, PLANNED_STATUS, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        if hasLocation:
+            entry.status = "SKIP"
+            entry.message = _MSG_HAS_LOCATION
+            return entry, None
+        return entry, shootingDateTime
+
+    def _apply(self) -> None:
+        if self.planPath is None:
+            raise AddGglLocException("計画ファイルが指定されていません。")
+        if not os.path.isfile(self.planPath):
+            raise AddGglLocException(f"計画ファイルが見つかりません:'{self.planPath}'")
+
+        logger.info(f"[START]\t計画ファイルの内容で位置情報を付与します:'{self.planPath}'")
+        try:
+            reader = PlanReader(self.planPath)
+        except InvalidPlanException as e:
+            raise AddGglLocException(e.message)
+
+        with reader:
+            # 出力先の相対パスは、計画したときのディレクトリから求める
+            if reader.jpegInputDir != self.jpegInputDir:
+                logger.info(f"計画したときのJPEGファイルのディレクトリを使います:'{reader.jpegInputDir}'")
+                self.jpegInputDir = reader.jpegInputDir
+
+            # 処理に回すまでの処理予定（一度に読み込むのは一定数まで）
+            plannedEntries: Dict[str, PlanEntry] = {}
+            skipped = 0
+
+            def plannedFiles() -> Iterator[str]:
+                nonlocal skipped
+                entries = iter(reader)
+                while True:
+                    chunk = list(itertools.islice(entries, _APPLY_CHUNK_SIZE))
+                    if not chunk:
+                        return
+                    planned = [
+                        entry for entry in chunk
+                        if entry.status == PLANNED_STATUS and self._isInShard(entry.path)
+                    ]
+                    skipped += len(chunk) - len(planned)
+                    planned.sort(key=PlanEntry.sortKey)
+                    for entry in planned:
+                        plannedEntries[entry.path] = entry
+                        yield entry.path
+
+            # 位置情報は照合しないので、空のロケーション履歴を渡す
+            locationIndex = LocationIndexBuilder().build()
+            processed = 0
+            with self._openOutputs() as (manifest, resultsFile):
+                results = self._processFiles(locationIndex, plannedFiles(), manifest, plannedEntries)
+                for jpegFile, result in results:
+                    self._recordResult(f"{processed}", jpegFile, result, manifest, resultsFile)
+                    processed += 1
+
+        logger.info(f"[END]\t{processed}個のJPEGファイルを処理しました。（計画で対象外の{skipped}個を除く）")
+
+    def rollback(self) -> None:
+        """ `inPlace`で書き換えたファイルを、ジャーナルに記録した元のExifに戻す """
+
+        if self.undoJournalPath is None:
+            raise AddGglLocException("ジャーナルファイルが指定されていません。")
+        undoJournalPath = self._shardPath(self.undoJournalPath)
+        if not os.path.isfile(undoJournalPath):
+            raise AddGglLocException(f"ジャーナルファイルが見つかりません:'{undoJournalPath}'")
+
+        logger.info(f"[START]\tジャーナルの内容でファイルを元に戻します:'{undoJournalPath}'")
+        restored = 0
+        with UndoJournal(undoJournalPath) as journal:
+            entries = journal.entries()
+            total = len(entries)
+            for i, entry in enumerate(entries):
+                try:
+                    stat = os.stat(entry.path)
+                except OSError as e:
+                    logger.error(f"({i}/{total})\t{entry.path}\tERROR\t{e}")
+                    continue
+                if not entry.isUnchanged(stat):
+                    logger.warning(
+                        f"({i}/{total})\t{entry.path}\tSKIP\t書き換えた後に変更されているため元に戻せません。")
+                    continue
+                try:
+                    spliceFile(entry.path, entry.offset, entry.length, entry.original)
+                except Exception as e:
+                    logger.error(f"({i}/{total})\t{entry.path}\tERROR\t{e}")
+                    continue
+                journal.remove(entry.path)
+                restored += 1
+                logger.info(f"({i}/{total})\t{entry.path}\tRESTORED")
+        logger.info(f"[END]\t{restored}個のファイルを元に戻しました。")
+
     def _hasLocationLog(self, exifDict: Dict[str, Any]) -> bool:
         """ すでに位置情報を保持していればTrueを返す。 """
         gpsIdf = exifDict.get("GPS")
@@ -208,38 +1241,69 @@ class AddGglLoc(object):
             and piexif.GPSIFD.GPSLongitudeRef in gpsIdf \
             and piexif.GPSIFD.GPSLongitude in gpsIdf
 
-    def _matchLocationLog(self, locationLogs: List[LocationLog], shootingDateTime: Optional[datetime]) -> Optional[LocationLog]:
+    def _matchLocationLog(self, locationIndex: LocationIndex, shootingDateTime: Optional[datetime]) -> Optional[LocationLog]:
         """ 撮影時間における位置情報を返す。推測できなければNoneを返す。 """
+        match = self._matchLocation(locationIndex, shootingDateTime)
+        return None if match is None else match.locationLog
+
+    def _matchLocation(self, locationIndex: LocationIndex, shootingDateTime: Optional[datetime]) -> Optional[LocationMatch]:
+        """ 撮影時間における位置情報と、その確からしさを返す。推測できなければNoneを返す。 """
 
         if shootingDateTime is None:
             return None
 
         # 位置情報を2分探索
-        left = 0
-        right = len(locationLogs) - 1
-        center = 0
-        while (left <= right):
-            center = left + int((right - left) / 2)
-            centerDateTime = locationLogs[center].timestamp
-            if centerDateTime == shootingDateTime:
-                break
-            if shootingDateTime > centerDateTime:
-                left = center + 1
-            else:
-                right = center - 1
-
-        # 最終的にたどり着いた位置情報と撮影時間とだいたい同じであればその位置情報を採用
-        delta = locationLogs[center].timestamp - shootingDateTime
-        if delta.total_seconds() <= self.toleranceSec:
-            return locationLogs[center]
-
-        return None
+        return self._matcher(locationIndex).match(datetimeToMs(shootingDateTime))
+
+    def matchMany(self, locationIndex: LocationIndex,
+                  shootingDateTimes: Sequence[Optional[datetime]]) -> List[Optional[LocationLog]]:
+        """ 複数の撮影時間における位置情報をまとめて返す。推測できなかったものはNoneになる。
+
+        撮影時間をソートしてから索引をまとめて探索するので、
+        大量の写真では`_matchLocationLog`を1件ずつ呼ぶよりも速い。
+        判定の基準は`_matchLocationLog`と同じ。
+        """
+        return [None if match is None else match.locationLog
+                for match in self._matchMany(locationIndex, shootingDateTimes)]
+
+    def _matchMany(self, locationIndex: LocationIndex,
+                   shootingDateTimes: Sequence[Optional[datetime]]) -> List[Optional[LocationMatch]]:
+        """ `matchMany`と同じく照合し、位置情報とその確からしさを返す """
+
+        results: List[Optional[LocationMatch]] = [None] * len(shootingDateTimes)
+        if len(locationIndex) == 0 and len(locationIndex.visits) == 0:
+            return results
+
+        targets = [i for i, shootingDateTime in enumerate(shootingDateTimes) if shootingDateTime is not None]
+        matches = self._matcher(locationIndex).matchMany(
+            [datetimeToMs(cast(datetime, shootingDateTimes[i])) for i in targets])
+        for i, match in zip(targets, matches):
+            results[i] = match
+        return results
+
+    def _rawLocationFilter(self) -> RawLocationFilter:
+        """ 生のロケーション履歴を読み込むときに間引く条件を返す """
+        return RawLocationFilter(
+            maxAccuracyM=self.rawMaxAccuracyM,
+            duplicateDistanceM=self.rawDuplicateDistanceM,
+            stayRadiusM=self.rawStayRadiusM,
+            stayMinSec=self.rawStayMinSec,
+        )
+
+    def _matcher(self, locationIndex: LocationIndex) -> LocationMatcher:
+        """ 設定された照合方法で`locationIndex`を探すLocationMatcherを返す """
+        return LocationMatcher(locationIndex, self.toleranceSec * 1000, self.matchStrategy)
 
     def _getShootingDate(self, exifDict) -> Optional[datetime]:
         """ 撮影時間を返す """
 
         dateTimeOriginal = exifDict["Exif"].get(
             piexif.ExifIFD.DateTimeOriginal)
+        return self._parseShootingDate(dateTimeOriginal)
+
+    def _parseShootingDate(self, dateTimeOriginal: Optional[bytes]) -> Optional[datetime]:
+        """ ExifIFD.DateTimeOriginalの値を撮影時間として解釈する """
+
         if dateTimeOriginal is None:
             return None
 
@@ -261,14 +1325,124 @@ class AddGglLoc(object):
 
         return datetime(year, month, day, hour, minute, sec, tzinfo=timezone(timedelta(hours=+9), 'JST'))
 
+def _isNeededForShootingTimes(file: str, cachedEntry: Optional[CacheEntry],
+                              shootingTimes: Sequence[int], toleranceMs: int) -> bool:
+    """ ロケーション履歴ファイルの期間が、いずれかの撮影日時の前後`toleranceMs`に重なればTrueを返す
+
+    期間はキャッシュがあればその内容から、無ければYYYY_MONTH.jsonというファイル名から判断する。
+    期間が分からないファイルは、読み込まないと判断できないのでTrueを返す。
+    """
+
+    if cachedEntry is not None:
+        timeRange = cachedEntry.index.timeRange()
+        if timeRange is None:
+            # 位置情報が1件も無いファイル
+            return False
+    else:
+        timeRange = _monthlyFileTimeRange(file)
+        if timeRange is None:
+            return True
+
+    start, end = timeRange
+    i = bisect_left(shootingTimes, start - toleranceMs)
+    return i < len(shootingTimes) and shootingTimes[i] <= end + toleranceMs
+
+
+def _monthlyFileTimeRange(file: str) -> Optional[Tuple[int, int]]:
+    """ YYYY_MONTH.jsonという名前のファイルの期間をエポックミリ秒で返す。月ごとのファイルでなければNoneを返す。 """
+
+    m = _MONTHLY_FILE_PATTERN.match(os.path.basename(file))
+    if m is None or m.group(2).upper() not in _MONTH_NAMES:
+        return None
+    year = int(m.group(1))
+    month = _MONTH_NAMES.index(m.group(2).upper()) + 1
+    monthStart = datetime(year, month, 1, tzinfo=timezone.utc)
+    nextMonthStart = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    return (datetimeToMs(monthStart - _MONTHLY_FILE_MARGIN), datetimeToMs(nextMonthStart + _MONTHLY_FILE_MARGIN))
+
+
+def _describeLocation(locationLog: LocationLog) -> str:
+    """ ログに出力する位置情報の説明 """
+    return f"({locationLog.lat}, {locationLog.lon}) {'' if locationLog.areaInformation is None else f',{locationLog.areaInformation}'}"
+
+
+def _isUnder(path: str, baseDir: str) -> bool:
+    """ `path`が`baseDir`の配下にあればTrueを返す """
+    baseDir = os.path.abspath(baseDir)
+    return os.path.commonpath([os.path.abspath(path), baseDir]) == baseDir
+
+
+def _countJpegBytes(timer: StageTimer, jpeg: JpegFile) -> None:
+    """ JPEGファイルから読み込んだバイト数とカーネル内でコピーしたバイト数を`timer`に加える """
+    timer.count("jpegBytesRead", jpeg.bytesRead)
+    timer.count("jpegBytesCopied", jpeg.bytesCopied)
+
+
+def _loadLocationLogFile(file: str, nameTable: Optional[NameTable] = None,
+                         rawFilter: Optional[RawLocationFilter] = None) -> Tuple[LocationIndex, Dict[str, float]]:
+    """ ロケーション履歴ファイルを1つ読み込み、タイムスタンプ順のLocationIndexと段階ごとの処理時間を返す。
+
+    プロセスプールのワーカーでも呼び出すため、モジュールの関数にしている。
+    """
+    timer = StageTimer()
+    builder = LocationIndexBuilder(nameTable)
+    with timer.measure("parse"):
+        builder.extend(GoogleLocationLogLoader.load(file, rawFilter))
+    with timer.measure("sort"):
+        locationIndex = builder.build()
+    return locationIndex, timer.timings
+
+
+# プロセスプールの各ワーカーが保持する処理対象とロケーション履歴
+_workerAddGglLoc: Optional[AddGglLoc] = None
+_workerLocationIndex: Optional[LocationIndex] = None
+
+
+def _initWorker(addGglLoc: AddGglLoc, locationIndex: LocationIndex) -> None:
+    """ プロセスプールのワーカーを初期化する。 """
+    global _workerAddGglLoc, _workerLocationIndex
+    _workerAddGglLoc = addGglLoc
+    _workerLocationIndex = locationIndex
+    if addGglLoc.inPlace and (addGglLoc.undoJournalPath is not None):
+        # ジャーナルは記録ごとにコミットするので、ワーカーの終了時に閉じなくてもよい
+        addGglLoc._undoJournal = UndoJournal(addGglLoc._shardPath(addGglLoc.undoJournalPath))
+
+
+def _processFileInWorker(file: str, planned: Optional[PlanEntry] = None) -> "FileProcessResult":
+    """ プロセスプールのワーカーで1ファイル処理する。 """
+    assert _workerAddGglLoc is not None and _workerLocationIndex is not None
+    return _workerAddGglLoc._processFileSafely(_workerLocationIndex, file, planned)
+
+
 @dataclasses.dataclass
 class FileProcessResult:
 
-    status: Literal["ADDED", "SKIP", "ERROR", "WARN"]
+    status: Literal["ADDED", "SKIP", "ERROR", "WARN", "PLANNED"]
     successMsg: Optional[str] = dataclasses.field(default=None)
     errorMsg: Optional[str] = dataclasses.field(default=None)
     exeption: Optional[Exception] = dataclasses.field(default=None)
 
+    # 付与した位置情報
+    locationLog: Optional[LocationLog] = dataclasses.field(default=None)
+
+    # 照合した結果（時間差と確からしさ。計画ファイルを適用した場合などはNone）
+    match: Optional[LocationMatch] = dataclasses.field(default=None)
+
+    # 処理前のファイルサイズと更新日時（マニフェストに記録する）
+    fileSize: Optional[int] = dataclasses.field(default=None)
+    fileMtimeNs: Optional[int] = dataclasses.field(default=None)
+
+    # マニフェストにより処理済みとして読み飛ばしたか
+    resumed: bool = dataclasses.field(default=False)
+
+    # 段階ごとの処理時間（秒）
+    timings: Dict[str, float] = dataclasses.field(default_factory=dict)
+
+    # JPEGファイルからPythonに読み込んだバイト数、カーネル内でコピーしたバイト数、書き出したバイト数
+    bytesRead: int = dataclasses.field(default=0)
+    bytesCopied: int = dataclasses.field(default=0)
+    bytesWritten: int = dataclasses.field(default=0)
+
 
 class AddGglLocException(Exception):
     def __init__(self, message):
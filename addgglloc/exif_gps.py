@@ -0,0 +1,167 @@
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+import piexif
+
+from .exif_scan import readIfd
+
+
+_TAG_GPS_IFD = 0x8825
+""" IFD0のGPS IFDへのポインタ（GPSInfo） """
+
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+""" TIFFの型ごとの1要素のバイト数 """
+
+_TYPE_BYTE = 1
+_TYPE_ASCII = 2
+_TYPE_SHORT = 3
+_TYPE_LONG = 4
+_TYPE_RATIONAL = 5
+_TYPE_UNDEFINED = 7
+_TYPE_SRATIONAL = 10
+
+_GPS_VERSION_ID = (2, 0, 0, 0)
+""" GPS IFDにバージョンが無いときに付け加える値（LocationLog.writeToと同じ） """
+
+_MAX_EXIF_SIZE = 65533 - 6
+""" APP1セグメントに収まるTIFF構造の最大バイト数（セグメント長とExifヘッダの分を除く） """
+
+_RawEntry = Tuple[int, int, bytes]
+""" 書き出すIFDエントリ(型, 個数, 値のバイト列) """
+
+
+def insertGpsIfd(tiff: bytes, gpsTags: Dict[int, Any]) -> Optional[bytes]:
+    """ ExifのTIFF構造のうちGPS IFDだけを差し替えたものを返す
+
+    元のバイト列は1バイトも変えずに残し、末尾に新しいGPS IFDを追加する。
+    IFD0にGPS IFDへのポインタがあればその値だけを書き換え、無ければポインタを加えたIFD0を末尾に追加して
+    ヘッダのIFD0へのオフセットを付け替える。他のIFDやサムネイル、メーカーノートは動かさないので、
+    それらの中のオフセットもそのまま有効である。
+    既存のGPS IFDのエントリのうち`gpsTags`に無いものは引き継ぐ。
+    解釈できない構造や、APP1セグメントに収まらない場合はNoneを返す。
+    """
+
+    try:
+        if tiff[0:2] == b"II":
+            endian = "<"
+        elif tiff[0:2] == b"MM":
+            endian = ">"
+        else:
+            return None
+
+        ifd0Offset = struct.unpack(endian + "L", tiff[4:8])[0]
+        ifd0 = readIfd(tiff, endian, ifd0Offset)
+        ifd0Count = len(ifd0)
+        nextIfdOffset = tiff[ifd0Offset + 2 + ifd0Count * 12:ifd0Offset + 6 + ifd0Count * 12]
+        if len(ifd0) != struct.unpack(endian + "H", tiff[ifd0Offset:ifd0Offset + 2])[0] or len(nextIfdOffset) != 4:
+            # 同じタグが重複しているIFD0は書き換えない
+            return None
+
+        # 既存のGPS IFDのエントリを引き継ぎ、新しい値で上書きする
+        gpsEntries: Dict[int, _RawEntry] = {}
+        if _TAG_GPS_IFD in ifd0:
+            gpsOffset = struct.unpack(endian + "L", ifd0[_TAG_GPS_IFD][2])[0]
+            for tag, entry in readIfd(tiff, endian, gpsOffset).items():
+                rawEntry = _readRawEntry(tiff, endian, entry)
+                if rawEntry is None:
+                    return None
+                gpsEntries[tag] = rawEntry
+        if piexif.GPSIFD.GPSVersionID not in gpsEntries and piexif.GPSIFD.GPSVersionID not in gpsTags:
+            gpsEntries[piexif.GPSIFD.GPSVersionID] = _encodeValue(endian, _TYPE_BYTE, _GPS_VERSION_ID)
+        for tag, value in gpsTags.items():
+            gpsEntries[tag] = _encodeValue(endian, piexif.TAGS["GPS"][tag]["type"], value)
+
+        out = bytearray(tiff)
+        _pad(out)
+        if _TAG_GPS_IFD in ifd0:
+            # ポインタの値だけを新しいGPS IFDの位置に書き換える
+            index = list(ifd0).index(_TAG_GPS_IFD)
+            pointerOffset = ifd0Offset + 2 + index * 12 + 8
+            out[pointerOffset:pointerOffset + 4] = struct.pack(endian + "L", len(out))
+        else:
+            # ポインタを加えたIFD0を末尾に追加する（エントリの値やオフセットは元のものをそのまま使う）
+            ifd0Entries: List[Tuple[int, int, int, bytes]] = [
+                (tag, type_, count, value) for tag, (type_, count, value) in ifd0.items()
+            ]
+            newIfd0Offset = len(out)
+            gpsOffset = newIfd0Offset + 2 + (ifd0Count + 1) * 12 + 4
+            ifd0Entries.append((_TAG_GPS_IFD, _TYPE_LONG, 1, struct.pack(endian + "L", gpsOffset)))
+            ifd0Entries.sort(key=lambda entry: entry[0])
+            out += struct.pack(endian + "H", len(ifd0Entries))
+            for tag, type_, count, value in ifd0Entries:
+                out += struct.pack(endian + "HHL", tag, type_, count) + value
+            out += nextIfdOffset
+            out[4:8] = struct.pack(endian + "L", newIfd0Offset)
+
+        _writeIfd(out, endian, gpsEntries)
+    except (struct.error, IndexError, KeyError, ValueError, TypeError):
+        return None
+
+    if len(out) > _MAX_EXIF_SIZE:
+        return None
+    return bytes(out)
+
+
+def _readRawEntry(tiff: bytes, endian: str, entry: Tuple[int, int, bytes]) -> Optional[_RawEntry]:
+    """ IFDエントリの値のバイト列を取り出す。未知の型ならNoneを返す。 """
+
+    type_, count, value = entry
+    typeSize = _TYPE_SIZES.get(type_)
+    if typeSize is None:
+        return None
+    size = typeSize * count
+    if size <= 4:
+        return (type_, count, value[:size])
+    offset = struct.unpack(endian + "L", value)[0]
+    if offset + size > len(tiff):
+        raise ValueError("value out of range")
+    return (type_, count, tiff[offset:offset + size])
+
+
+def _encodeValue(endian: str, type_: int, value: Any) -> _RawEntry:
+    """ piexifの辞書と同じ形式の値を、IFDエントリの(型, 個数, 値のバイト列)にする """
+
+    if type_ in (_TYPE_ASCII, _TYPE_UNDEFINED):
+        data = value.encode("latin1") if isinstance(value, str) else bytes(value)
+        if type_ == _TYPE_ASCII:
+            # piexifと同じくNUL終端を付ける
+            data += b"\x00"
+        return (type_, len(data), data)
+
+    if type_ in (_TYPE_RATIONAL, _TYPE_SRATIONAL):
+        # (分子, 分母)が1つだけなら、その1組の値とみなす
+        pairs = (value,) if isinstance(value[0], int) else value
+        fmt = "L" if type_ == _TYPE_RATIONAL else "l"
+        data = b"".join(struct.pack(endian + fmt * 2, numerator, denominator) for numerator, denominator in pairs)
+        return (type_, len(pairs), data)
+
+    values = (value,) if isinstance(value, int) else tuple(value)
+    fmt = {_TYPE_BYTE: "B", _TYPE_SHORT: "H", _TYPE_LONG: "L"}[type_]
+    return (type_, len(values), struct.pack(endian + fmt * len(values), *values))
+
+
+def _writeIfd(out: bytearray, endian: str, entries: Dict[int, _RawEntry]) -> None:
+    """ IFDを`out`の末尾に追加する。4バイトを超える値はIFDの直後に置く。 """
+
+    tags = sorted(entries)
+    dataOffset = len(out) + 2 + len(tags) * 12 + 4
+    ifd = bytearray(struct.pack(endian + "H", len(tags)))
+    data = bytearray()
+    for tag in tags:
+        type_, count, value = entries[tag]
+        if len(value) <= 4:
+            ifd += struct.pack(endian + "HHL", tag, type_, count) + value.ljust(4, b"\x00")
+        else:
+            ifd += struct.pack(endian + "HHLL", tag, type_, count, dataOffset + len(data))
+            data += value
+            # 値の位置はワード境界にそろえる
+            _pad(data)
+    ifd += struct.pack(endian + "L", 0)
+    out += ifd
+    out += data
+
+
+def _pad(buffer: bytearray) -> None:
+    """ 長さが偶数になるよう詰め物を加える """
+    if len(buffer) % 2 == 1:
+        buffer += b"\x00"
@@ -0,0 +1,160 @@
+import dataclasses
+import struct
+from typing import Dict, Optional, Tuple
+
+
+_PREFIX_SIZE = 16 * 1024
+""" 最初に読み込むバイト数。多くのJPEGはこの範囲にExifが収まっている。 """
+
+_MAX_SEGMENTS = 64
+""" Exifを探すときに読み飛ばすセグメント数の上限 """
+
+_TAG_EXIF_IFD = 0x8769
+_TAG_GPS_IFD = 0x8825
+_TAG_DATE_TIME_ORIGINAL = 0x9003
+_TAGS_GPS_LOCATION = (0x0001, 0x0002, 0x0003, 0x0004)
+""" 位置情報を表すGPSタグ（GPSLatitudeRef, GPSLatitude, GPSLongitudeRef, GPSLongitude） """
+
+_TYPE_ASCII = 2
+
+
+@dataclasses.dataclass
+class ExifScanResult:
+    """ ヘッダだけを読んで分かったExifの情報 """
+
+    # GPS IFDに位置情報（緯度経度とその方位）がそろっているか
+    hasLocation: bool
+
+    # ExifIFD.DateTimeOriginalの値。無ければNone
+    dateTimeOriginal: Optional[bytes]
+
+    # ファイルから読み込んだバイト数（scanExifのみ設定する）
+    bytesRead: int = 0
+
+
+def scanExif(path: str) -> Optional[ExifScanResult]:
+    """ JPEGファイルの先頭だけを読み、位置情報の有無と撮影日時を返す。
+
+    piexif.loadのようにExif全体を辞書にせず、必要なIFDのエントリだけを最小限たどる。
+    解釈できない構造の場合はNoneを返すので、呼び出し元は通常の読み込みにフォールバックすること。
+    """
+
+    with open(path, "rb") as f:
+        prefix = f.read(_PREFIX_SIZE)
+        if prefix[0:2] != b"\xff\xd8":
+            return None
+        bytesRead = len(prefix)
+
+        def read(pos: int, size: int) -> bytes:
+            """ ファイルのposからsizeバイトを返す。先頭で読んだ範囲に無ければ読み足す。 """
+            nonlocal bytesRead
+            if pos + size <= len(prefix):
+                return prefix[pos:pos + size]
+            f.seek(pos)
+            data = f.read(size)
+            bytesRead += len(data)
+            return data
+
+        # Exif(APP1)セグメントを探す
+        pos = 2
+        for _ in range(_MAX_SEGMENTS):
+            header = read(pos, 10)
+            if len(header) < 4 or header[0] != 0xFF:
+                return None
+            marker = header[1]
+            if marker == 0xFF:
+                # フィルバイト
+                pos += 1
+                continue
+            if marker == 0xDA or marker == 0xD9:
+                # SOS（画像データ）までにExifが無かった
+                return ExifScanResult(False, None, bytesRead)
+            if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                # 長さを持たないマーカー
+                pos += 2
+                continue
+            length = struct.unpack(">H", header[2:4])[0]
+            if length < 2:
+                return None
+            if marker == 0xE1 and header[4:10] == b"Exif\x00\x00":
+                tiff = read(pos + 10, length - 8)
+                if len(tiff) != length - 8:
+                    return None
+                result = scanTiff(tiff)
+                if result is not None:
+                    result.bytesRead = bytesRead
+                return result
+            pos += 2 + length
+
+    return None
+
+
+def scanTiff(tiff: bytes) -> Optional[ExifScanResult]:
+    """ TIFF構造からGPS IFDの位置情報の有無とDateTimeOriginalを取り出す """
+
+    try:
+        if tiff[0:2] == b"II":
+            endian = "<"
+        elif tiff[0:2] == b"MM":
+            endian = ">"
+        else:
+            return None
+
+        ifd0 = readIfd(tiff, endian, struct.unpack(endian + "L", tiff[4:8])[0])
+
+        hasLocation = False
+        if _TAG_GPS_IFD in ifd0:
+            gpsIfd = readIfd(tiff, endian, _longValue(tiff, endian, ifd0[_TAG_GPS_IFD]))
+            hasLocation = all(tag in gpsIfd for tag in _TAGS_GPS_LOCATION)
+
+        dateTimeOriginal = None
+        if _TAG_EXIF_IFD in ifd0:
+            exifIfd = readIfd(tiff, endian, _longValue(tiff, endian, ifd0[_TAG_EXIF_IFD]))
+            if _TAG_DATE_TIME_ORIGINAL in exifIfd:
+                dateTimeOriginal = _asciiValue(tiff, endian, exifIfd[_TAG_DATE_TIME_ORIGINAL])
+
+        return ExifScanResult(hasLocation, dateTimeOriginal)
+    except (struct.error, IndexError, ValueError):
+        return None
+
+
+IfdEntry = Tuple[int, int, bytes]
+""" IFDエントリ(型, 個数, 値または値へのオフセット(4バイト)) """
+
+
+def readIfd(tiff: bytes, endian: str, offset: int) -> Dict[int, IfdEntry]:
+    """ IFDのエントリをタグ番号をキーにして返す """
+
+    count = struct.unpack(endian + "H", tiff[offset:offset + 2])[0]
+    if offset + 2 + count * 12 > len(tiff):
+        raise ValueError("IFD out of range")
+    entries: Dict[int, IfdEntry] = {}
+    for i in range(count):
+        entryOffset = offset + 2 + i * 12
+        tag, type_, num = struct.unpack(endian + "HHL", tiff[entryOffset:entryOffset + 8])
+        entries[tag] = (type_, num, tiff[entryOffset + 8:entryOffset + 12])
+    return entries
+
+
+def _longValue(tiff: bytes, endian: str, entry: IfdEntry) -> int:
+    """ LONG型（IFDへのポインタ）の値を返す """
+    return struct.unpack(endian + "L", entry[2])[0]
+
+
+def _asciiValue(tiff: bytes, endian: str, entry: IfdEntry) -> bytes:
+    """ ASCII型の値を、末尾のNULを除いて返す
+
+    ASCII型でなければ例外を送出する（scanTiffはNoneを返し、呼び出し元の通常の読み込みでエラーとして扱われる）。
+    """
+
+    type_, num, value = entry
+    if type_ != _TYPE_ASCII:
+        raise ValueError("value is not ASCII")
+    if num <= 4:
+        raw = value[:num]
+    else:
+        offset = struct.unpack(endian + "L", value)[0]
+        if offset + num > len(tiff):
+            raise ValueError("value out of range")
+        raw = tiff[offset:offset + num]
+    return raw.rstrip(b"\x00")
@@ -0,0 +1,101 @@
+import os
+import queue
+import threading
+import time
+from typing import Any, Generic, Iterable, Iterator, Tuple, TypeVar
+
+
+T = TypeVar("T")
+
+_ITEM = 0
+_END = 1
+_ERROR = 2
+
+
+def walkFiles(baseDir: str, extensions: Tuple[str, ...]) -> Iterator[str]:
+    """ `baseDir`配下のファイルのうち、拡張子（小文字で比較）が`extensions`のいずれかのものを見つけた順に返す。
+
+    os.walkのようにディレクトリごとの一覧を作らず、os.scandirの結果をそのまま流す。
+    os.walkと同じく、シンボリックリンクのディレクトリはたどらず、読めないディレクトリは無視する。
+    """
+
+    stack = [baseDir]
+    while stack:
+        curDir = stack.pop()
+        subDirs = []
+        try:
+            with os.scandir(curDir) as entries:
+                for entry in entries:
+                    try:
+                        isDir = entry.is_dir()
+                    except OSError:
+                        isDir = False
+                    if isDir:
+                        if not entry.is_symlink():
+                            subDirs.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in extensions:
+                        yield entry.path
+        except OSError:
+            continue
+        # os.walkと同じく、見つけた順にたどる
+        stack.extend(reversed(subDirs))
+
+
+class BackgroundIterator(Generic[T]):
+    """ イテレータを別スレッドで回し、要素を上限付きのキューで受け渡す
+
+    ディレクトリの走査などを後続の処理と並行させるために使う。
+    キューが一杯になると生成側が待つので、消費側より先に進みすぎることはない。
+    生成側で発生した例外は、消費側で送出する。
+    """
+
+    def __init__(self, iterable: Iterable[T], maxSize: int):
+        # ここまでに生成された要素数
+        self.count = 0
+
+        # 生成側がすべての要素を生成し終えたか
+        self.done = False
+
+        # 生成にかかった時間（秒）
+        self.elapsedSec = 0.0
+
+        self._queue: "queue.Queue[Tuple[int, Any]]" = queue.Queue(maxSize)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(iterable,), daemon=True)
+        self._thread.start()
+
+    def __iter__(self) -> Iterator[T]:
+        try:
+            while True:
+                kind, value = self._queue.get()
+                if kind == _END:
+                    return
+                if kind == _ERROR:
+                    raise value
+                yield value
+        finally:
+            # 途中で消費をやめた場合も生成側を止める
+            self._stop.set()
+
+    def _run(self, iterable: Iterable[T]) -> None:
+        start = time.perf_counter()
+        try:
+            for item in iterable:
+                self.count += 1
+                if not self._put((_ITEM, item)):
+                    return
+            self.done = True
+            self.elapsedSec = time.perf_counter() - start
+            self._put((_END, None))
+        except BaseException as e:
+            self._put((_ERROR, e))
+
+    def _put(self, message: Tuple[int, Any]) -> bool:
+        """ キューに空きができるまで待って入れる。消費側が止まっていればFalseを返す。 """
+        while not self._stop.is_set():
+            try:
+                self._queue.put(message, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
@@ -3,29 +3,35 @@
 import datetime
 import json
 from logging import getLogger
-from typing import Any, Dict, List
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
 
 from . import NAME_LOGER
-from .location_log import LocationLog
+from .location_index import LocationRecord, TimelineRecord, VisitRecord, datetimeToMs
+from .raw_location_filter import RawLocationDownsampler, RawLocationFilter
 
 
 logger = getLogger(NAME_LOGER)
 
+_RE_UTC_TIMESTAMP = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]{1,6})?Z\Z")
+""" UTCのタイムスタンプ（"2018-04-16T03:22:42.995Z"など）にマッチする正規表現 """
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+""" エポックの日付の序数 """
+
 
 class GoogleLocationLogLoader(object):
     """ Googleのロケーション履歴ファイル(.json)を読みこむ """
 
     @classmethod
-    def load(cls, fileName: str) -> List[LocationLog]:
-        """ Googleのロケーション履歴ファイル(.json)を読み込み、LocationLogの配列にして返す。
+    def load(cls, fileName: str, rawFilter: Optional[RawLocationFilter] = None) -> Iterator[TimelineRecord]:
+        """ Googleのロケーション履歴ファイル(.json)を読み込み、LocationRecordかVisitRecordを1件ずつ返す。
         戻り値はソートされていない。
+
+        ファイル全体をメモリに載せないよう、`timelineObjects`（または`locations`）の配列を
+        要素ごとに読み進める。ファイル構造が不正な場合は、途中まで返したあとで例外を送出する。
+        `rawFilter`を渡すと、生のロケーション履歴（`locations`）は読み込みながらその条件で間引く。
         """
-        
-        with open(fileName, "r", encoding="utf-8") as f:
-            try:
-                file = json.load(f)
-            except json.decoder.JSONDecodeError as e:
-                raise InvalidFileFormatException("Json parse error.") from e
 
         # 以下構造を読み込む
         # {
@@ -38,28 +44,62 @@ class GoogleLocationLogLoader(object):
         #         ・・・
         #     ]
         # }
-        try:
-            locationLogs = []
-            for timelineObject in file["timelineObjects"]:
-                if "activitySegment" in timelineObject:
-                    locationLogs.extend(
-                        cls._processActivtySegment(
-                            timelineObject["activitySegment"])
-                    )
-                elif "placeVisit" in timelineObject:
-                    locationLogs.extend(
-                        cls._processPlaceVisit(timelineObject["placeVisit"])
-                    )
-        except KeyError as e:
-            keyName = e.args[0]
-            raise InvalidFileFormatException(f"Json key '{keyName}' not found.")  from e
-        except Exception as e:
-            raise InvalidFileFormatException(f"{e}")  from e
-        
-        return locationLogs
+        # または、生のロケーション履歴（Records.json）の以下構造を読み込む
+        # {
+        #     "locations": [
+        #         {
+        #             "latitudeE7": 355050042,
+        #             "longitudeE7": 1387341570,
+        #             "timestamp": "2018-04-16T03:22:42.995Z",
+        #             (略)
+        #         },
+        #         ・・・
+        #     ]
+        # }
+        downsampler = None if rawFilter is None else RawLocationDownsampler(rawFilter)
+        with open(fileName, "r", encoding="utf-8") as f:
+            try:
+                for key, element in _JsonArrayStreamReader(f).iterItems(("timelineObjects", "locations")):
+                    if key == "timelineObjects":
+                        if "activitySegment" in element:
+                            yield from cls._processActivtySegment(element["activitySegment"])
+                        elif "placeVisit" in element:
+                            yield from cls._processPlaceVisit(element["placeVisit"])
+                    elif downsampler is None:
+                        yield cls._processLocation(element)
+                    else:
+                        yield from downsampler.push(cls._processLocation(element), element.get("accuracy"))
+                if downsampler is not None:
+                    yield from downsampler.flush()
+            except json.decoder.JSONDecodeError as e:
+                raise InvalidFileFormatException("Json parse error.") from e
+            except InvalidFileFormatException:
+                raise
+            except KeyError as e:
+                keyName = e.args[0]
+                raise InvalidFileFormatException(f"Json key '{keyName}' not found.")  from e
+            except Exception as e:
+                raise InvalidFileFormatException(f"{e}")  from e
 
     @classmethod
-    def _processActivtySegment(cls, activtySegment: Dict[str, Any]) -> List[LocationLog]:
+    def _processLocation(cls, location: Dict[str, Any]) -> LocationRecord:
+        """ 生のロケーション履歴（Records.jsonの`locations`の要素）を読み込む """
+
+        # {
+        #   "latitudeE7": 355050042,
+        #   "longitudeE7": 1387341570,
+        #   "accuracy": 20,
+        #   "timestamp": "2018-04-16T03:22:42.995Z"
+        # }
+        # 古い形式では`timestamp`の代わりに`timestampMs`（エポックミリ秒の文字列）が入っている。
+        if "timestampMs" in location:
+            timestampMs = int(location["timestampMs"])
+        else:
+            timestampMs = cls._convertTimestamp(location["timestamp"])
+        return (timestampMs, location["latitudeE7"], location["longitudeE7"], None)
+
+    @classmethod
+    def _processActivtySegment(cls, activtySegment: Dict[str, Any]) -> List[LocationRecord]:
         """ ActivtySegmentを読み込む """
 
         # `activitySegment`は移動を表します。
@@ -102,32 +142,35 @@ class GoogleLocationLogLoader(object):
         locationLogs = []
 
         if "latitudeE7" in activtySegment["startLocation"]:
-            locationLogs.append(LocationLog(**{
-                "timestamp": cls._convertTimestamp(activtySegment["duration"]["startTimestamp"]),
-                "lat": cls._e7ToDegree(activtySegment["startLocation"]["latitudeE7"]),
-                "lon": cls._e7ToDegree(activtySegment["startLocation"]["longitudeE7"]),
-            }))
+            locationLogs.append((
+                cls._convertTimestamp(activtySegment["duration"]["startTimestamp"]),
+                activtySegment["startLocation"]["latitudeE7"],
+                activtySegment["startLocation"]["longitudeE7"],
+                None,
+            ))
         if "latitudeE7" in activtySegment["endLocation"]:
-            locationLogs.append(LocationLog(**{
-                "timestamp": cls._convertTimestamp(activtySegment["duration"]["endTimestamp"]),
-                "lat": cls._e7ToDegree(activtySegment["endLocation"]["latitudeE7"]),
-                "lon": cls._e7ToDegree(activtySegment["endLocation"]["longitudeE7"]),
-            }))
+            locationLogs.append((
+                cls._convertTimestamp(activtySegment["duration"]["endTimestamp"]),
+                activtySegment["endLocation"]["latitudeE7"],
+                activtySegment["endLocation"]["longitudeE7"],
+                None,
+            ))
 
         if "simplifiedRawPath" not in activtySegment:
             return locationLogs
 
         for p in activtySegment["simplifiedRawPath"]["points"]:
-            locationLogs.append(LocationLog(**{
-                "timestamp": cls._convertTimestamp(p["timestamp"]),
-                "lat": cls._e7ToDegree(p["latE7"]),
-                "lon": cls._e7ToDegree(p["lngE7"]),
-            }))
+            locationLogs.append((
+                cls._convertTimestamp(p["timestamp"]),
+                p["latE7"],
+                p["lngE7"],
+                None,
+            ))
 
         return locationLogs
 
     @classmethod
-    def _processPlaceVisit(cls, placeVisitSegment: Dict[str, Any]) -> List[LocationLog]:
+    def _processPlaceVisit(cls, placeVisitSegment: Dict[str, Any]) -> List[VisitRecord]:
         """ PlaceVisitを読み込みます。 """
         # {
         #   "placeVisit": {
@@ -146,67 +189,174 @@ class GoogleLocationLogLoader(object):
         #      (略)
         #   }
         # }
-        locationLogs = []
-
         if "latitudeE7" not in placeVisitSegment["location"]:
-            return locationLogs
+            return []
 
-        lat = cls._e7ToDegree(placeVisitSegment["location"]["latitudeE7"])
-        lon = cls._e7ToDegree(placeVisitSegment["location"]["longitudeE7"])
-        name = placeVisitSegment.get("name")
+        lat = placeVisitSegment["location"]["latitudeE7"]
+        lon = placeVisitSegment["location"]["longitudeE7"]
+        name = placeVisitSegment["location"].get("name")
 
         start = cls._convertTimestamp(
             placeVisitSegment["duration"]["startTimestamp"])
         end = cls._convertTimestamp(
             placeVisitSegment["duration"]["endTimestamp"])
 
-        # 到着時間のログを作成
-        current = start
-        locationLogs.append(LocationLog(**{
-            "timestamp": start,
-            "lat": lat,
-            "lon": lon,
-            "areaInformation": name
-        }))
-
-        # 到着から出発までの間のログを作成
-        # TODO 5分は可変にしたほうがいいんだろうな
-        while (end - current).total_seconds() > (5 * 60):
-            current = current + datetime.timedelta(minutes=5)
-            locationLogs.append(LocationLog(**{
-                "timestamp": current,
-                "lat": lat,
-                "lon": lon,
-                "areaInformation": name
-            }))
-
-        # 出発時間のログを作成
-        locationLogs.append(LocationLog(**{
-            "timestamp": end,
-            "lat": lat,
-            "lon": lon,
-            "areaInformation": name
-        }))
-
-        return locationLogs
+        # 到着から出発までを1件の滞在として扱う
+        return [(start, max(start, end), lat, lon, name)]
 
     @staticmethod
-    def _convertTimestamp(timestampStr: str) -> datetime.datetime:
-        """ 文字列からタイムスタンプを作成 """
+    def _convertTimestamp(timestampStr: str) -> int:
+        """ 文字列からタイムスタンプ（エポックミリ秒）を作成 """
+
+        # ほぼすべてのタイムスタンプは"2018-04-16T03:22:42.995Z"か"2018-04-16T03:22:42Z"の形式なので、
+        # strptimeを使わずに直接エポックミリ秒を計算する
+        # （なぜだかミリセカンドが入っていたりいなかったりする）
+        if len(timestampStr) >= 20 and timestampStr[-1] == "Z" and _RE_UTC_TIMESTAMP.match(timestampStr):
+            days = datetime.date(
+                int(timestampStr[0:4]), int(timestampStr[5:7]), int(timestampStr[8:10])
+            ).toordinal() - _EPOCH_ORDINAL
+            hour = int(timestampStr[11:13])
+            minute = int(timestampStr[14:16])
+            sec = int(timestampStr[17:19])
+            # 小数部はミリ秒未満を切り捨てる
+            fraction = timestampStr[20:-1]
+            ms = int((fraction + "00")[:3]) if fraction else 0
+            if hour < 24 and minute < 60 and sec < 60:
+                return ((days * 24 + hour) * 60 + minute) * 60000 + sec * 1000 + ms
 
-        # なぜだかミリセカンドが入っていたりいなかったりするので処理分岐
+        # それ以外の形式（タイムゾーンのオフセット付きなど）は従来どおりstrptimeで解釈する
         try:
-            return datetime.datetime.strptime(timestampStr, "%Y-%m-%dT%H:%M:%S.%f%z")
+            dt = datetime.datetime.strptime(timestampStr, "%Y-%m-%dT%H:%M:%S.%f%z")
         except ValueError:
-            return datetime.datetime.strptime(timestampStr, "%Y-%m-%dT%H:%M:%S%z")
+            dt = datetime.datetime.strptime(timestampStr, "%Y-%m-%dT%H:%M:%S%z")
+        return datetimeToMs(dt)
 
-    @staticmethod
-    def _e7ToDegree(e7: int) -> float:
-        """ e7型式を角度に変換 """
+class _JsonArrayStreamReader(object):
+    """ JSONのトップレベルのオブジェクトから、指定したキーの配列の要素を1つずつ読み出す
+
+    ファイルを少しずつ読み込み、配列の要素単位で`json.JSONDecoder.raw_decode`する。
+    メモリに保持するのは読み込み途中の要素1つ分程度で済む。
+    """
+
+    _CHUNK_SIZE = 1024 * 1024
+    """ 1回に読み込む文字数 """
+
+    _NUMBER_MARGIN = 64
+    """ 値の読み終わりがバッファの末尾からこの文字数以内なら、数値が途中で切れている可能性がある """
+
+    _WHITESPACES = " \t\n\r"
+    """ JSONの空白文字 """
+
+    def __init__(self, f: TextIO):
+        self._f = f
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def iterItems(self, keys: Iterable[str]) -> Iterator[Tuple[str, Any]]:
+        """ (キー, 配列の要素)を順に返す。いずれのキーも無ければInvalidFileFormatExceptionを送出する。 """
+
+        keys = tuple(keys)
+        found = False
+
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+        else:
+            while True:
+                key = self._decode()
+                if not isinstance(key, str):
+                    raise self._error("Object key expected")
+                self._expect(":")
+                if key in keys:
+                    found = True
+                    yield from ((key, item) for item in self._iterArray())
+                else:
+                    self._decode()
+                if self._nextSeparator("}"):
+                    break
+
+        if not found:
+            raise InvalidFileFormatException(f"Json key '{keys[0]}' not found.")
+
+    def _iterArray(self) -> Iterator[Any]:
+        """ 配列の要素を順に返す """
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._decode()
+            if self._nextSeparator("]"):
+                return
+
+    def _decode(self) -> Any:
+        """ 現在位置から値を1つ読み込む """
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.decoder.JSONDecodeError:
+                # 値が読み込み済みの範囲に収まっていないだけなら、続きを読み込んで再試行する
+                if self._fill():
+                    continue
+                raise
+            # 数値はバッファの末尾付近で切れていても（"1.5"が"1."で切れているなど）途中まで読めてしまうので、
+            # 末尾付近で読み終わった場合は続きを読み込んで再試行する
+            if len(self._buffer) - end < self._NUMBER_MARGIN and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _expect(self, char: str) -> None:
+        """ 現在位置の文字が`char`であることを確認して読み進める """
+        if self._peek() != char:
+            raise self._error(f"Expecting '{char}'")
+        self._pos += 1
+
+    def _nextSeparator(self, closing: str) -> bool:
+        """ 要素の区切りを読み進める。閉じ括弧`closing`ならTrue、カンマならFalseを返す。 """
+        char = self._next()
+        if char == closing:
+            return True
+        if char != ",":
+            self._pos -= 1
+            raise self._error(f"Expecting ',' or '{closing}'")
+        return False
+
+    def _next(self) -> str:
+        """ 空白を読み飛ばし、次の文字を返して読み進める """
+        char = self._peek()
+        self._pos += 1
+        return char
+
+    def _peek(self) -> str:
+        """ 空白を読み飛ばし、次の文字を返す。ファイル末尾なら空文字を返す。 """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in self._WHITESPACES:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def _fill(self) -> bool:
+        """ 続きを読み込む。ファイル末尾に達していればFalseを返す。 """
+        if self._eof:
+            return False
+        chunk = self._f.read(self._CHUNK_SIZE)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _error(self, message: str) -> json.decoder.JSONDecodeError:
+        """ 現在位置を示すJSONDecodeErrorを作成する """
+        return json.decoder.JSONDecodeError(message, self._buffer, self._pos)
 
-        e7Str = str(e7)
-        degree = int(e7Str[:-7]) + (int(e7Str[-7:]) / 10000000)
-        return degree
 
 class InvalidFileFormatException(Exception):
     def __init__(self, message):
@@ -0,0 +1,274 @@
+import mmap
+import os
+import shutil
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+import piexif
+
+
+_SOI = b"\xff\xd8"
+""" JPEGの開始マーカー """
+
+_EXIF_HEADER = b"Exif\x00\x00"
+""" APP1セグメントのうちExifのものを表す識別子 """
+
+_COPY_CHUNK_SIZE = 8 * 1024 * 1024
+""" 画像データを書き出すときの1回あたりのバイト数 """
+
+_TEMP_SUFFIX = ".addgglloc-tmp"
+""" 元のファイルを置き換えるときに、同じディレクトリに作る一時ファイルの接尾辞 """
+
+
+class JpegFile(object):
+    """ JPEGファイルを1度だけ開き、Exif(APP1)だけを差し替えて書き出す
+
+    ファイルはメモリマップし、実際に読むのは先頭のセグメント部分だけにする。
+    書き出し時、Exif以降の画像データはカーネル内でコピー（copy_file_range/sendfile）し、
+    Pythonのメモリには載せない。
+    """
+
+    def __init__(self, path: str):
+        # ファイルパス
+        self.path = path
+
+        # メモリマップからPythonに読み込んだバイト数と、カーネル内でコピーしたバイト数
+        self.bytesRead = 0
+        self.bytesCopied = 0
+
+        self._file = open(path, "rb")
+        try:
+            self.size = os.fstat(self._file.fileno()).st_size
+            if self.size < 4:
+                raise InvalidJpegException("JPEGファイルではありません。")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self._file.close()
+            raise
+
+        if self._read(0, 2) != _SOI:
+            self.close()
+            raise InvalidJpegException("JPEGファイルではありません。")
+
+        try:
+            self._segments = self._scanSegments()
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self) -> "JpegFile":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """ ファイルを閉じる """
+        self._mmap.close()
+        self._file.close()
+
+    def exifSegment(self) -> Optional[Tuple[int, int]]:
+        """ ExifのAPP1セグメントの(開始位置, 終了位置)を返す。無ければNoneを返す。 """
+        for start, end in self._segments:
+            if self._isExif(start):
+                return (start, end)
+        return None
+
+    def loadExif(self) -> Dict[str, Any]:
+        """ Exifを辞書として読み込む（piexif.loadと同じ形式） """
+        segment = self.exifSegment()
+        if segment is None:
+            return {"0th": {}, "Exif": {}, "GPS": {}, "Interop": {}, "1st": {}, "thumbnail": None}
+        start, end = segment
+        return piexif.load(self._read(start + 4, end))
+
+    def exifTiff(self) -> Optional[bytes]:
+        """ ExifのAPP1セグメントのうち、Exifヘッダに続くTIFF構造のバイト列を返す。無ければNoneを返す。 """
+        segment = self.exifSegment()
+        if segment is None:
+            return None
+        start, end = segment
+        return self._read(start + 4 + len(_EXIF_HEADER), end)
+
+    def writeWithExif(self, outputPath: str, exifBytes: bytes) -> int:
+        """ Exifを`exifBytes`（piexif.dumpの戻り値と同じくExifヘッダから始まるもの）に差し替えたJPEGを書き出し、書き込んだバイト数を返す。
+
+        セグメントの差し替え方はpiexif.insertと同じにしている。
+        """
+
+        if exifBytes[0:6] != _EXIF_HEADER:
+            raise ValueError("Given data is not exif data")
+        app1 = b"\xff\xe1" + struct.pack(">H", len(exifBytes) + 2) + exifBytes
+
+        cutStart, cutEnd = self.replaceRange()
+        with open(outputPath, "wb") as out:
+            out.write(self._read(0, cutStart))
+            out.write(app1)
+            out.flush()
+            copied = _copyRange(self._file.fileno(), self._mmap, out.fileno(), cutEnd, self.size - cutEnd)
+        self.bytesCopied += copied
+        self.bytesRead += self.size - cutEnd - copied
+
+        return cutStart + len(app1) + (self.size - cutEnd)
+
+    def readRange(self, start: int, end: int) -> bytes:
+        """ ファイルの`start`から`end`までの内容を返す """
+        return self._read(start, end)
+
+    def replaceRange(self) -> Tuple[int, int]:
+        """ 新しいExifで置き換える範囲(開始位置, 終了位置)を返す """
+
+        segments = self._segments
+        first = segments[0] if len(segments) > 0 else None
+        second = segments[1] if len(segments) > 1 else None
+
+        # 先頭がAPP0(JFIF)で次がExifなら、APP0ごとExifで置き換える
+        if first is not None and self._isApp0(first[0]):
+            if second is not None and self._isExif(second[0]):
+                return (first[0], second[1])
+            # Exifが後ろのほうにあるならそれを置き換える（piexif.insertではExifが重複してしまう）
+            segment = self.exifSegment()
+            if segment is not None:
+                return segment
+            return first
+
+        # 先頭がExifならそれを置き換える。無ければSOIの直後に挿入する。
+        segment = self.exifSegment()
+        if segment is not None:
+            return segment
+        return (2, 2)
+
+    def _scanSegments(self) -> List[Tuple[int, int]]:
+        """ SOSまでのセグメントの(開始位置, 終了位置)を列挙する """
+
+        segments: List[Tuple[int, int]] = []
+        mm = self._mmap
+        pos = 2
+        while pos + 4 <= self.size:
+            if mm[pos] != 0xFF:
+                raise InvalidJpegException("JPEGのセグメント構造が不正です。")
+            marker = mm[pos + 1]
+            if marker == 0xFF:
+                # フィルバイト
+                pos += 1
+                continue
+            if marker == 0xDA:
+                # SOS以降は画像データ
+                break
+            if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                # 長さを持たないマーカー
+                pos += 2
+                continue
+            length = struct.unpack(">H", mm[pos + 2:pos + 4])[0]
+            end = pos + 2 + length
+            if length < 2 or end > self.size:
+                raise InvalidJpegException("JPEGのセグメント構造が不正です。")
+            segments.append((pos, end))
+            pos = end
+        # マーカーと長さ（セグメントごとに4バイト）だけを読んでいる
+        self.bytesRead += 4 * (len(segments) + 1)
+        return segments
+
+    def _isApp0(self, start: int) -> bool:
+        return self._read(start, start + 2) == b"\xff\xe0"
+
+    def _isExif(self, start: int) -> bool:
+        return self._read(start, start + 2) == b"\xff\xe1" \
+            and self._read(start + 4, start + 10) == _EXIF_HEADER
+
+    def _read(self, start: int, end: int) -> bytes:
+        """ メモリマップから`start`から`end`までを読み込み、読み込んだバイト数を数える """
+        data = self._mmap[start:end]
+        self.bytesRead += len(data)
+        return data
+
+
+def _copyRange(inFd: int, inMap: mmap.mmap, outFd: int, offset: int, count: int) -> int:
+    """ 入力ファイルの`offset`から`count`バイトを出力ファイルの現在位置以降にコピーし、カーネル内でコピーしたバイト数を返す
+
+    copy_file_range（リフリンクやサーバーサイドコピーが効く）、sendfileの順に試し、
+    どちらも使えなければメモリマップから書き出す。
+    """
+
+    total = count
+    copyFileRange = getattr(os, "copy_file_range", None)
+    if copyFileRange is not None:
+        try:
+            while count > 0:
+                copied = copyFileRange(inFd, outFd, count, offset)
+                if copied == 0:
+                    break
+                offset += copied
+                count -= copied
+            if count == 0:
+                return total
+        except OSError:
+            pass
+
+    sendfile = getattr(os, "sendfile", None)
+    if sendfile is not None:
+        try:
+            while count > 0:
+                sent = sendfile(outFd, inFd, offset, min(count, _COPY_CHUNK_SIZE))
+                if sent == 0:
+                    break
+                offset += sent
+                count -= sent
+            if count == 0:
+                return total
+        except OSError:
+            pass
+
+    copied = total - count
+    view = memoryview(inMap)
+    try:
+        while count > 0:
+            size = min(count, _COPY_CHUNK_SIZE)
+            with view[offset:offset + size] as chunk:
+                written = os.write(outFd, chunk)
+            offset += written
+            count -= written
+    finally:
+        view.release()
+    return copied
+
+
+def inPlaceTempPath(path: str) -> str:
+    """ `path`を置き換えるために書き出す一時ファイルのパスを返す
+
+    os.replaceで置き換えられるよう、元のファイルと同じディレクトリにする。
+    """
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}{_TEMP_SUFFIX}")
+
+
+def spliceFile(path: str, offset: int, length: int, data: bytes) -> None:
+    """ ファイルの`offset`から`length`バイトを`data`に置き換える
+
+    一時ファイルに書き出してから置き換えるので、途中で失敗しても元のファイルは壊れない。
+    置き換える範囲より後ろはカーネル内でコピーする。
+    """
+
+    tempPath = inPlaceTempPath(path)
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if offset + length > size:
+                raise ValueError("range out of file")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with open(tempPath, "wb") as out:
+                    out.write(mm[0:offset])
+                    out.write(data)
+                    out.flush()
+                    _copyRange(f.fileno(), mm, out.fileno(), offset + length, size - offset - length)
+        shutil.copymode(path, tempPath)
+        os.replace(tempPath, path)
+    finally:
+        if os.path.lexists(tempPath):
+            os.remove(tempPath)
+
+
+class InvalidJpegException(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
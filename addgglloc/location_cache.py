@@ -0,0 +1,214 @@
+import dataclasses
+import json
+from logging import getLogger
+import mmap
+import os
+import struct
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import NAME_LOGER
+from .location_index import LocationIndex, NameTable, VisitIndex
+
+
+logger = getLogger(NAME_LOGER)
+
+_MAGIC = b"AGLC"
+""" キャッシュファイルの先頭に置く識別子 """
+
+_VERSION = 2
+""" キャッシュファイル形式のバージョン。形式を変えたら上げる。 """
+
+_HEADER = struct.Struct("<4sIBxxxQ")
+""" ヘッダ（識別子, バージョン, バイトオーダー(0:little, 1:big), 目次の長さ） """
+
+_ALIGN = 8
+""" 列データの配置境界 """
+
+
+@dataclasses.dataclass
+class CacheEntry:
+    """ キャッシュ内の1ファイル分のロケーション履歴 """
+
+    # 元になったJSONファイルのパス
+    path: str
+
+    # 読み込んだ時点のファイルサイズ
+    size: int
+
+    # 読み込んだ時点の更新日時（ナノ秒）
+    mtimeNs: int
+
+    # ロケーション履歴（タイムスタンプ順）
+    index: LocationIndex
+
+    def isFresh(self, stat: os.stat_result) -> bool:
+        """ JSONファイルが読み込んだ時点から変わっていなければTrueを返す """
+        return self.size == stat.st_size and self.mtimeNs == stat.st_mtime_ns
+
+
+@dataclasses.dataclass
+class CacheData:
+    """ キャッシュファイルから読み込んだ内容 """
+
+    # 場所の名称テーブル（各LocationIndexで共通）
+    nameTable: NameTable
+
+    # JSONファイルのパスごとのロケーション履歴
+    entries: Dict[str, CacheEntry]
+
+    # 全ファイルのロケーション履歴をタイムスタンプ順に並べたもの
+    merged: LocationIndex
+
+    # 列データをメモリマップしたもの
+    _mmap: Optional[mmap.mmap] = dataclasses.field(default=None, repr=False)
+
+    # mmap上に作成したmemoryview（閉じる前にすべて解放する必要がある）
+    _views: List[memoryview] = dataclasses.field(default_factory=list, repr=False)
+
+    def close(self) -> None:
+        """ メモリマップを閉じる。以降、このキャッシュのLocationIndexは使えない。 """
+        # 親のmemoryviewより先に切り出したものを解放する
+        for view in reversed(self._views):
+            view.release()
+        self._views.clear()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+class LocationLogCache(object):
+    """ 解析済みのロケーション履歴をバイナリファイルにキャッシュする
+
+    ファイル構造は以下のとおり。
+
+        ヘッダ（_HEADER）
+        目次（JSON。名称テーブル、各JSONファイルのパス・サイズ・更新日時と列データの位置）
+        列データ（タイムスタンプ, 緯度, 経度, 名称IDの順。ネイティブのバイトオーダー）
+        滞在の列データ（到着時刻, 出発時刻, 出発時刻の累積最大値, 緯度, 経度, 名称IDの順）
+
+    列データはメモリマップしてそのままLocationIndexの列として使う。
+    """
+
+    def __init__(self, path: str, options: Optional[Dict[str, Any]] = None):
+        # キャッシュファイルのパス
+        self.path = path
+
+        # キャッシュの内容を左右する読み込みの設定（JSONにできる値）。作成時と異なればキャッシュを使わない。
+        self.options: Dict[str, Any] = {} if options is None else options
+
+    def load(self) -> Optional[CacheData]:
+        """ キャッシュファイルを読み込む。存在しないか、読み込めなければNoneを返す。 """
+
+        if not os.path.isfile(self.path):
+            return None
+
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(_HEADER.size)
+                magic, version, byteorder, tocLength = _HEADER.unpack(header)
+                if magic != _MAGIC or version != _VERSION or byteorder != _byteorderFlag():
+                    logger.info(f"キャッシュファイルの形式が異なるため使用しません:'{self.path}'")
+                    return None
+                toc = json.loads(f.read(tocLength).decode("utf-8"))
+                if toc.get("options", {}) != self.options:
+                    logger.info(f"キャッシュファイルを作成したときと読み込みの設定が異なるため使用しません:'{self.path}'")
+                    return None
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"キャッシュファイルを読み込めませんでした:'{self.path}' {e}")
+            return None
+
+        nameTable = NameTable(toc["names"])
+        views = [memoryview(mm)]
+
+        def view(offset: int, count: int, visitCount: int) -> LocationIndex:
+            """ メモリマップ上の列データをLocationIndexとして返す """
+            position = toc["dataOffset"] + offset
+
+            def columnsAt(columnTypes: Tuple[Tuple[str, int], ...], count: int) -> List[memoryview]:
+                nonlocal position
+                columns: List[memoryview] = []
+                for typecode, itemSize in columnTypes:
+                    column = views[0][position:position + itemSize * count].cast(typecode)
+                    views.append(column)
+                    columns.append(column)
+                    position += itemSize * count
+                position = _align(position)
+                return columns
+
+            columns = columnsAt(_COLUMN_TYPES, count)
+            visits = VisitIndex(*columnsAt(_VISIT_COLUMN_TYPES, visitCount), nameTable.names)
+            return LocationIndex(columns[0], columns[1], columns[2], columns[3], nameTable.names, visits)
+
+        entries = {
+            file["path"]: CacheEntry(file["path"], file["size"], file["mtimeNs"],
+                                     view(file["offset"], file["count"], file["visitCount"]))
+            for file in toc["files"]
+        }
+        merged = view(toc["merged"]["offset"], toc["merged"]["count"], toc["merged"]["visitCount"])
+        return CacheData(nameTable, entries, merged, mm, views)
+
+    def save(self, nameTable: NameTable, entries: List[CacheEntry], merged: LocationIndex) -> None:
+        """ キャッシュファイルを書き込む """
+
+        toc: Dict[str, Any] = {"names": nameTable.names, "options": self.options, "files": []}
+        offset = 0
+        for entry in entries:
+            toc["files"].append({
+                "path": entry.path,
+                "size": entry.size,
+                "mtimeNs": entry.mtimeNs,
+                "offset": offset,
+                "count": len(entry.index),
+                "visitCount": len(entry.index.visits),
+            })
+            offset += _indexSize(entry.index)
+        toc["merged"] = {"offset": offset, "count": len(merged), "visitCount": len(merged.visits)}
+
+        # 目次の長さが決まるまで列データの開始位置が決まらないため、仮の値で長さを求める
+        toc["dataOffset"] = 0
+        tocLength = len(json.dumps(toc).encode("utf-8")) + 32
+        toc["dataOffset"] = _align(_HEADER.size + tocLength)
+        tocBytes = json.dumps(toc).encode("utf-8").ljust(tocLength)
+
+        # 書き込み途中で中断しても壊れたキャッシュが残らないよう、一時ファイルに書いてから置き換える
+        tempPath = f"{self.path}.tmp"
+        with open(tempPath, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, _byteorderFlag(), tocLength))
+            f.write(tocBytes)
+            f.write(b"\0" * (toc["dataOffset"] - f.tell()))
+            for index in [entry.index for entry in entries] + [merged]:
+                for columns in (index.columns(), index.visits.columns()):
+                    for column in columns:
+                        f.write(column)
+                    f.write(b"\0" * (_align(f.tell()) - f.tell()))
+        os.replace(tempPath, self.path)
+
+
+_COLUMN_TYPES: Tuple[Tuple[str, int], ...] = (("q", 8), ("i", 4), ("i", 4), ("i", 4))
+""" 列データの型コードと要素サイズ（タイムスタンプ, 緯度, 経度, 名称ID） """
+
+
+_VISIT_COLUMN_TYPES: Tuple[Tuple[str, int], ...] = (("q", 8), ("q", 8), ("q", 8), ("i", 4), ("i", 4), ("i", 4))
+""" 滞在の列データの型コードと要素サイズ（到着時刻, 出発時刻, 出発時刻の累積最大値, 緯度, 経度, 名称ID） """
+
+
+def _indexSize(index: LocationIndex) -> int:
+    """ LocationIndex1つ分の列データのバイト数を返す """
+    return _columnsSize(_COLUMN_TYPES, len(index)) + _columnsSize(_VISIT_COLUMN_TYPES, len(index.visits))
+
+
+def _columnsSize(columnTypes: Tuple[Tuple[str, int], ...], count: int) -> int:
+    """ 列データ1組のバイト数を返す """
+    return _align(sum(itemSize for _, itemSize in columnTypes) * count)
+
+
+def _align(position: int) -> int:
+    """ 位置を配置境界に切り上げる """
+    return (position + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _byteorderFlag() -> int:
+    """ 実行環境のバイトオーダーを表す値を返す """
+    return 0 if sys.byteorder == "little" else 1
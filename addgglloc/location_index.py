@@ -0,0 +1,457 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import datetime
+import heapq
+from itertools import accumulate
+from operator import itemgetter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union, cast
+
+from .location_log import LocationLog
+
+try:
+    import numpy
+except ImportError:
+    # NumPyは任意。無ければbisectで探索する。
+    numpy = None
+
+
+LocationRecord = Tuple[int, int, int, Optional[str]]
+""" ロケーション履歴1件分の生データ。(エポックミリ秒, 緯度E7, 経度E7, 場所の名称) """
+
+VisitRecord = Tuple[int, int, int, int, Optional[str]]
+""" 1か所に滞在した記録の生データ。(到着のエポックミリ秒, 出発のエポックミリ秒, 緯度E7, 経度E7, 場所の名称) """
+
+TimelineRecord = Union[LocationRecord, VisitRecord]
+""" ロケーション履歴ファイルから読み込む生データ """
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+""" エポックミリ秒の基準時刻 """
+
+NO_NAME = -1
+""" 場所の名称が無いことを表す名称ID """
+
+Column = Union[array, memoryview]
+""" LocationIndexの列。通常はarrayだが、キャッシュファイルをメモリマップした場合はmemoryviewになる。 """
+
+
+def datetimeToMs(dt: datetime.datetime) -> int:
+    """ タイムゾーン付きの日時をエポックミリ秒に変換する """
+    return (dt - EPOCH) // datetime.timedelta(milliseconds=1)
+
+
+def msToDatetime(ms: int) -> datetime.datetime:
+    """ エポックミリ秒をUTCの日時に変換する
+
+    照合のたびに呼ばれるので、EPOCHにtimedeltaを足すよりも速いfromtimestampを使う
+    （ミリ秒の浮動小数点数はマイクロ秒に丸められるので誤差は出ない）。
+    """
+    return datetime.datetime.fromtimestamp(ms / 1000, datetime.timezone.utc)
+
+
+class NameTable(object):
+    """ 場所の名称を重複なく保持し、名称IDを払い出す """
+
+    def __init__(self, names: Sequence[str] = ()):
+        self.names: List[str] = list(names)
+        self._ids: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+
+    def intern(self, areaInformation: Optional[str]) -> int:
+        """ 場所の名称を登録し、名称IDを返す """
+        if areaInformation is None:
+            return NO_NAME
+        nameId = self._ids.get(areaInformation)
+        if nameId is None:
+            nameId = len(self.names)
+            self.names.append(areaInformation)
+            self._ids[areaInformation] = nameId
+        return nameId
+
+
+class VisitIndex(object):
+    """ 1か所に滞在した記録を到着時刻順に保持する列指向の索引
+
+    滞在は(到着時刻, 出発時刻)の区間1件として保持し、滞在中の位置情報を一定間隔で作り出すことはしない。
+    出発時刻の累積最大値も保持しておき、ある時刻を含む滞在を2分探索だけで見つけられるようにする。
+    """
+
+    def __init__(self, starts: Column, ends: Column, maxEnds: Column,
+                 lats: Column, lons: Column, nameIds: Column, names: List[str]):
+        # 到着時刻（エポックミリ秒、昇順）
+        self.starts = starts
+
+        # 出発時刻（エポックミリ秒）
+        self.ends = ends
+
+        # 先頭からその位置までの出発時刻の最大値（昇順になる）
+        self.maxEnds = maxEnds
+
+        # 緯度（E7）
+        self.lats = lats
+
+        # 経度（E7）
+        self.lons = lons
+
+        # 場所の名称ID（`names`の添字。名称が無ければNO_NAME）
+        self.nameIds = nameIds
+
+        # 場所の名称テーブル
+        self.names = names
+
+    @staticmethod
+    def empty(names: List[str]) -> "VisitIndex":
+        """ 滞在の無いVisitIndexを返す """
+        return VisitIndex(array("q"), array("q"), array("q"), array("i"), array("i"), array("i"), names)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def get(self, i: int, timestampMs: int) -> LocationLog:
+        """ i番目の滞在を、`timestampMs`を滞在期間内に収めた時刻のLocationLogとして返す """
+        # 照合のたびに呼ばれるので、キーワード引数より速い位置引数で生成する（timestamp, lat, lon, areaInformation）
+        nameId = self.nameIds[i]
+        return LocationLog(
+            msToDatetime(min(max(timestampMs, self.starts[i]), self.ends[i])),
+            self.lats[i] / 10000000,
+            self.lons[i] / 10000000,
+            None if nameId == NO_NAME else self.names[nameId],
+        )
+
+    def nearest(self, timestampMs: int, toleranceMs: int) -> Optional[Tuple[int, int]]:
+        """ `timestampMs`に最も近い滞在の(位置, 時間差のミリ秒)を返す。`toleranceMs`以内に無ければNoneを返す。
+
+        滞在中なら時間差は0で、該当する滞在が複数あれば到着が最も遅いものを優先する。
+        そうでなければ、直前に出発した滞在と直後に到着する滞在のうち近い方を返す（同じなら到着する方）。
+        """
+
+        # `timestampMs`より後に到着する最初の滞在
+        after = bisect_right(self.starts, timestampMs)
+        best: Optional[Tuple[int, int]] = None
+        if after > 0:
+            last = after - 1
+            if self.ends[last] >= timestampMs:
+                return (last, 0)
+            if self.maxEnds[last] >= timestampMs:
+                # それより前の滞在のうち、出発が`timestampMs`以降になる最初のもの
+                return (bisect_left(self.maxEnds, timestampMs, 0, last), 0)
+
+            # 到着済みの滞在はすべて出発しているので、出発が最も遅いもの
+            departed = self.maxEnds[last]
+            if timestampMs - departed <= toleranceMs:
+                best = (bisect_left(self.maxEnds, departed, 0, last), timestampMs - departed)
+        if after < len(self.starts):
+            distance = self.starts[after] - timestampMs
+            if distance <= toleranceMs and (best is None or distance <= best[1]):
+                best = (after, distance)
+        return best
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # memoryviewはpickleできないのでarrayに詰め替える
+        return {
+            "starts": _toArray("q", self.starts),
+            "ends": _toArray("q", self.ends),
+            "maxEnds": _toArray("q", self.maxEnds),
+            "lats": _toArray("i", self.lats),
+            "lons": _toArray("i", self.lons),
+            "nameIds": _toArray("i", self.nameIds),
+            "names": self.names,
+        }
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+
+    def detach(self) -> "VisitIndex":
+        """ 列をすべてarrayにしたVisitIndexを返す """
+        return VisitIndex(**self.__getstate__())
+
+    def columns(self) -> Tuple[Column, Column, Column, Column, Column, Column]:
+        """ (到着時刻, 出発時刻, 出発時刻の累積最大値, 緯度, 経度, 名称ID)の列を返す """
+        return (self.starts, self.ends, self.maxEnds, self.lats, self.lons, self.nameIds)
+
+
+class LocationIndex(object):
+    """ ロケーション履歴を時刻順に保持する列指向の索引
+
+    LocationLogを大量に生成するとメモリを大きく消費するため、
+    タイムスタンプ(int64)、緯度経度のE7値(int32)、場所の名称ID(int32)を
+    それぞれ型付き配列で保持し、場所の名称は重複を除いたテーブルで保持する。
+    LocationLogは検索でヒットしたものだけを生成する。
+    1か所に滞在した記録は、区間としてVisitIndexに別に保持する。
+    """
+
+    def __init__(self, timestamps: Column, lats: Column, lons: Column, nameIds: Column, names: List[str],
+                 visits: Optional[VisitIndex] = None):
+        # タイムスタンプ（エポックミリ秒、昇順）
+        self.timestamps = timestamps
+
+        # 緯度（E7）
+        self.lats = lats
+
+        # 経度（E7）
+        self.lons = lons
+
+        # 場所の名称ID（`names`の添字。名称が無ければNO_NAME）
+        self.nameIds = nameIds
+
+        # 場所の名称テーブル
+        self.names = names
+
+        # 滞在の記録（名称テーブルは共通）
+        self.visits = VisitIndex.empty(names) if visits is None else visits
+
+    def __len__(self) -> int:
+        """ 位置情報の件数を返す（滞在の件数は含まない） """
+        return len(self.timestamps)
+
+    def timeRange(self) -> Optional[Tuple[int, int]]:
+        """ 位置情報と滞在を合わせた(最初の時刻, 最後の時刻)をエポックミリ秒で返す。空ならNoneを返す。 """
+
+        ranges: List[Tuple[int, int]] = []
+        if len(self.timestamps) > 0:
+            ranges.append((self.timestamps[0], self.timestamps[-1]))
+        if len(self.visits) > 0:
+            ranges.append((self.visits.starts[0], self.visits.maxEnds[-1]))
+        if not ranges:
+            return None
+        return (min(start for start, _ in ranges), max(end for _, end in ranges))
+
+    def get(self, i: int) -> LocationLog:
+        """ i番目のロケーション履歴をLocationLogとして返す """
+        # 照合のたびに呼ばれるので、キーワード引数より速い位置引数で生成する（timestamp, lat, lon, areaInformation）
+        nameId = self.nameIds[i]
+        return LocationLog(
+            msToDatetime(self.timestamps[i]),
+            self.lats[i] / 10000000,
+            self.lons[i] / 10000000,
+            None if nameId == NO_NAME else self.names[nameId],
+        )
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # memoryviewはpickleできないのでarrayに詰め替える
+        return {
+            "timestamps": _toArray("q", self.timestamps),
+            "lats": _toArray("i", self.lats),
+            "lons": _toArray("i", self.lons),
+            "nameIds": _toArray("i", self.nameIds),
+            "names": self.names,
+            "visits": self.visits.detach(),
+        }
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+
+    def detach(self) -> "LocationIndex":
+        """ 列をすべてarrayにしたLocationIndexを返す（メモリマップを閉じても使えるようにする） """
+        state = self.__getstate__()
+        return LocationIndex(**state)
+
+    def bisect(self, timestampMs: int) -> int:
+        """ タイムスタンプがtimestampMs以上となる最初の位置を2分探索で返す """
+        return bisect_left(self.timestamps, timestampMs)
+
+    def bisectMany(self, timestampsMs: Sequence[int]) -> List[int]:
+        """ 昇順に並んだ`timestampsMs`それぞれについて、`bisect`と同じ位置をまとめて返す
+
+        NumPyがあればsearchsortedで一括して探索する。
+        無ければ、直前に見つかった位置から先だけを2分探索しながら1回の走査で求める。
+        """
+
+        if numpy is not None and len(timestampsMs) > 0:
+            timestamps = numpy.frombuffer(self.timestamps, dtype=numpy.int64)
+            queries = numpy.fromiter(timestampsMs, dtype=numpy.int64, count=len(timestampsMs))
+            return numpy.searchsorted(timestamps, queries, side="left").tolist()
+
+        positions: List[int] = []
+        position = 0
+        for timestampMs in timestampsMs:
+            position = bisect_left(self.timestamps, timestampMs, position)
+            positions.append(position)
+        return positions
+
+    def columns(self) -> Tuple[Column, Column, Column, Column]:
+        """ (タイムスタンプ, 緯度, 経度, 名称ID)の列を返す """
+        return (self.timestamps, self.lats, self.lons, self.nameIds)
+
+    def rebind(self, nameTable: NameTable) -> "LocationIndex":
+        """ 名称IDを`nameTable`のものに付け替えたLocationIndexを返す """
+        visits = self.visits
+        if not self.names:
+            return LocationIndex(
+                self.timestamps, self.lats, self.lons, self.nameIds, nameTable.names,
+                VisitIndex(visits.starts, visits.ends, visits.maxEnds, visits.lats, visits.lons, visits.nameIds,
+                           nameTable.names))
+        # 末尾にNO_NAMEを置いておけば、mapping[NO_NAME]でNO_NAMEが得られる
+        mapping = [nameTable.intern(name) for name in self.names] + [NO_NAME]
+        nameIds = array("i", map(mapping.__getitem__, self.nameIds))
+        visitNameIds = array("i", map(mapping.__getitem__, visits.nameIds))
+        return LocationIndex(
+            self.timestamps, self.lats, self.lons, nameIds, nameTable.names,
+            VisitIndex(visits.starts, visits.ends, visits.maxEnds, visits.lats, visits.lons, visitNameIds,
+                       nameTable.names))
+
+    @staticmethod
+    def merge(indexes: Iterable["LocationIndex"], nameTable: NameTable) -> "LocationIndex":
+        """ 同じNameTableを使うタイムスタンプ順のLocationIndexを、タイムスタンプ順を保ったまま1つにする
+
+        期間が重ならなければ開始時刻順に連結するだけで済ませ、
+        重なる場合はk-wayマージする（全体を改めてソートはしない）。
+        滞在は件数が少ないので、連結してから到着時刻順に並べ替える。
+        """
+
+        indexes = list(indexes)
+        builder = LocationIndexBuilder(nameTable)
+        for index in indexes:
+            builder.extendVisits(index.visits)
+
+        sources = sorted((index for index in indexes if len(index) > 0),
+                         key=lambda index: index.timestamps[0])
+
+        overlapped = any(a.timestamps[-1] > b.timestamps[0] for a, b in zip(sources, sources[1:]))
+        if not overlapped:
+            for index in sources:
+                builder.extendIndex(index, withVisits=False)
+            return builder.build()
+
+        # 同時刻のものは`sources`の並び順を保つ
+        for timestampMs, latE7, lonE7, nameId in heapq.merge(
+                *(zip(*index.columns()) for index in sources), key=itemgetter(0)):
+            builder.appendRaw(timestampMs, latE7, lonE7, nameId)
+        return builder.build()
+
+
+class LocationIndexBuilder(object):
+    """ LocationIndexを組み立てる
+
+    `nameTable`を複数のBuilderで共有すると、作成されるLocationIndex同士で名称IDが共通になる。
+    """
+
+    def __init__(self, nameTable: Optional[NameTable] = None) -> None:
+        self._timestamps = array("q")
+        self._lats = array("i")
+        self._lons = array("i")
+        self._nameIds = array("i")
+        self._nameTable = NameTable() if nameTable is None else nameTable
+
+        # ここまでに追加されたロケーション履歴がタイムスタンプ順に並んでいるか
+        self._sorted = True
+
+        self._visitStarts = array("q")
+        self._visitEnds = array("q")
+        self._visitLats = array("i")
+        self._visitLons = array("i")
+        self._visitNameIds = array("i")
+
+        # ここまでに追加された滞在が到着時刻順に並んでいるか
+        self._visitsSorted = True
+
+    def __len__(self) -> int:
+        return len(self._timestamps)
+
+    def append(self, timestampMs: int, latE7: int, lonE7: int, areaInformation: Optional[str] = None) -> None:
+        """ ロケーション履歴を1件追加する """
+        self.appendRaw(timestampMs, latE7, lonE7, self._nameTable.intern(areaInformation))
+
+    def appendRaw(self, timestampMs: int, latE7: int, lonE7: int, nameId: int) -> None:
+        """ 名称IDを指定してロケーション履歴を1件追加する（名称IDは同じNameTableのものであること） """
+        if self._sorted and self._timestamps and self._timestamps[-1] > timestampMs:
+            self._sorted = False
+        self._timestamps.append(timestampMs)
+        self._lats.append(latE7)
+        self._lons.append(lonE7)
+        self._nameIds.append(nameId)
+
+    def appendVisit(self, startMs: int, endMs: int, latE7: int, lonE7: int,
+                    areaInformation: Optional[str] = None) -> None:
+        """ 滞在を1件追加する """
+        if self._visitsSorted and self._visitStarts and self._visitStarts[-1] > startMs:
+            self._visitsSorted = False
+        self._visitStarts.append(startMs)
+        self._visitEnds.append(endMs)
+        self._visitLats.append(latE7)
+        self._visitLons.append(lonE7)
+        self._visitNameIds.append(self._nameTable.intern(areaInformation))
+
+    def extend(self, records: Iterable[TimelineRecord]) -> None:
+        """ ロケーション履歴と滞在をまとめて追加する """
+        for record in records:
+            if len(record) == 5:
+                self.appendVisit(*cast(VisitRecord, record))
+            else:
+                self.append(*cast(LocationRecord, record))
+
+    def extendVisits(self, visits: VisitIndex) -> None:
+        """ 同じNameTableで作成したVisitIndexの内容をまとめて追加する """
+        if len(visits) == 0:
+            return
+        if self._visitsSorted and self._visitStarts and self._visitStarts[-1] > visits.starts[0]:
+            self._visitsSorted = False
+        self._visitStarts.frombytes(_asBytes(visits.starts))
+        self._visitEnds.frombytes(_asBytes(visits.ends))
+        self._visitLats.frombytes(_asBytes(visits.lats))
+        self._visitLons.frombytes(_asBytes(visits.lons))
+        self._visitNameIds.frombytes(_asBytes(visits.nameIds))
+
+    def extendIndex(self, index: LocationIndex, withVisits: bool = True) -> None:
+        """ 同じNameTableで作成したLocationIndexの内容をまとめて追加する """
+        if withVisits:
+            self.extendVisits(index.visits)
+        if len(index) == 0:
+            return
+        if self._sorted and self._timestamps and self._timestamps[-1] > index.timestamps[0]:
+            self._sorted = False
+        self._timestamps.frombytes(_asBytes(index.timestamps))
+        self._lats.frombytes(_asBytes(index.lats))
+        self._lons.frombytes(_asBytes(index.lons))
+        self._nameIds.frombytes(_asBytes(index.nameIds))
+
+    def build(self) -> LocationIndex:
+        """ タイムスタンプ順に並べ替えたLocationIndexを作成する """
+
+        timestamps = self._timestamps
+        lats = self._lats
+        lons = self._lons
+        nameIds = self._nameIds
+
+        # 2部探索するためにソートしておく
+        # （同時刻の並びは追加順を保つ）
+        if not self._sorted:
+            order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+            timestamps = array("q", (timestamps[i] for i in order))
+            lats = array("i", (lats[i] for i in order))
+            lons = array("i", (lons[i] for i in order))
+            nameIds = array("i", (nameIds[i] for i in order))
+
+        return LocationIndex(timestamps, lats, lons, nameIds, self._nameTable.names, self._buildVisits())
+
+    def _buildVisits(self) -> VisitIndex:
+        """ 到着時刻順に並べ替えたVisitIndexを作成する """
+
+        starts = self._visitStarts
+        ends = self._visitEnds
+        lats = self._visitLats
+        lons = self._visitLons
+        nameIds = self._visitNameIds
+
+        if not self._visitsSorted:
+            order = sorted(range(len(starts)), key=starts.__getitem__)
+            starts = array("q", (starts[i] for i in order))
+            ends = array("q", (ends[i] for i in order))
+            lats = array("i", (lats[i] for i in order))
+            lons = array("i", (lons[i] for i in order))
+            nameIds = array("i", (nameIds[i] for i in order))
+
+        maxEnds = array("q", accumulate(ends, max))
+        return VisitIndex(starts, ends, maxEnds, lats, lons, nameIds, self._nameTable.names)
+
+
+def _toArray(typecode: str, column: Column) -> array:
+    """ 列をarrayにして返す """
+    if isinstance(column, array):
+        return column
+    result = array(typecode)
+    result.frombytes(_asBytes(column))
+    return result
+
+
+def _asBytes(column: Column) -> memoryview:
+    """ 列をバイト列として参照するmemoryviewを返す """
+    return memoryview(column).cast("B")
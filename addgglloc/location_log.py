@@ -1,7 +1,6 @@
-import copy
 import dataclasses
 import datetime
-import math
+import functools
 from typing import Any, Dict, Literal, Optional, Tuple
 
 import piexif
@@ -24,31 +23,36 @@ class LocationLog:
     areaInformation: Optional[str] = dataclasses.field(default=None)
 
     def writeTo(self, exifDict: Dict[str, Any]) -> Dict[str, Any]:
-        """ 渡されたExif辞書のコピーを作成し、そこに位置情報を書き込む """
+        """ 渡されたExif辞書のコピーを作成し、そこに位置情報を書き込む
 
-        copyExifDict = copy.deepcopy(exifDict)
-        copyGpsIdf = copyExifDict["GPS"]
+        書き換えるのはGPS IFDだけなので、コピーするのは外側の辞書とGPS IFDだけにする
+        （他のIFDやサムネイルは元の辞書と共有する）。
+        """
 
-        lat, latRef = self._degreeToDmsRef(self.lat, "lat")
-        lon, lonRef = self._degreeToDmsRef(self.lon, "lon")
-        dateStamp = self.timestamp.strftime("%Y:%m:%d")
-        hour = (self.timestamp.hour, 1)
-        minute = (self.timestamp.minute, 1)
-        sec = (self.timestamp.second, 1)
+        copyExifDict = dict(exifDict)
+        copyGpsIdf = dict(exifDict.get("GPS") or {})
+        copyExifDict["GPS"] = copyGpsIdf
 
         if piexif.GPSIFD.GPSVersionID not in copyGpsIdf:
             copyGpsIdf[piexif.GPSIFD.GPSVersionID] = (2, 0, 0, 0)
-        copyGpsIdf[piexif.GPSIFD.GPSLatitudeRef] = latRef.encode()
-        copyGpsIdf[piexif.GPSIFD.GPSLatitude] = lat
-        copyGpsIdf[piexif.GPSIFD.GPSLongitudeRef] = lonRef.encode()
-        copyGpsIdf[piexif.GPSIFD.GPSLongitude] = lon
-        copyGpsIdf[piexif.GPSIFD.GPSDateStamp] = dateStamp.encode()
-        copyGpsIdf[piexif.GPSIFD.GPSTimeStamp] = (hour, minute, sec)
-        if self.areaInformation is not None:
-            copyGpsIdf[piexif.GPSIFD.GPSAreaInformation] = self.areaInformation.encode()
+        copyGpsIdf.update(self.gpsTags())
 
         return copyExifDict
 
+    def gpsTags(self) -> Dict[int, Any]:
+        """ 書き込む位置情報とタイムスタンプを、GPS IFDのタグ（piexifの辞書と同じ形式）にして返す """
+
+        tags = dict(_encodePosition(self.lat, self.lon, self.areaInformation))
+        timestamp = self.timestamp
+        tags[piexif.GPSIFD.GPSDateStamp] = \
+            f"{timestamp.year:04d}:{timestamp.month:02d}:{timestamp.day:02d}".encode()
+        tags[piexif.GPSIFD.GPSTimeStamp] = (
+            (timestamp.hour, 1),
+            (timestamp.minute, 1),
+            (timestamp.second * 1000 + timestamp.microsecond // 1000, 1000),
+        )
+        return tags
+
     @staticmethod
     def _degreeToDmsRef(degree: float, axis: Literal["lat", "lon"]) -> Tuple[Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int]], str]:
         """ 度数表記を((D, M, S), Ref)表記に変換する
@@ -61,13 +65,42 @@ class LocationLog:
         秒 = 分での計算の小数点以下を取り出し、60 を掛ける。
             0.2 * 60 = 12
         度・分・秒を組み合わせ、35度 40分 12秒となる。
+
+        南緯・西経は絶対値を変換し、方角はRefで表す（Exifの有理数は負の値を持てない）。
+        秒は1/_SEC_DENOMINATOR秒単位の有理数にする。
         """
         if degree >= 0:
             ref = "N" if axis == "lat" else "E"
         else:
             ref = "S" if axis == "lat" else "W"
 
-        dec1, deg = math.modf(degree)
-        dec2, min_,  = math.modf(dec1 * 60)
-        sec = dec2 * 60
-        return (((int(deg), 1), (int(min_), 1), (int(sec), 1)), ref)
+        # 丸めで60秒になった場合に分・度へ繰り上げるため、秒の単位の整数にしてから分解する
+        total = round(abs(degree) * 3600 * _SEC_DENOMINATOR)
+        deg, rest = divmod(total, 3600 * _SEC_DENOMINATOR)
+        min_, sec = divmod(rest, 60 * _SEC_DENOMINATOR)
+        return (((deg, 1), (min_, 1), (sec, _SEC_DENOMINATOR)), ref)
+
+
+_SEC_DENOMINATOR = 10000
+""" 緯度経度の秒を表す有理数の分母（E7の精度である0.00036秒を表せる） """
+
+
+@functools.lru_cache(maxsize=1024)
+def _encodePosition(lat: float, lon: float, areaInformation: Optional[str]) -> Dict[int, Any]:
+    """ 緯度経度と場所の名称をGPS IFDのタグにしたものを返す
+
+    同じ滞在先で撮影した写真では同じ位置を何度も書き込むので、結果をキャッシュしておく。
+    戻り値は共有されるので変更しないこと。
+    """
+
+    latDms, latRef = LocationLog._degreeToDmsRef(lat, "lat")
+    lonDms, lonRef = LocationLog._degreeToDmsRef(lon, "lon")
+    tags: Dict[int, Any] = {
+        piexif.GPSIFD.GPSLatitudeRef: latRef.encode(),
+        piexif.GPSIFD.GPSLatitude: latDms,
+        piexif.GPSIFD.GPSLongitudeRef: lonRef.encode(),
+        piexif.GPSIFD.GPSLongitude: lonDms,
+    }
+    if areaInformation is not None:
+        tags[piexif.GPSIFD.GPSAreaInformation] = areaInformation.encode()
+    return tags
@@ -0,0 +1,222 @@
+import dataclasses
+from typing import List, Optional, Sequence, cast
+
+from .location_index import NO_NAME, LocationIndex, VisitIndex, msToDatetime
+from .location_log import LocationLog
+
+try:
+    import numpy
+except ImportError:
+    # NumPyは任意。無ければ1件ずつ照合する。
+    numpy = None
+
+
+MATCH_STRATEGIES = ("nearest", "interpolate", "visit-preferred")
+""" 撮影時間と位置情報を照合する方法
+
+nearest          前後の位置情報と滞在のうち、時間が最も近いものを採用する
+interpolate      滞在中でなければ、前後の位置情報（simplifiedRawPathの点）の間を時間で線形補間する
+visit-preferred  許容範囲内に滞在があれば、位置情報の方が近くても滞在を採用する
+"""
+
+_E7 = 10000000
+""" 緯度経度のE7値を度に直す係数 """
+
+
+@dataclasses.dataclass
+class LocationMatch:
+    """ 照合した位置情報と、その確からしさ """
+
+    # 照合した位置情報
+    locationLog: LocationLog
+
+    # 撮影時間と、採用した位置情報（補間した場合は近い方の点、滞在ならその期間）との時間差（ミリ秒）
+    deltaMs: int
+
+    # 確からしさ（時間差が0なら1、許容範囲の端なら0）
+    confidence: float
+
+
+class LocationMatcher(object):
+    """ LocationIndexから撮影時間に合う位置情報を探す
+
+    撮影時間の直前と直後の位置情報、最も近い滞在をそれぞれ2分探索で求め、`strategy`に従って1つを選ぶ。
+    いずれも時間差が`toleranceMs`以内のものだけを候補にする（撮影時間より前でも後でも同じ扱い）。
+    """
+
+    def __init__(self, locationIndex: LocationIndex, toleranceMs: int, strategy: str = "nearest"):
+        if strategy not in MATCH_STRATEGIES:
+            raise ValueError(f"unknown match strategy:'{strategy}'")
+
+        # 照合する索引
+        self.locationIndex = locationIndex
+
+        # 撮影時間と位置情報を紐付ける時間の範囲（ミリ秒）
+        self.toleranceMs = toleranceMs
+
+        # 照合する方法（MATCH_STRATEGIESのいずれか）
+        self.strategy = strategy
+
+        # 照合のたびに参照するものは先に取り出しておく（索引は変更されない）
+        self._timestamps = locationIndex.timestamps
+        self._count = len(locationIndex.timestamps)
+        self._visits = locationIndex.visits if len(locationIndex.visits) > 0 else None
+        self._preferVisit = strategy == "visit-preferred"
+        self._interpolates = strategy == "interpolate"
+
+        # 時間差から確からしさを求める係数（候補の時間差は`toleranceMs`以下なので、確からしさは0〜1になる）
+        self._confidencePerMs = 1.0 / toleranceMs if toleranceMs > 0 else 0.0
+
+    def match(self, timestampMs: int) -> Optional[LocationMatch]:
+        """ 撮影時間（エポックミリ秒）に合う位置情報を返す。無ければNoneを返す。 """
+        return self.matchAt(self.locationIndex.bisect(timestampMs), timestampMs)
+
+    def matchMany(self, timestampsMs: Sequence[int]) -> List[Optional[LocationMatch]]:
+        """ 複数の撮影時間に合う位置情報をまとめて返す
+
+        撮影時間をソートしてから索引をまとめて探索するので、`match`を1件ずつ呼ぶよりも速い。
+        NumPyがあれば、候補の選択までを配列演算でまとめて行う。
+        """
+
+        results: List[Optional[LocationMatch]] = [None] * len(timestampsMs)
+        if numpy is not None and len(timestampsMs) > 0:
+            self._matchManyWithNumpy(timestampsMs, results)
+            return results
+
+        order = sorted(range(len(timestampsMs)), key=timestampsMs.__getitem__)
+        sortedTimestampsMs = [timestampsMs[i] for i in order]
+        positions = self.locationIndex.bisectMany(sortedTimestampsMs)
+        matchAt = self.matchAt
+        for i, position, timestampMs in zip(order, positions, sortedTimestampsMs):
+            results[i] = matchAt(position, timestampMs)
+        return results
+
+    def _matchManyWithNumpy(self, timestampsMs: Sequence[int], results: List[Optional[LocationMatch]]) -> None:
+        """ `matchAt`と同じ基準で候補を配列演算で選び、`results`に照合結果を書き込む """
+
+        toleranceMs = self.toleranceMs
+        queries = numpy.fromiter(timestampsMs, dtype=numpy.int64, count=len(timestampsMs))
+        noCandidate = numpy.full(len(queries), toleranceMs + 1, dtype=numpy.int64)
+
+        # 撮影時間の直前と直後の点のうち近い方（同じなら直後の点）
+        count = self._count
+        positions = numpy.zeros(len(queries), dtype=numpy.int64)
+        beforeDeltas = afterDeltas = noCandidate
+        if count > 0:
+            timestamps = numpy.frombuffer(self._timestamps, dtype=numpy.int64)
+            positions = numpy.searchsorted(timestamps, queries, side="left")
+            afterDeltas = numpy.where(
+                positions < count, timestamps[numpy.minimum(positions, count - 1)] - queries, noCandidate)
+            beforeDeltas = numpy.where(
+                positions > 0, queries - timestamps[numpy.maximum(positions - 1, 0)], noCandidate)
+        useBefore = beforeDeltas < afterDeltas
+        nearests = numpy.where(useBefore, positions - 1, positions)
+        nearestDeltas = numpy.where(useBefore, beforeDeltas, afterDeltas)
+        interpolates = (nearestDeltas != 0) & (beforeDeltas <= toleranceMs) & (afterDeltas <= toleranceMs) \
+            if self._interpolates else numpy.zeros(len(queries), dtype=bool)
+
+        # 最も近い滞在（VisitIndex.nearestと同じ基準）
+        visits = self._visits
+        useVisits = numpy.zeros(len(queries), dtype=bool)
+        visitIndexes = visitDeltas = noCandidate
+        if visits is not None:
+            starts = numpy.frombuffer(visits.starts, dtype=numpy.int64)
+            ends = numpy.frombuffer(visits.ends, dtype=numpy.int64)
+            maxEnds = numpy.frombuffer(visits.maxEnds, dtype=numpy.int64)
+            arrivals = numpy.searchsorted(starts, queries, side="right")
+            lasts = numpy.maximum(arrivals - 1, 0)
+            hasLast = arrivals > 0
+            inLast = hasLast & (ends[lasts] >= queries)
+            inEarlier = hasLast & ~inLast & (maxEnds[lasts] >= queries)
+            departed = maxEnds[lasts]
+            departedDeltas = numpy.where(hasLast & ~inLast & ~inEarlier, queries - departed, noCandidate)
+            arrivalDeltas = numpy.where(
+                arrivals < len(starts), starts[numpy.minimum(arrivals, len(starts) - 1)] - queries, noCandidate)
+            useArrival = (arrivalDeltas <= toleranceMs) & (arrivalDeltas <= departedDeltas)
+
+            visitIndexes = numpy.where(useArrival, arrivals, numpy.searchsorted(maxEnds, departed, side="left"))
+            visitDeltas = numpy.where(useArrival, arrivalDeltas, departedDeltas)
+            visitIndexes = numpy.where(inEarlier, numpy.searchsorted(maxEnds, queries, side="left"), visitIndexes)
+            visitIndexes = numpy.where(inLast, lasts, visitIndexes)
+            visitDeltas = numpy.where(inLast | inEarlier, 0, visitDeltas)
+            useVisits = (visitDeltas <= toleranceMs) & (self._preferVisit | (visitDeltas <= nearestDeltas))
+
+        # 照合結果（LocationLog）の生成だけを1件ずつ行う
+        getPoint = self.locationIndex.get
+        confidencePerMs = self._confidencePerMs
+        for i, (timestampMs, useVisit, visitIndex, visitDelta, position, nearest, nearestDelta, interpolate) in \
+                enumerate(zip(timestampsMs, useVisits.tolist(), visitIndexes.tolist(), visitDeltas.tolist(),
+                              positions.tolist(), nearests.tolist(), nearestDeltas.tolist(), interpolates.tolist())):
+            if useVisit:
+                results[i] = LocationMatch(cast(VisitIndex, visits).get(visitIndex, timestampMs), visitDelta,
+                                           1.0 - visitDelta * confidencePerMs)
+            elif nearestDelta <= toleranceMs:
+                if interpolate:
+                    locationLog = self._interpolate(position - 1, position, timestampMs)
+                else:
+                    locationLog = getPoint(nearest)
+                results[i] = LocationMatch(locationLog, nearestDelta, 1.0 - nearestDelta * confidencePerMs)
+
+    def matchAt(self, position: int, timestampMs: int) -> Optional[LocationMatch]:
+        """ 2分探索でたどり着いた位置（`timestampMs`以上となる最初の位置）の前後から位置情報を選ぶ """
+
+        timestamps = self._timestamps
+        toleranceMs = self.toleranceMs
+
+        # 撮影時間の直前と直後の点のうち近い方（同じなら直後の点）。時間差が`toleranceMs`を超えれば候補にしない。
+        nearest = position
+        nearestDelta = toleranceMs + 1
+        if position < self._count:
+            nearestDelta = timestamps[position] - timestampMs
+        if position > 0 and timestampMs - timestamps[position - 1] < nearestDelta:
+            nearest = position - 1
+            nearestDelta = timestampMs - timestamps[nearest]
+
+        visits = self._visits
+        if visits is not None:
+            visit = visits.nearest(timestampMs, toleranceMs)
+            if visit is not None and (self._preferVisit or visit[1] <= nearestDelta):
+                return LocationMatch(visits.get(visit[0], timestampMs), visit[1],
+                                     1.0 - visit[1] * self._confidencePerMs)
+
+        if nearestDelta > toleranceMs:
+            return None
+        # 補間するのは、前後の点がどちらも`toleranceMs`以内にある場合だけ
+        if self._interpolates and nearestDelta != 0 and 0 < position < self._count \
+                and max(timestampMs - timestamps[position - 1], timestamps[position] - timestampMs) <= toleranceMs:
+            locationLog = self._interpolate(position - 1, position, timestampMs)
+        else:
+            locationLog = self.locationIndex.get(nearest)
+        return LocationMatch(locationLog, nearestDelta, 1.0 - nearestDelta * self._confidencePerMs)
+
+    def _interpolate(self, before: int, after: int, timestampMs: int) -> LocationLog:
+        """ 前後の位置情報の間を時間で線形補間した、撮影時間の位置情報を返す """
+
+        locationIndex = self.locationIndex
+        startMs = locationIndex.timestamps[before]
+        ratio = (timestampMs - startMs) / (locationIndex.timestamps[after] - startMs)
+        latE7 = locationIndex.lats[before] + (locationIndex.lats[after] - locationIndex.lats[before]) * ratio
+
+        # 経度180度をまたぐ場合は近い方の向きに補間する
+        lonStart = locationIndex.lons[before]
+        lonDelta = locationIndex.lons[after] - lonStart
+        if lonDelta > 180 * _E7:
+            lonDelta -= 360 * _E7
+        elif lonDelta < -180 * _E7:
+            lonDelta += 360 * _E7
+        lonE7 = lonStart + lonDelta * ratio
+        if lonE7 >= 180 * _E7:
+            lonE7 -= 360 * _E7
+        elif lonE7 < -180 * _E7:
+            lonE7 += 360 * _E7
+
+        # 場所の名称は前後で同じときだけ引き継ぐ
+        nameId = locationIndex.nameIds[before]
+        if nameId != locationIndex.nameIds[after]:
+            nameId = NO_NAME
+        return LocationLog(
+            timestamp=msToDatetime(timestampMs),
+            lat=round(latE7) / _E7,
+            lon=round(lonE7) / _E7,
+            areaInformation=None if nameId == NO_NAME else locationIndex.names[nameId],
+        )
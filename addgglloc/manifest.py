@@ -0,0 +1,123 @@
+import datetime
+import os
+import sqlite3
+from typing import Dict, Optional, Tuple
+
+from .location_log import LocationLog
+
+
+DONE_STATUSES = ("ADDED", "SKIP", "WARN")
+""" 処理済みとみなす処理結果。ERRORは再実行時にやり直す。 """
+
+_COMMIT_INTERVAL = 1000
+""" この件数を記録するごとにコミットする """
+
+
+class ProcessManifest(object):
+    """ JPEGファイルごとの処理結果を記録するSQLiteのマニフェスト
+
+    入力ファイルのパス、サイズ、更新日時、処理結果と付与した位置情報を記録する。
+    中断した処理を再開するときは、サイズと更新日時が変わっていない処理済みのファイルを
+    開かずに読み飛ばすために使う。
+    """
+
+    def __init__(self, path: str):
+        # マニフェストファイルのパス
+        self.path = path
+
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtimeNs INTEGER NOT NULL,"
+            " status TEXT NOT NULL,"
+            " lat REAL,"
+            " lon REAL,"
+            " areaInformation TEXT,"
+            " message TEXT,"
+            " updatedAt TEXT NOT NULL"
+            ")"
+        )
+        self._connection.commit()
+        self._uncommitted = 0
+
+    def __enter__(self) -> "ProcessManifest":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """ 未コミットの記録をコミットして閉じる """
+        self._connection.commit()
+        self._connection.close()
+
+    def findDone(self, path: str, stat: os.stat_result) -> Optional[Tuple[str, Optional[str]]]:
+        """ 前回から変わっていない処理済みのファイルなら(処理結果, メッセージ)を返す。そうでなければNoneを返す。 """
+
+        row = self._connection.execute(
+            "SELECT status, message FROM files WHERE path = ? AND size = ? AND mtimeNs = ?",
+            (path, stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+        if row is None or row[0] not in DONE_STATUSES:
+            return None
+        return (row[0], row[1])
+
+    def record(self, path: str, size: int, mtimeNs: int, status: str,
+               locationLog: Optional[LocationLog], message: Optional[str]) -> None:
+        """ 1ファイル分の処理結果を記録する """
+
+        self._connection.execute(
+            "INSERT OR REPLACE INTO files"
+            " (path, size, mtimeNs, status, lat, lon, areaInformation, message, updatedAt)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                path, size, mtimeNs, status,
+                None if locationLog is None else locationLog.lat,
+                None if locationLog is None else locationLog.lon,
+                None if locationLog is None else locationLog.areaInformation,
+                message,
+                datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            )
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= _COMMIT_INTERVAL:
+            self._connection.commit()
+            self._uncommitted = 0
+
+    def merge(self, path: str) -> int:
+        """ 別のマニフェストの記録を取り込み、取り込んだ件数を返す。同じファイルの記録は新しいほうを残す。 """
+
+        # ATTACHはトランザクションの外で行う必要がある
+        self._connection.commit()
+        self._uncommitted = 0
+        self._connection.execute("ATTACH DATABASE ? AS source", (path,))
+        try:
+            cursor = self._connection.execute(
+                "INSERT INTO files"
+                " (path, size, mtimeNs, status, lat, lon, areaInformation, message, updatedAt)"
+                " SELECT path, size, mtimeNs, status, lat, lon, areaInformation, message, updatedAt"
+                " FROM source.files WHERE true"
+                " ON CONFLICT(path) DO UPDATE SET"
+                " size = excluded.size, mtimeNs = excluded.mtimeNs, status = excluded.status,"
+                " lat = excluded.lat, lon = excluded.lon, areaInformation = excluded.areaInformation,"
+                " message = excluded.message, updatedAt = excluded.updatedAt"
+                " WHERE excluded.updatedAt > files.updatedAt"
+            )
+            merged = cursor.rowcount
+            self._connection.commit()
+        finally:
+            self._connection.execute("DETACH DATABASE source")
+        return merged
+
+    def statusCounts(self) -> Dict[str, int]:
+        """ 処理結果ごとの件数を返す """
+
+        rows = self._connection.execute("SELECT status, COUNT(*) FROM files GROUP BY status ORDER BY status").fetchall()
+        return {status: count for status, count in rows}
@@ -0,0 +1,175 @@
+import dataclasses
+import datetime
+import json
+import os
+from typing import Any, Dict, Iterator, Optional, TextIO, Tuple
+
+from .location_log import LocationLog
+from .location_matcher import LocationMatch
+
+
+PLAN_VERSION = 1
+""" 計画ファイルの形式のバージョン """
+
+PLANNED_STATUS = "PLANNED"
+""" 位置情報を付与する予定のファイルの処理結果 """
+
+
+@dataclasses.dataclass
+class PlanEntry:
+    """ 計画ファイルに記録する、JPEGファイル1つ分の処理予定 """
+
+    # JPEGファイルのパス
+    path: str
+
+    # 計画したときの処理結果（PLANNED、SKIP、ERROR）
+    status: str
+
+    # 計画したときのファイルサイズ
+    size: Optional[int] = dataclasses.field(default=None)
+
+    # 計画したときの更新日時（ナノ秒）
+    mtimeNs: Optional[int] = dataclasses.field(default=None)
+
+    # 計画したときのiノード番号（書き込む順序を決めるのに使う）
+    inode: Optional[int] = dataclasses.field(default=None)
+
+    # 付与する位置情報
+    locationLog: Optional[LocationLog] = dataclasses.field(default=None)
+
+    # 処理結果の詳細
+    message: Optional[str] = dataclasses.field(default=None)
+
+    # 撮影時間と付与する位置情報との時間差（ミリ秒）
+    matchDeltaMs: Optional[int] = dataclasses.field(default=None)
+
+    # 付与する位置情報の確からしさ（0〜1）
+    confidence: Optional[float] = dataclasses.field(default=None)
+
+    def sortKey(self) -> Tuple[str, int]:
+        """ ディスク上で連続して読み書きできるよう、ディレクトリ、iノード番号の順に並べるためのキー """
+        return (os.path.dirname(self.path), self.inode or 0)
+
+    def setMatch(self, match: LocationMatch) -> None:
+        """ 照合した結果を付与する位置情報として記録する """
+        self.locationLog = match.locationLog
+        self.matchDeltaMs = match.deltaMs
+        self.confidence = match.confidence
+
+    def match(self) -> Optional[LocationMatch]:
+        """ 記録した照合結果を返す。照合していなければNoneを返す。 """
+        if self.locationLog is None or self.matchDeltaMs is None or self.confidence is None:
+            return None
+        return LocationMatch(self.locationLog, self.matchDeltaMs, self.confidence)
+
+    def isUnchanged(self, stat: os.stat_result) -> bool:
+        """ ファイルが計画したときから変わっていなければTrueを返す """
+        return self.size == stat.st_size and self.mtimeNs == stat.st_mtime_ns
+
+    def toDict(self) -> Dict[str, Any]:
+        locationLog = self.locationLog
+        return {
+            "path": self.path,
+            "status": self.status,
+            "size": self.size,
+            "mtimeNs": self.mtimeNs,
+            "inode": self.inode,
+            "lat": None if locationLog is None else locationLog.lat,
+            "lon": None if locationLog is None else locationLog.lon,
+            "areaInformation": None if locationLog is None else locationLog.areaInformation,
+            "timestamp": None if locationLog is None else locationLog.timestamp.isoformat(),
+            "message": self.message,
+            "matchDeltaMs": self.matchDeltaMs,
+            "confidence": self.confidence,
+        }
+
+    @staticmethod
+    def fromDict(record: Dict[str, Any]) -> "PlanEntry":
+        locationLog = None
+        if record.get("timestamp") is not None:
+            locationLog = LocationLog(
+                datetime.datetime.fromisoformat(record["timestamp"]),
+                record["lat"], record["lon"], record.get("areaInformation"))
+        return PlanEntry(
+            record["path"], record["status"], record.get("size"), record.get("mtimeNs"), record.get("inode"),
+            locationLog, record.get("message"), record.get("matchDeltaMs"), record.get("confidence"))
+
+
+class PlanWriter(object):
+    """ 計画ファイルを書き出す
+
+    1行目は計画の条件を記録したヘッダ、2行目以降はファイルごとの処理予定で、いずれも1行1件のJSONにする。
+    """
+
+    def __init__(self, path: str, jpegInputDir: str, toleranceSec: int):
+        # 計画ファイルのパス
+        self.path = path
+
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._file: TextIO = open(path, "w", encoding="utf-8")
+        self._write({"version": PLAN_VERSION, "jpegInputDir": jpegInputDir, "toleranceSec": toleranceSec})
+
+    def __enter__(self) -> "PlanWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def write(self, entry: PlanEntry) -> None:
+        """ 1ファイル分の処理予定を書き出す """
+        self._write(entry.toDict())
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+class PlanReader(object):
+    """ 計画ファイルを先頭から1件ずつ読み込む """
+
+    def __init__(self, path: str):
+        # 計画ファイルのパス
+        self.path = path
+
+        self._file: TextIO = open(path, "r", encoding="utf-8")
+        try:
+            header = json.loads(self._file.readline() or "null")
+        except json.JSONDecodeError:
+            header = None
+        if (not isinstance(header, dict)) or (header.get("version") != PLAN_VERSION):
+            self._file.close()
+            raise InvalidPlanException(f"計画ファイルの形式が正しくありません:'{path}'")
+
+        # 計画したときのJPEGファイルのディレクトリ
+        self.jpegInputDir: str = header["jpegInputDir"]
+
+        # 計画したときの撮影時間と位置情報を紐付ける時間の範囲（秒）
+        self.toleranceSec: int = header["toleranceSec"]
+
+    def __enter__(self) -> "PlanReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __iter__(self) -> Iterator[PlanEntry]:
+        for lineNum, line in enumerate(self._file, 2):
+            if not line.strip():
+                continue
+            try:
+                yield PlanEntry.fromDict(json.loads(line))
+            except (ValueError, KeyError, TypeError) as e:
+                raise InvalidPlanException(f"計画ファイルの{lineNum}行目が読み込めません:'{self.path}' {e}")
+
+
+class InvalidPlanException(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
@@ -0,0 +1,159 @@
+import dataclasses
+import math
+from typing import List, Optional, Sequence, Tuple
+
+from .location_index import LocationRecord, TimelineRecord
+
+
+_METERS_PER_E7 = math.pi / 180 * 6371008.8 / 10000000
+""" 緯度のE7値1あたりの距離（メートル） """
+
+_NOTHING: Tuple[TimelineRecord, ...] = ()
+""" 返すものが無いときの戻り値（点ごとにリストを作らない） """
+
+_DUPLICATE_MAX_INTERVAL_MS = 60 * 1000
+""" 重複とみなす点の時間差の上限（ミリ秒）。同じ場所でもこれより間があけば残し、照合できない時間帯を作らない。 """
+
+
+@dataclasses.dataclass(frozen=True)
+class RawLocationFilter:
+    """ 生のロケーション履歴（Records.jsonの`locations`）を読み込むときに間引く条件。0ならその間引きはしない。 """
+
+    # 精度（accuracy、メートル）がこれより悪い点を捨てる
+    maxAccuracyM: int = dataclasses.field(default=0)
+
+    # 直前に残した点からこの距離（メートル）以内の点は重複として捨てる
+    duplicateDistanceM: int = dataclasses.field(default=0)
+
+    # 最初の点からこの半径（メートル）以内に留まり続けた点の集まりを、1件の滞在にまとめる
+    stayRadiusM: int = dataclasses.field(default=0)
+
+    # 滞在にまとめる最短の時間（秒）
+    stayMinSec: int = dataclasses.field(default=0)
+
+
+class RawLocationDownsampler(object):
+    """ 生のロケーション履歴を1件ずつ受け取り、`rawFilter`に従って間引いたLocationRecordとVisitRecordを返す
+
+    点はファイルの並び（時刻順）で受け取る前提で、保持するのは滞在かどうかを判断している途中の点だけにする。
+    滞在とみなせる時間に達した集まりは、重心と最初・最後の時刻だけを保持する。
+    """
+
+    def __init__(self, rawFilter: RawLocationFilter):
+        self.rawFilter = rawFilter
+
+        # 距離の比較は、E7値の2乗で行う
+        self._duplicateE7Sq = (rawFilter.duplicateDistanceM / _METERS_PER_E7) ** 2
+        self._stayE7Sq = (rawFilter.stayRadiusM / _METERS_PER_E7) ** 2
+        self._stayMinMs = rawFilter.stayMinSec * 1000
+
+        # 直前に残した点（重複の判定に使う）
+        self._lastKept: Optional[LocationRecord] = None
+
+        # 滞在の候補となっている点の集まり（最初の点、経度方向の縮尺、最初と最後の時刻）
+        self._anchor: Optional[LocationRecord] = None
+        self._anchorCos = 1.0
+        self._clusterStartMs = 0
+        self._clusterEndMs = 0
+
+        # 滞在の候補の点。滞在とみなせる時間に達したら保持せず、最初の点からの差の合計だけを保持する。
+        self._clusterPoints: List[LocationRecord] = []
+        self._isStay = False
+        self._count = 0
+        self._latSum = 0
+        self._lonSum = 0
+
+    def push(self, record: LocationRecord, accuracy: Optional[int]) -> Sequence[TimelineRecord]:
+        """ 1件の点を受け取り、残すことが決まった点や滞在を返す
+
+        点の多くは捨てるか判断を保留するので、ジェネレーターではなくシーケンスを返す。
+        """
+
+        rawFilter = self.rawFilter
+        if rawFilter.maxAccuracyM > 0 and accuracy is not None and accuracy > rawFilter.maxAccuracyM:
+            return _NOTHING
+        if rawFilter.stayRadiusM <= 0 or rawFilter.stayMinSec <= 0:
+            return self._keep(record)
+
+        anchor = self._anchor
+        if anchor is not None and record[0] >= self._clusterEndMs:
+            dLat, dLon = _offsetE7(anchor, record)
+            if dLat * dLat + (dLon * self._anchorCos) ** 2 <= self._stayE7Sq:
+                self._addToCluster(record, dLat, dLon)
+                return _NOTHING
+
+        flushed = self.flush()
+        self._anchor = record
+        self._anchorCos = math.cos(math.radians(record[1] / 10000000))
+        self._clusterStartMs = record[0]
+        self._clusterEndMs = record[0]
+        self._clusterPoints.append(record)
+        self._count = 1
+        return flushed
+
+    def flush(self) -> Sequence[TimelineRecord]:
+        """ 判断を保留している点をすべて返す。ファイルの終わりで呼ぶ。 """
+
+        anchor = self._anchor
+        if anchor is None:
+            return _NOTHING
+        results: List[TimelineRecord] = []
+        if self._isStay:
+            # 滞在は重心の位置で1件にまとめる
+            count = self._count
+            lon = anchor[2] + round(self._lonSum / count)
+            if lon >= 1800000000:
+                lon -= 3600000000
+            elif lon < -1800000000:
+                lon += 3600000000
+            results.append(
+                (self._clusterStartMs, self._clusterEndMs, anchor[1] + round(self._latSum / count), lon, None))
+            self._lastKept = None
+        else:
+            for point in self._clusterPoints:
+                results.extend(self._keep(point))
+
+        self._anchor = None
+        self._clusterPoints = []
+        self._isStay = False
+        self._count = 0
+        self._latSum = 0
+        self._lonSum = 0
+        return results
+
+    def _addToCluster(self, record: LocationRecord, dLat: int, dLon: int) -> None:
+        self._clusterEndMs = record[0]
+        self._count += 1
+        self._latSum += dLat
+        self._lonSum += dLon
+        if self._isStay:
+            return
+        self._clusterPoints.append(record)
+        if record[0] - self._clusterStartMs >= self._stayMinMs:
+            # 滞在とみなせる時間に達したので、個々の点は保持しない
+            self._isStay = True
+            self._clusterPoints = []
+
+    def _keep(self, record: LocationRecord) -> Sequence[TimelineRecord]:
+        """ 直前に残した点と重複していなければ、点を残す """
+
+        lastKept = self._lastKept
+        if self.rawFilter.duplicateDistanceM > 0 and lastKept is not None \
+                and 0 <= record[0] - lastKept[0] <= _DUPLICATE_MAX_INTERVAL_MS:
+            dLat, dLon = _offsetE7(lastKept, record)
+            scale = math.cos(math.radians(lastKept[1] / 10000000))
+            if dLat * dLat + (dLon * scale) ** 2 <= self._duplicateE7Sq:
+                return _NOTHING
+        self._lastKept = record
+        return (record,)
+
+
+def _offsetE7(origin: LocationRecord, record: LocationRecord) -> Tuple[int, int]:
+    """ `origin`から`record`までの(緯度の差, 経度の差)をE7値で返す（経度は180度をまたぐ場合も近い方向の差） """
+
+    dLon = record[2] - origin[2]
+    if dLon > 1800000000:
+        dLon -= 3600000000
+    elif dLon < -1800000000:
+        dLon += 3600000000
+    return (record[1] - origin[1], dLon)
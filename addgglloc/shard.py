@@ -0,0 +1,33 @@
+import hashlib
+import os
+from typing import Tuple
+
+
+def parseShard(text: str) -> Tuple[int, int]:
+    """ "K/N"形式（1≦K≦N）の分割指定を解析し、(0から始まる番号, 分割数)を返す。形式が正しくなければValueErrorを送出する。 """
+
+    number, _, count = text.partition("/")
+    shardNumber = int(number)
+    shardCount = int(count)
+    if not (1 <= shardNumber <= shardCount):
+        raise ValueError(f"invalid shard:'{text}'")
+    return shardNumber - 1, shardCount
+
+
+def shardOf(relativePath: str, shardCount: int) -> int:
+    """ 相対パスが属する分割の番号（0から`shardCount`-1）を返す
+
+    どのマシン、どのプロセスでも同じ結果になるよう、Pythonのhash()ではなく
+    区切り文字を"/"にそろえたパスのハッシュ値を使う。
+    """
+
+    normalized = relativePath.replace(os.sep, "/")
+    digest = hashlib.blake2b(normalized.encode("utf-8", "surrogateescape"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shardCount
+
+
+def shardPath(path: str, shardIndex: int, shardCount: int) -> str:
+    """ 分割ごとのファイル名を返す。"results.jsonl"の2/4なら"results.shard2of4.jsonl"になる。 """
+
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shardIndex + 1}of{shardCount}{ext}"
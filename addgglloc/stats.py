@@ -0,0 +1,121 @@
+import contextlib
+import json
+import time
+from typing import Any, Dict, Iterator, List
+
+
+_HISTOGRAM_BUCKETS = 32
+""" 処理時間のヒストグラムの区分数。k番目の区分は2^(k-1)マイクロ秒以上2^kマイクロ秒未満（0番目は1マイクロ秒未満）。 """
+
+
+class StageStats(object):
+    """ 1つの段階の処理時間の集計 """
+
+    def __init__(self) -> None:
+        # 計測回数
+        self.count = 0
+
+        # 処理時間の合計（秒）
+        self.totalSec = 0.0
+
+        # 処理時間の最大値（秒）
+        self.maxSec = 0.0
+
+        # 処理時間の対数ヒストグラム
+        self.histogram: List[int] = [0] * _HISTOGRAM_BUCKETS
+
+    def add(self, seconds: float) -> None:
+        """ 処理時間を1回分加える """
+        self.count += 1
+        self.totalSec += seconds
+        self.maxSec = max(self.maxSec, seconds)
+        bucket = min(int(seconds * 1000000).bit_length(), _HISTOGRAM_BUCKETS - 1)
+        self.histogram[bucket] += 1
+
+    def toDict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "totalSec": self.totalSec,
+            "meanSec": self.totalSec / self.count if self.count > 0 else 0.0,
+            "maxSec": self.maxSec,
+            # 件数のある区分だけを"<上限us"をキーにして出力する
+            "histogram": {f"<{1 << bucket}us": count for bucket, count in enumerate(self.histogram) if count > 0},
+        }
+
+
+class StageTimer(object):
+    """ 1つの処理の中で、段階ごとの処理時間と読み書きしたバイト数などを測る
+
+    測った値はpickleできる辞書で保持するので、プロセスプールのワーカーから返すことができる。
+    """
+
+    def __init__(self) -> None:
+        # 段階ごとの処理時間（秒）
+        self.timings: Dict[str, float] = {}
+
+        # カウンタ
+        self.counters: Dict[str, int] = {}
+
+    @contextlib.contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        """ withブロックの処理時間を`stage`の時間として加える """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - start
+
+    def count(self, name: str, value: int = 1) -> None:
+        """ カウンタを加算する """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+
+class RunStats(object):
+    """ 1回の実行全体の統計（段階ごとの処理時間、カウンタ、処理結果の内訳） """
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, StageStats] = {}
+        self.counters: Dict[str, int] = {}
+        self.statuses: Dict[str, int] = {}
+
+    @contextlib.contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        """ withブロックの処理時間を`stage`の1回分として加える """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addTiming(stage, time.perf_counter() - start)
+
+    def addTiming(self, stage: str, seconds: float) -> None:
+        """ 段階の処理時間を1回分加える """
+        stageStats = self.stages.get(stage)
+        if stageStats is None:
+            stageStats = self.stages[stage] = StageStats()
+        stageStats.add(seconds)
+
+    def addTimings(self, timings: Dict[str, float]) -> None:
+        """ StageTimerで測った処理時間を、それぞれの段階の1回分として加える """
+        for stage, seconds in timings.items():
+            self.addTiming(stage, seconds)
+
+    def count(self, name: str, value: int = 1) -> None:
+        """ カウンタを加算する """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def countStatus(self, status: str) -> None:
+        """ 処理結果の件数を加算する """
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def toDict(self) -> Dict[str, Any]:
+        return {
+            "stages": {stage: stageStats.toDict() for stage, stageStats in self.stages.items()},
+            "counters": dict(self.counters),
+            "statuses": dict(self.statuses),
+        }
+
+    def write(self, path: str) -> None:
+        """ 統計をJSONファイルに書き出す """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.toDict(), f, indent=2, ensure_ascii=False)
+            f.write("\n")
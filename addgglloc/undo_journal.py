@@ -0,0 +1,109 @@
+import dataclasses
+import datetime
+import os
+import sqlite3
+import threading
+from typing import List
+
+
+@dataclasses.dataclass
+class JournalEntry:
+    """ 書き換えたJPEGファイル1つ分の、元に戻すための情報 """
+
+    # 書き換えたファイルのパス
+    path: str
+
+    # 書き換えた直後のファイルサイズ
+    size: int
+
+    # 書き換えた直後の更新日時（ナノ秒）
+    mtimeNs: int
+
+    # 書き換えた範囲の開始位置
+    offset: int
+
+    # 書き換えた後の範囲の長さ（新しいExifのAPP1セグメントの長さ）
+    length: int
+
+    # 書き換える前の範囲の内容（元のAPP1セグメントなど）
+    original: bytes
+
+    def isUnchanged(self, stat: os.stat_result) -> bool:
+        """ ファイルが書き換えた直後から変わっていなければTrueを返す """
+        return self.size == stat.st_size and self.mtimeNs == stat.st_mtime_ns
+
+
+class UndoJournal(object):
+    """ 元のファイルを書き換えたときに、置き換える前のセグメントを記録するSQLiteのジャーナル
+
+    画像データは変えないので、記録するのは置き換えた範囲の元の内容（数KB〜64KB程度）だけで済む。
+    元のファイルを置き換える前に1件ずつコミットする。
+    複数のスレッドから使えるよう、操作はロックで直列化する。
+    """
+
+    def __init__(self, path: str):
+        # ジャーナルファイルのパス
+        self.path = path
+
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._lock = threading.Lock()
+        # プロセスプールの各ワーカーも同じファイルに書き込むので、ロック待ちを許す
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtimeNs INTEGER NOT NULL,"
+            " offset INTEGER NOT NULL,"
+            " length INTEGER NOT NULL,"
+            " original BLOB NOT NULL,"
+            " updatedAt TEXT NOT NULL"
+            ")"
+        )
+        self._connection.commit()
+
+    def __enter__(self) -> "UndoJournal":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """ ジャーナルを閉じる """
+        with self._lock:
+            self._connection.close()
+
+    def record(self, path: str, stat: os.stat_result, offset: int, length: int, original: bytes) -> None:
+        """ 1ファイル分の元に戻すための情報を記録してコミットする
+
+        `stat`は書き換えた後のファイル（置き換える前の一時ファイル）のもの。
+        """
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries"
+                " (path, size, mtimeNs, offset, length, original, updatedAt)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    path, stat.st_size, stat.st_mtime_ns, offset, length, original,
+                    datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                )
+            )
+            self._connection.commit()
+
+    def entries(self) -> List[JournalEntry]:
+        """ 記録されているすべての情報を返す """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, size, mtimeNs, offset, length, original FROM entries ORDER BY path"
+            ).fetchall()
+        return [JournalEntry(*row) for row in rows]
+
+    def remove(self, path: str) -> None:
+        """ 元に戻したファイルの情報を削除する """
+        with self._lock:
+            self._connection.execute("DELETE FROM entries WHERE path = ?", (path,))
+            self._connection.commit()
@@ -0,0 +1,211 @@
+import abc
+import ctypes
+import ctypes.util
+import errno
+from logging import getLogger
+import os
+import select
+import struct
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from . import NAME_LOGER
+from .file_walker import walkFiles
+
+
+logger = getLogger(NAME_LOGER)
+
+# inotifyの定数（linux/inotify.h）
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE_SELF | _IN_MOVE_SELF
+""" 監視するイベント """
+
+_EVENT_HEADER = struct.Struct("iIII")
+""" inotify_eventの固定長部分（wd, mask, cookie, len） """
+
+
+class DirectoryWatcher(abc.ABC):
+    """ ディレクトリ配下で追加・変更されたファイルを通知する
+
+    書き込み中のファイルを拾わないよう、最後に変化してから`settleSec`秒たったファイルだけを返す。
+    """
+
+    def __init__(self, roots: Sequence[str], extensions: Tuple[str, ...], settleSec: float):
+        self.roots = list(roots)
+        self.extensions = extensions
+        self.settleSec = settleSec
+
+        # 変化を検知したファイルと、最後に変化した時刻
+        self._pending: Dict[str, float] = {}
+
+    @abc.abstractmethod
+    def poll(self, timeoutSec: float) -> List[str]:
+        """ 最大`timeoutSec`秒待ち、落ち着いた（変化が止まった）ファイルを返す """
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "DirectoryWatcher":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _touch(self, path: str) -> None:
+        if os.path.splitext(path)[1].lower() in self.extensions:
+            self._pending[path] = time.monotonic()
+
+    def _settled(self) -> List[str]:
+        now = time.monotonic()
+        settled = [path for path, touched in self._pending.items() if now - touched >= self.settleSec]
+        for path in settled:
+            del self._pending[path]
+        return settled
+
+    def _untilSettled(self, timeoutSec: float) -> float:
+        """ 次にファイルが落ち着くまでの時間（最大`timeoutSec`秒）を返す """
+        if not self._pending:
+            return timeoutSec
+        earliest = min(self._pending.values()) + self.settleSec - time.monotonic()
+        return max(0.0, min(timeoutSec, earliest))
+
+
+class InotifyWatcher(DirectoryWatcher):
+    """ Linuxのinotifyでディレクトリを監視する
+
+    inotifyが使えない環境や、監視数の上限に達した場合はOSErrorを送出する。
+    """
+
+    def __init__(self, roots: Sequence[str], extensions: Tuple[str, ...], settleSec: float):
+        super().__init__(roots, extensions, settleSec)
+
+        libcName = ctypes.util.find_library("c")
+        if libcName is None:
+            raise OSError(errno.ENOSYS, "libc not found")
+        self._libc = ctypes.CDLL(libcName, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs: Dict[int, str] = {}
+        try:
+            for root in self.roots:
+                self._addTree(root, notifyFiles=False)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def poll(self, timeoutSec: float) -> List[str]:
+        readable, _, _ = select.select([self._fd], [], [], self._untilSettled(timeoutSec))
+        if readable:
+            self._readEvents()
+        return self._settled()
+
+    def _addTree(self, root: str, notifyFiles: bool) -> None:
+        """ ディレクトリとその配下のディレクトリを監視対象にする """
+        for curDir, _, _ in os.walk(root):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(curDir), _WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed:'{curDir}'")
+            self._dirs[wd] = curDir
+        if notifyFiles:
+            # 監視を始める前にできたファイルを取りこぼさないよう、中身を変化したものとして扱う
+            for path in walkFiles(root, self.extensions):
+                self._touch(path)
+
+    def _readEvents(self) -> None:
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        pos = 0
+        while pos + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, pos)
+            name = os.fsdecode(data[pos + _EVENT_HEADER.size:pos + _EVENT_HEADER.size + length].rstrip(b"\0"))
+            pos += _EVENT_HEADER.size + length
+
+            if mask & _IN_Q_OVERFLOW:
+                # イベントを取りこぼしたので、すべてのファイルを変化したものとして扱う
+                logger.warning("ファイルの変更通知があふれたため、監視対象を走査し直します。")
+                for root in self.roots:
+                    for path in walkFiles(root, self.extensions):
+                        self._touch(path)
+                continue
+            if mask & _IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+
+            curDir = self._dirs.get(wd)
+            if curDir is None or not name:
+                continue
+            path = os.path.join(curDir, name)
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    try:
+                        self._addTree(path, notifyFiles=True)
+                    except OSError as e:
+                        logger.warning(f"ディレクトリを監視できませんでした:'{path}' {e}")
+                continue
+            self._touch(path)
+
+
+class PollingWatcher(DirectoryWatcher):
+    """ 一定間隔でディレクトリを走査し、ファイルのサイズと更新日時の変化を検知する """
+
+    def __init__(self, roots: Sequence[str], extensions: Tuple[str, ...], settleSec: float, intervalSec: float):
+        super().__init__(roots, extensions, settleSec)
+        self.intervalSec = intervalSec
+        self._snapshot = self._scan()
+        self._nextScan = time.monotonic() + intervalSec
+
+    def poll(self, timeoutSec: float) -> List[str]:
+        waitSec = min(self._untilSettled(timeoutSec), max(0.0, self._nextScan - time.monotonic()))
+        time.sleep(waitSec)
+        if time.monotonic() >= self._nextScan:
+            snapshot = self._scan()
+            for path, stat in snapshot.items():
+                if self._snapshot.get(path) != stat:
+                    self._touch(path)
+            self._snapshot = snapshot
+            self._nextScan = time.monotonic() + self.intervalSec
+        return self._settled()
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        snapshot: Dict[str, Tuple[int, int]] = {}
+        for root in self.roots:
+            for path in walkFiles(root, self.extensions):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+
+def createWatcher(roots: Sequence[str], extensions: Tuple[str, ...], settleSec: float,
+                  pollIntervalSec: float) -> DirectoryWatcher:
+    """ inotifyで監視するDirectoryWatcherを返す。使えなければ定期的に走査するものを返す。 """
+    try:
+        return InotifyWatcher(roots, extensions, settleSec)
+    except OSError as e:
+        logger.info(f"inotifyを使えないため、{pollIntervalSec}秒ごとに走査して監視します。({e})")
+        return PollingWatcher(roots, extensions, settleSec, pollIntervalSec)
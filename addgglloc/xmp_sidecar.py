@@ -0,0 +1,85 @@
+import datetime
+import os
+from typing import List, Tuple
+from xml.sax.saxutils import quoteattr
+
+from .location_log import LocationLog
+
+
+_SIDECAR_EXTENSION = ".xmp"
+""" サイドカーファイルの拡張子 """
+
+_MICRO_MINUTES_PER_DEGREE = 60 * 1000000
+""" 座標を分の1/1000000単位の整数で丸めるための係数 """
+
+_TEMP_SUFFIX = ".addgglloc-tmp"
+""" 書き込み中のサイドカーファイルに付ける接尾辞 """
+
+
+def sidecarPath(imagePath: str, naming: str) -> str:
+    """ 画像ファイルに対応するサイドカーファイルのパスを返す
+
+    `naming`が"replace"なら拡張子を置き換え（IMG_0001.xmp。Lightroomなど）、
+    "append"なら拡張子の後に付け加える（IMG_0001.jpg.xmp。darktableなど）。
+    """
+
+    if naming == "append":
+        return imagePath + _SIDECAR_EXTENSION
+    return os.path.splitext(imagePath)[0] + _SIDECAR_EXTENSION
+
+
+def buildXmp(locationLog: LocationLog) -> bytes:
+    """ 位置情報をExifのGPSプロパティとして記述したXMPを返す """
+
+    properties: List[Tuple[str, str]] = [
+        ("exif:GPSVersionID", "2.2.0.0"),
+        ("exif:GPSLatitude", _coordinate(locationLog.lat, "N", "S")),
+        ("exif:GPSLongitude", _coordinate(locationLog.lon, "E", "W")),
+        ("exif:GPSMapDatum", "WGS-84"),
+        ("exif:GPSTimeStamp", _timestamp(locationLog.timestamp)),
+    ]
+    if locationLog.areaInformation is not None:
+        properties.append(("exif:GPSAreaInformation", locationLog.areaInformation))
+
+    attributes = "".join(f"\n    {name}={quoteattr(value)}" for name, value in properties)
+    xmp = (
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="addgglloc">\n'
+        ' <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+        '  <rdf:Description rdf:about=""\n'
+        '    xmlns:exif="http://ns.adobe.com/exif/1.0/"'
+        f'{attributes}/>\n'
+        ' </rdf:RDF>\n'
+        '</x:xmpmeta>\n'
+    )
+    return xmp.encode("utf-8")
+
+
+def writeSidecar(path: str, data: bytes) -> None:
+    """ サイドカーファイルを書き出す。書き込み途中のファイルが見えないよう、一時ファイルから置き換える。 """
+
+    tempPath = path + _TEMP_SUFFIX
+    try:
+        with open(tempPath, "wb") as f:
+            f.write(data)
+        os.replace(tempPath, path)
+    finally:
+        if os.path.lexists(tempPath):
+            os.remove(tempPath)
+
+
+def _coordinate(degree: float, positiveRef: str, negativeRef: str) -> str:
+    """ XMPのGPSCoordinate形式（"度,分.分の小数部"と方位）の文字列を返す """
+
+    ref = positiveRef if degree >= 0 else negativeRef
+    # 分の小数部を丸めたときに60分へ繰り上がらないよう、整数で丸めてから度と分に分ける
+    total = round(abs(degree) * _MICRO_MINUTES_PER_DEGREE)
+    deg, microMinutes = divmod(total, _MICRO_MINUTES_PER_DEGREE)
+    minutes, fraction = divmod(microMinutes, 1000000)
+    return f"{deg},{minutes}.{fraction:06d}{ref}"
+
+
+def _timestamp(timestamp: datetime.datetime) -> str:
+    """ UTCの日時をミリ秒までのISO 8601形式で返す """
+
+    utc = timestamp.astimezone(datetime.timezone.utc)
+    return f"{utc:%Y-%m-%dT%H:%M:%S}.{utc.microsecond // 1000:03d}Z"
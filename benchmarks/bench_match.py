@@ -0,0 +1,196 @@
+""" 撮影時間と位置情報の照合（LocationMatcher.matchMany）のマイクロベンチマーク
+
+リポジトリのルートで以下を実行すると、2分探索でたどり着いた1点だけを調べる従来の照合と、
+前後の点と最も近い滞在を調べる現在の照合（照合方法ごと）とで、まとめて照合する速度（件/秒）を比較して表示します。
+nearestの結果は、すべての点と滞在を調べる総当たりの結果と一致することも確認します。
+
+    python -m benchmarks.bench_match [--points N] [--visits N] [--queries N] [--repeat N]
+"""
+
+import argparse
+from bisect import bisect_left, bisect_right
+import datetime
+import functools
+import random
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+from addgglloc.location_index import EPOCH, NO_NAME, LocationIndex, LocationIndexBuilder
+from addgglloc.location_log import LocationLog
+from addgglloc.location_matcher import MATCH_STRATEGIES, LocationMatcher
+
+
+_TOLERANCE_MS = 5 * 60 * 1000
+""" 撮影時間と位置情報を紐付ける時間の範囲（AddGglLocのデフォルト値と同じ） """
+
+
+def _buildIndex(points: int, visits: int) -> LocationIndex:
+    """ 移動中の点と滞在が交互に現れる索引を作成する """
+
+    rand = random.Random(0)
+    builder = LocationIndexBuilder()
+    currentMs = 1514764800000
+    visitEvery = max(1, points // max(1, visits))
+    for i in range(points):
+        currentMs += rand.randint(10, 600) * 1000
+        builder.append(currentMs, rand.randint(340000000, 360000000), rand.randint(1380000000, 1400000000))
+        if i % visitEvery == visitEvery - 1:
+            # 前後の点との間に少し間をあけて滞在する
+            startMs = currentMs + rand.randint(0, 20) * 60000
+            endMs = startMs + rand.randint(10, 240) * 60000
+            builder.appendVisit(startMs, endMs, 350000000, 1390000000, f"place{i % 50}")
+            currentMs = endMs + rand.randint(0, 20) * 60000
+    return builder.build()
+
+
+class _LegacyMatcher(object):
+    """ 従来の照合（AddGglLoc.matchManyと_matchAt、VisitIndex.find、LocationIndex.get、msToDatetime）
+
+    2分探索でたどり着いた1点だけを調べ、滞在は到着の前の許容範囲から出発までを調べる。
+    点の探索は、列形式の索引にする前の2分探索と同じ手順で行う（撮影時間の前後どちらの点にたどり着くかも同じ）。
+    """
+
+    def __init__(self, locationIndex: LocationIndex, toleranceSec: int):
+        self.locationIndex = locationIndex
+        self.toleranceSec = toleranceSec
+
+    def matchMany(self, timestampsMs: Sequence[int]) -> List[Optional[LocationLog]]:
+        results: List[Optional[LocationLog]] = [None] * len(timestampsMs)
+        for i, timestampMs in enumerate(timestampsMs):
+            results[i] = self._matchAt(timestampMs)
+        return results
+
+    def _matchAt(self, shootingMs: int) -> Optional[LocationLog]:
+        locationIndex = self.locationIndex
+        toleranceMs = self.toleranceSec * 1000
+
+        center: Optional[int] = None
+        delta = 0
+        if len(locationIndex) > 0:
+            center = self._search(shootingMs)
+            delta = locationIndex.timestamps[center] - shootingMs
+            if delta > toleranceMs:
+                center = None
+
+        visits = locationIndex.visits
+        visit = self._findVisit(shootingMs, toleranceMs)
+        if visit is not None:
+            visitDelta = max(visits.starts[visit] - shootingMs, 0)
+            if center is None or visitDelta <= abs(delta):
+                nameId = visits.nameIds[visit]
+                return LocationLog(
+                    timestamp=_legacyMsToDatetime(min(max(shootingMs, visits.starts[visit]), visits.ends[visit])),
+                    lat=visits.lats[visit] / 10000000,
+                    lon=visits.lons[visit] / 10000000,
+                    areaInformation=None if nameId == NO_NAME else visits.names[nameId],
+                )
+
+        if center is None:
+            return None
+        nameId = locationIndex.nameIds[center]
+        return LocationLog(
+            timestamp=_legacyMsToDatetime(locationIndex.timestamps[center]),
+            lat=locationIndex.lats[center] / 10000000,
+            lon=locationIndex.lons[center] / 10000000,
+            areaInformation=None if nameId == NO_NAME else locationIndex.names[nameId],
+        )
+
+    def _search(self, shootingMs: int) -> int:
+        """ 2分探索で最後に調べた位置を返す（撮影時間と一致する点が無ければ、前後どちらの点にもなり得る） """
+
+        timestamps = self.locationIndex.timestamps
+        left = 0
+        right = len(timestamps) - 1
+        center = 0
+        while (left <= right):
+            center = left + int((right - left) / 2)
+            centerMs = timestamps[center]
+            if centerMs == shootingMs:
+                break
+            if shootingMs > centerMs:
+                left = center + 1
+            else:
+                right = center - 1
+        return center
+
+    def _findVisit(self, timestampMs: int, toleranceMs: int) -> Optional[int]:
+        visits = self.locationIndex.visits
+        last = bisect_right(visits.starts, timestampMs + toleranceMs) - 1
+        if last < 0:
+            return None
+        if visits.ends[last] >= timestampMs:
+            return last
+        if visits.maxEnds[last] < timestampMs:
+            return None
+        return bisect_left(visits.maxEnds, timestampMs, 0, last)
+
+
+def _legacyMsToDatetime(ms: int) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(milliseconds=ms)
+
+
+def _bruteForceDelta(locationIndex: LocationIndex, timestampMs: int) -> Optional[int]:
+    """ すべての点と滞在を調べ、許容範囲内で最も近いものとの時間差を返す """
+
+    visits = locationIndex.visits
+    deltas = [abs(t - timestampMs) for t in locationIndex.timestamps]
+    deltas += [max(visits.starts[i] - timestampMs, timestampMs - visits.ends[i], 0) for i in range(len(visits))]
+    best = min(deltas, default=None)
+    return best if best is not None and best <= _TOLERANCE_MS else None
+
+
+def _measure(funcs: Dict[str, Callable[[], object]], count: int, repeat: int) -> Dict[str, float]:
+    """ 照合速度（件/秒）を計測し、それぞれ最速の値を返す
+
+    CPUのクロックの変動などが偏らないよう、1回ごとにすべての照合を順番に実行する。
+    """
+
+    best = {name: 0.0 for name in funcs}
+    for _ in range(repeat):
+        for name, func in funcs.items():
+            start = time.perf_counter()
+            func()
+            best[name] = max(best[name], count / (time.perf_counter() - start))
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--points", type=int, default=500000, help="位置情報の点の数")
+    parser.add_argument("--visits", type=int, default=20000, help="滞在の数")
+    parser.add_argument("--queries", type=int, default=200000, help="照合する撮影時間の数")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（最速の値を採用）")
+    args = parser.parse_args()
+
+    locationIndex = _buildIndex(args.points, args.visits)
+    rand = random.Random(1)
+    firstMs = locationIndex.timestamps[0]
+    lastMs = locationIndex.timestamps[-1]
+    queries = [rand.randint(firstMs, lastMs) for _ in range(args.queries)]
+
+    # nearestの結果が総当たりと一致することを、一部の撮影時間で確認しておく
+    nearest = LocationMatcher(locationIndex, _TOLERANCE_MS, "nearest").matchMany(queries)
+    for timestampMs, match in list(zip(queries, nearest))[:200]:
+        assert _bruteForceDelta(locationIndex, timestampMs) == (None if match is None else match.deltaMs)
+
+    print(f"points:\t{len(locationIndex)}")
+    print(f"visits:\t{len(locationIndex.visits)}")
+    print(f"queries:\t{len(queries)}")
+
+    legacy = _LegacyMatcher(locationIndex, _TOLERANCE_MS // 1000)
+    matchers = {strategy: LocationMatcher(locationIndex, _TOLERANCE_MS, strategy) for strategy in MATCH_STRATEGIES}
+    funcs: Dict[str, Callable[[], object]] = {"before (single point)": functools.partial(legacy.matchMany, queries)}
+    for strategy, matcher in matchers.items():
+        funcs[f"after ({strategy})"] = functools.partial(matcher.matchMany, queries)
+    speeds = _measure(funcs, len(queries), args.repeat)
+
+    before = speeds["before (single point)"]
+    matched = sum(1 for locationLog in legacy.matchMany(queries) if locationLog is not None)
+    print(f"before (single point):\t{before:,.0f} matches/sec\tmatched {matched}")
+    for strategy, matcher in matchers.items():
+        after = speeds[f"after ({strategy})"]
+        matched = sum(1 for match in matcher.matchMany(queries) if match is not None)
+        print(f"after ({strategy}):\t{after:,.0f} matches/sec\tmatched {matched}\tspeedup {after / before:.2f}x")
+
+if __name__ == "__main__":
+    main()
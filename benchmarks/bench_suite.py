@@ -0,0 +1,348 @@
+""" AddGglLocの処理全体と各段階のベンチマーク
+
+合成したロケーション履歴ファイル(JSON)とJPEGファイルを作成し、以下の段階を計測して結果をJSONで出力します。
+
+    load     ロケーション履歴の読み込み（_loadLocationLogs）
+    match    撮影時間と位置情報の照合（_matchLocationLogを1件ずつ呼ぶ場合とmatchMany）
+    process  JPEGファイルへの位置情報の付与と書き出し（_processFiles）
+    execute  AddGglLoc.execute全体
+
+各段階は新しいプロセスで実行し、そのプロセスの最大RSSも記録します。
+合成データは`--seed`が同じなら毎回同じ内容になるので、コミット間で結果を比較できます。
+リポジトリのルートで以下を実行してください。
+
+    python -m benchmarks.bench_suite [--years N] [--points-per-day N] [--visits-per-day N]
+        [--visit-minutes N] [--jpegs N] [--jpeg-kb N] [--matches N] [--workers N]
+        [--stages load,match,process,execute] [--repeat N] [--data-dir DIR] [--output FILE]
+"""
+
+import argparse
+import calendar
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import json
+from logging import WARNING, getLogger
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import piexif
+
+from addgglloc import NAME_LOGER
+from addgglloc.addgglloc import AddGglLoc
+
+try:
+    import resource
+except ImportError:
+    # Windowsにはresourceモジュールが無い
+    resource = None
+
+
+STAGES = ("load", "match", "process", "execute")
+""" 計測する段階 """
+
+_JST = datetime.timezone(datetime.timedelta(hours=9))
+""" 撮影時間（DateTimeOriginal）のタイムゾーン """
+
+
+def _formatTimestamp(dt: datetime.datetime, rand: random.Random) -> str:
+    """ ロケーション履歴ファイルと同じ形式のタイムスタンプにする（ミリ秒があったりなかったりする） """
+    timestamp = dt.strftime("%Y-%m-%dT%H:%M:%S")
+    return timestamp + (f".{dt.microsecond // 1000:03d}Z" if rand.random() < 0.7 else "Z")
+
+
+def _randomPoint(rand: random.Random) -> Dict[str, int]:
+    return {"latE7": rand.randint(340000000, 360000000), "lngE7": rand.randint(1380000000, 1400000000)}
+
+
+def _writeTimelines(baseDir: str, args: argparse.Namespace) -> Dict[str, int]:
+    """ 月ごとのロケーション履歴ファイル（YYYY/YYYY_MONTH.json）を作成し、件数を返す """
+
+    rand = random.Random(args.seed)
+    start = datetime.datetime(2018, 1, 1, tzinfo=datetime.timezone.utc)
+    end = start.replace(year=start.year + args.years)
+    slotSec = 86400 / args.visits_per_day
+    pointsPerSlot = max(1, args.points_per_day // args.visits_per_day)
+
+    counts = {"files": 0, "bytes": 0, "points": 0, "visits": 0}
+    month = start
+    while month < end:
+        nextMonth = (month + datetime.timedelta(days=32)).replace(day=1)
+        timelineObjects: List[Dict[str, Any]] = []
+        slotStart = month
+        while slotStart < nextMonth:
+            # 滞在のあとに移動が続く
+            visitSec = min(args.visit_minutes * 60 * rand.uniform(0.5, 1.5), slotSec * 0.9)
+            visitEnd = slotStart + datetime.timedelta(seconds=visitSec)
+            point = _randomPoint(rand)
+            timelineObjects.append({"placeVisit": {
+                "location": {"latitudeE7": point["latE7"], "longitudeE7": point["lngE7"],
+                             "name": f"Place {rand.randint(0, 999)}"},
+                "duration": {"startTimestamp": _formatTimestamp(slotStart, rand),
+                             "endTimestamp": _formatTimestamp(visitEnd, rand)},
+            }})
+            counts["visits"] += 1
+
+            moveSec = slotSec - visitSec
+            points = []
+            for i in range(pointsPerSlot):
+                pointTime = visitEnd + datetime.timedelta(
+                    seconds=moveSec * (i + rand.random()) / pointsPerSlot)
+                points.append(dict(_randomPoint(rand), timestamp=_formatTimestamp(pointTime, rand)))
+            timelineObjects.append({"activitySegment": {
+                "startLocation": {},
+                "endLocation": {},
+                "duration": {},
+                "simplifiedRawPath": {"points": points},
+            }})
+            counts["points"] += len(points)
+
+            slotStart += datetime.timedelta(seconds=slotSec)
+
+        path = os.path.join(baseDir, str(month.year),
+                            f"{month.year}_{calendar.month_name[month.month].upper()}.json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"timelineObjects": timelineObjects}, f)
+        counts["files"] += 1
+        counts["bytes"] += os.path.getsize(path)
+        month = nextMonth
+
+    return counts
+
+
+def _writeJpegs(baseDir: str, args: argparse.Namespace) -> Dict[str, int]:
+    """ 撮影時間がロケーション履歴の期間に散らばったJPEGファイルを作成し、件数を返す """
+
+    rand = random.Random(args.seed + 1)
+    start = datetime.datetime(2018, 1, 1, tzinfo=_JST)
+    spanSec = int((start.replace(year=start.year + args.years) - start).total_seconds())
+
+    # 画像データ部分は全ファイルで共通にする（0xFFを含めるとマーカーと誤認されるので除く）
+    imageData = bytes(rand.randrange(0, 255) for _ in range(args.jpeg_kb * 1024))
+
+    counts = {"files": 0, "bytes": 0}
+    for i in range(args.jpegs):
+        shootingDateTime = start + datetime.timedelta(seconds=rand.randrange(spanSec))
+        exifBytes = piexif.dump({
+            "0th": {piexif.ImageIFD.Make: b"Bench", piexif.ImageIFD.Model: b"Synthetic"},
+            "Exif": {piexif.ExifIFD.DateTimeOriginal: shootingDateTime.strftime("%Y:%m:%d %H:%M:%S").encode()},
+            "GPS": {},
+            "1st": {},
+            "thumbnail": None,
+        })
+        body = b"\xff\xd8" \
+            + b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00" \
+            + b"\xff\xe1" + struct.pack(">H", len(exifBytes) + 2) + exifBytes \
+            + b"\xff\xdb" + struct.pack(">H", 67) + b"\x00" + bytes(range(64)) \
+            + b"\xff\xda" + struct.pack(">H", 8) + b"\x01\x01\x00\x00\x3f\x00" + imageData \
+            + b"\xff\xd9"
+
+        path = os.path.join(baseDir, f"{i // 1000:04d}", f"IMG_{i:07d}.jpg")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(body)
+        counts["files"] += 1
+        counts["bytes"] += len(body)
+
+    return counts
+
+
+def _peakRssBytes() -> Optional[int]:
+    """ このプロセスの最大RSS（バイト）を返す。取得できなければNoneを返す。 """
+    if resource is None:
+        return None
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト、それ以外はキロバイト単位
+    return maxRss if sys.platform == "darwin" else maxRss * 1024
+
+
+def _newAddGglLoc(dataDir: str, workers: int) -> AddGglLoc:
+    getLogger(NAME_LOGER).setLevel(WARNING)
+    addGglLoc = AddGglLoc()
+    addGglLoc.jpegInputDir = os.path.join(dataDir, "picture")
+    addGglLoc.googleLocationLogDir = os.path.join(dataDir, "google")
+    addGglLoc.outputDir = os.path.join(dataDir, "output")
+    addGglLoc.workers = workers
+    return addGglLoc
+
+
+def _benchLoad(dataDir: str, args: argparse.Namespace) -> Dict[str, Any]:
+    addGglLoc = _newAddGglLoc(dataDir, args.workers)
+    best = float("inf")
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        locationIndex = addGglLoc._loadLocationLogs(addGglLoc.googleLocationLogDir)
+        best = min(best, time.perf_counter() - start)
+    return {
+        "seconds": best,
+        "points": len(locationIndex),
+        "visits": len(locationIndex.visits),
+    }
+
+
+def _benchMatch(dataDir: str, args: argparse.Namespace) -> Dict[str, Any]:
+    addGglLoc = _newAddGglLoc(dataDir, args.workers)
+    locationIndex = addGglLoc._loadLocationLogs(addGglLoc.googleLocationLogDir)
+
+    rand = random.Random(args.seed + 2)
+    start = datetime.datetime(2018, 1, 1, tzinfo=_JST)
+    spanSec = int((start.replace(year=start.year + args.years) - start).total_seconds())
+    shootingDateTimes = [start + datetime.timedelta(seconds=rand.randrange(spanSec))
+                         for _ in range(args.matches)]
+
+    bestSingle = float("inf")
+    bestMany = float("inf")
+    for _ in range(args.repeat):
+        begin = time.perf_counter()
+        single = [addGglLoc._matchLocationLog(locationIndex, dt) for dt in shootingDateTimes]
+        bestSingle = min(bestSingle, time.perf_counter() - begin)
+
+        begin = time.perf_counter()
+        many = addGglLoc.matchMany(locationIndex, shootingDateTimes)
+        bestMany = min(bestMany, time.perf_counter() - begin)
+
+    assert single == many
+    return {
+        "matches": args.matches,
+        "matched": sum(1 for locationLog in many if locationLog is not None),
+        "matchesPerSec": args.matches / bestSingle,
+        "matchManyPerSec": args.matches / bestMany,
+    }
+
+
+def _benchProcess(dataDir: str, args: argparse.Namespace) -> Dict[str, Any]:
+    addGglLoc = _newAddGglLoc(dataDir, args.workers)
+    locationIndex = addGglLoc._loadLocationLogs(addGglLoc.googleLocationLogDir)
+    jpegFiles = addGglLoc._listJpegFiles(addGglLoc.jpegInputDir)
+
+    best = float("inf")
+    statuses: Dict[str, int] = {}
+    for _ in range(args.repeat):
+        shutil.rmtree(addGglLoc.outputDir, ignore_errors=True)
+        statuses = {}
+        start = time.perf_counter()
+        for _, result in addGglLoc._processFiles(locationIndex, jpegFiles, None):
+            statuses[result.status] = statuses.get(result.status, 0) + 1
+        best = min(best, time.perf_counter() - start)
+    return {
+        "seconds": best,
+        "files": len(jpegFiles),
+        "filesPerSec": len(jpegFiles) / best,
+        "statuses": statuses,
+    }
+
+
+def _benchExecute(dataDir: str, args: argparse.Namespace) -> Dict[str, Any]:
+    addGglLoc = _newAddGglLoc(dataDir, args.workers)
+    best = float("inf")
+    for _ in range(args.repeat):
+        shutil.rmtree(addGglLoc.outputDir, ignore_errors=True)
+        start = time.perf_counter()
+        addGglLoc.execute()
+        best = min(best, time.perf_counter() - start)
+    return {
+        "seconds": best,
+        "filesPerSec": args.jpegs / best,
+    }
+
+
+_BENCHMARKS: Dict[str, Callable[[str, argparse.Namespace], Dict[str, Any]]] = {
+    "load": _benchLoad,
+    "match": _benchMatch,
+    "process": _benchProcess,
+    "execute": _benchExecute,
+}
+
+
+def _runStage(stage: str, dataDir: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """ 1段階分を計測する（計測用のプロセス内で呼ばれる） """
+    result = _BENCHMARKS[stage](dataDir, args)
+    result["peakRssBytes"] = _peakRssBytes()
+    return result
+
+
+def _gitCommit() -> Optional[str]:
+    """ 計測対象のコミットを返す。gitが使えなければNoneを返す。 """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=1, help="ロケーション履歴の年数")
+    parser.add_argument("--points-per-day", type=int, default=300, help="1日あたりの移動中のポイント数")
+    parser.add_argument("--visits-per-day", type=int, default=4, help="1日あたりの滞在数")
+    parser.add_argument("--visit-minutes", type=int, default=180, help="滞在時間の平均（分）")
+    parser.add_argument("--jpegs", type=int, default=500, help="JPEGファイル数")
+    parser.add_argument("--jpeg-kb", type=int, default=256, help="JPEGファイル1つの画像データの大きさ（KB）")
+    parser.add_argument("--matches", type=int, default=100000, help="matchで照合する撮影時間の数")
+    parser.add_argument("--workers", type=int, default=1, help="JPEGファイルを処理する並列数")
+    parser.add_argument("--stages", type=str, default=",".join(STAGES), help="計測する段階（カンマ区切り）")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（最速の値を採用）")
+    parser.add_argument("--seed", type=int, default=0, help="合成データの乱数シード")
+    parser.add_argument("--data-dir", type=str, default=None,
+                        help="合成データを作成するディレクトリ（省略時は一時ディレクトリを使い、終了時に削除する）")
+    parser.add_argument("--output", type=str, default=None, help="結果のJSONの出力先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    stages = [stage for stage in args.stages.split(",") if stage]
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error(f"unknown stage: {stage}")
+
+    tempDir = None
+    dataDir = args.data_dir
+    if dataDir is None:
+        tempDir = tempfile.TemporaryDirectory()
+        dataDir = tempDir.name
+
+    try:
+        start = time.perf_counter()
+        shutil.rmtree(os.path.join(dataDir, "google"), ignore_errors=True)
+        shutil.rmtree(os.path.join(dataDir, "picture"), ignore_errors=True)
+        dataset = {
+            "timeline": _writeTimelines(os.path.join(dataDir, "google"), args),
+            "jpeg": _writeJpegs(os.path.join(dataDir, "picture"), args),
+            "generateSeconds": time.perf_counter() - start,
+        }
+
+        # 段階ごとに新しいプロセスで計測し、最大RSSが前の段階の影響を受けないようにする
+        results: Dict[str, Any] = {}
+        context = multiprocessing.get_context("spawn")
+        for stage in stages:
+            with ProcessPoolExecutor(1, mp_context=context) as pool:
+                results[stage] = pool.submit(_runStage, stage, dataDir, args).result()
+    finally:
+        if tempDir is not None:
+            tempDir.cleanup()
+
+    report = {
+        "commit": _gitCommit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("data_dir", "output")},
+        "dataset": dataset,
+        "stages": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+""" GoogleLocationLogLoaderのタイムスタンプ解釈のマイクロベンチマーク
+
+リポジトリのルートで以下を実行すると、strptimeによる従来の解釈と現在の解釈とで
+ロケーション履歴ファイルの読み込み速度（ポイント/秒）を比較して表示します。
+
+    python -m benchmarks.bench_timestamp [--points N] [--repeat N]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Type
+
+from addgglloc.google_location_log_loader import GoogleLocationLogLoader
+from addgglloc.location_index import datetimeToMs
+
+
+class _LegacyLoader(GoogleLocationLogLoader):
+    """ タイムスタンプをstrptimeで解釈する、従来の読み込み処理 """
+
+    @staticmethod
+    def _convertTimestamp(timestampStr: str) -> int:
+        try:
+            dt = datetime.datetime.strptime(timestampStr, "%Y-%m-%dT%H:%M:%S.%f%z")
+        except ValueError:
+            dt = datetime.datetime.strptime(timestampStr, "%Y-%m-%dT%H:%M:%S%z")
+        return datetimeToMs(dt)
+
+
+def _writeTimeline(path: str, points: int) -> None:
+    """ `points`個のポイントを含むロケーション履歴ファイルを作成する """
+
+    rand = random.Random(0)
+    current = datetime.datetime(2018, 4, 1, tzinfo=datetime.timezone.utc)
+    timelineObjects = []
+    while points > 0:
+        count = min(points, 100)
+        pathPoints = []
+        for _ in range(count):
+            current += datetime.timedelta(seconds=rand.randint(10, 120), milliseconds=rand.randint(0, 999))
+            # 実際の履歴と同じく、ミリ秒があったりなかったりする
+            timestamp = current.strftime("%Y-%m-%dT%H:%M:%S")
+            timestamp += f".{current.microsecond // 1000:03d}Z" if rand.random() < 0.7 else "Z"
+            pathPoints.append({
+                "latE7": rand.randint(340000000, 360000000),
+                "lngE7": rand.randint(1380000000, 1400000000),
+                "timestamp": timestamp,
+            })
+        timelineObjects.append({"activitySegment": {
+            "startLocation": {},
+            "endLocation": {},
+            "duration": {},
+            "simplifiedRawPath": {"points": pathPoints},
+        }})
+        points -= count
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"timelineObjects": timelineObjects}, f)
+
+
+def _measure(loader: Type[GoogleLocationLogLoader], path: str, repeat: int) -> float:
+    """ 読み込み速度（ポイント/秒）を計測し、最速の値を返す """
+
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = sum(1 for _ in loader.load(path))
+        best = max(best, count / (time.perf_counter() - start))
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--points", type=int, default=200000, help="ポイント数")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（最速の値を採用）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        path = os.path.join(tempDir, "timeline.json")
+        _writeTimeline(path, args.points)
+
+        # 両者の解釈結果が一致することを確認しておく
+        assert list(_LegacyLoader.load(path)) == list(GoogleLocationLogLoader.load(path))
+
+        before = _measure(_LegacyLoader, path, args.repeat)
+        after = _measure(GoogleLocationLogLoader, path, args.repeat)
+
+    print(f"points:\t{args.points}")
+    print(f"before (strptime):\t{before:,.0f} points/sec")
+    print(f"after:\t{after:,.0f} points/sec")
+    print(f"speedup:\t{after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    main()